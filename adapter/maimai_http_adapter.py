@@ -1,21 +1,30 @@
 import asyncio
+import base64
 import time
-import requests
 import tomllib
 from maim_message import (
     BaseMessageInfo, UserInfo, GroupInfo, MessageBase, Seg,
     Router, RouteConfig, TargetConfig
 )
 import os
+import sys
+from collections import OrderedDict, deque
 from loguru import logger
 import httpx
 import sqlite3
-from typing import Dict, Any, Optional
+from typing import Awaitable, Callable, Deque, Dict, Any, List, Optional, Tuple
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 class AdapterConfig:
     """适配器配置管理"""
     def __init__(self, config_path: str = 'config.toml'):
-        self.config_path = os.path.join(os.path.dirname(__file__), config_path)
+        # 可通过环境变量指定配置文件（如基准测试使用临时配置）
+        self.config_path = os.environ.get('MAIMBOT_ADAPTER_CONFIG') or os.path.join(os.path.dirname(__file__), config_path)
         self._config = self._load_config()
         
     def _load_config(self) -> Dict[str, Any]:
@@ -33,17 +42,34 @@ class AdapterConfig:
         return {
             'adapter': {
                 'platform_id': 'maimai_http_adapter',
-                'poll_interval': 2
+                'poll_interval': 2,
+                'feed': 'wait',
+                'wait_timeout': 30
             },
             'connection': {
                 'ws_url': 'ws://127.0.0.1:8000/ws',
                 'http_backend_url': 'http://127.0.0.1:8050'
             },
             'database': {
-                'db_path': '../http_server/backend/chat.db'
+                'db_path': 'adapter.db',
+                'mapping_cache_size': 10000,
+                'flush_interval': 1
             },
             'logging': {
                 'level': 'INFO'
+            },
+            'forwarding': {
+                'max_in_flight': 8,
+                'quantum': 1,
+                'report_interval': 60
+            },
+            'http_client': {
+                'timeout': 10,
+                'connect_timeout': 3,
+                'max_connections': 20,
+                'max_keepalive_connections': 10,
+                'keepalive_expiry': 30,
+                'http2': True
             }
         }
     
@@ -52,9 +78,19 @@ class AdapterConfig:
         return self._config['adapter']['platform_id']
     
     @property
-    def poll_interval(self) -> int:
+    def poll_interval(self) -> float:
         return self._config['adapter']['poll_interval']
     
+    @property
+    def feed(self) -> str:
+        """获取新消息的方式：wait 长轮询 /messages/wait，poll 每隔 poll_interval 秒轮询"""
+        return self._config['adapter'].get('feed', 'wait')
+    
+    @property
+    def wait_timeout(self) -> float:
+        """长轮询单次最长等待的秒数"""
+        return float(self._config['adapter'].get('wait_timeout', 30))
+    
     @property
     def ws_url(self) -> str:
         return self._config['connection']['ws_url']
@@ -67,6 +103,41 @@ class AdapterConfig:
     @property
     def db_path(self) -> str:
         return os.path.join(os.path.dirname(__file__), self._config['database']['db_path'])
+    
+    @property
+    def mapping_cache_size(self) -> int:
+        """内存中保留的会话映射数"""
+        return max(1, int(self._config['database'].get('mapping_cache_size', 10000)))
+    
+    @property
+    def mapping_flush_interval(self) -> float:
+        """新建的会话映射写入数据库的间隔（秒）"""
+        return float(self._config['database'].get('flush_interval', 1))
+    
+    @property
+    def log_level(self) -> str:
+        return self._config.get('logging', {}).get('level', 'INFO')
+    
+    @property
+    def forward_max_in_flight(self) -> int:
+        """同时转发到 MaiBot Core 的消息数上限"""
+        return max(1, int(self._config.get('forwarding', {}).get('max_in_flight', 8)))
+    
+    @property
+    def forward_quantum(self) -> int:
+        """每个会话每轮可连续转发的消息数"""
+        return max(1, int(self._config.get('forwarding', {}).get('quantum', 1)))
+    
+    @property
+    def forward_report_interval(self) -> float:
+        """输出各会话排队情况的间隔（秒），0 表示不输出"""
+        return float(self._config.get('forwarding', {}).get('report_interval', 60))
+    
+    @property
+    def http_client(self) -> Dict[str, Any]:
+        """访问HTTP后端的客户端配置（超时、连接池、HTTP/2）"""
+        defaults = self._get_default_config()['http_client']
+        return {**defaults, **self._config.get('http_client', {})}
 
 # 初始化配置
 config = AdapterConfig()
@@ -82,6 +153,45 @@ route_config = RouteConfig(
 
 router = Router(route_config)
 
+class HttpClientManager:
+    """共享的HTTP后端客户端，复用 keep-alive 连接，在 main() 中创建和关闭"""
+    
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """当前客户端，首次使用时创建"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_client()
+        return self._client
+    
+    @staticmethod
+    def _create_client() -> httpx.AsyncClient:
+        options = config.http_client
+        http2 = bool(options['http2']) and HTTP2_AVAILABLE
+        if options['http2'] and not HTTP2_AVAILABLE:
+            logger.info("[Adapter] 未安装 h2，HTTP后端客户端使用 HTTP/1.1")
+        return httpx.AsyncClient(
+            base_url=config.http_backend_url,
+            timeout=httpx.Timeout(options['timeout'], connect=options['connect_timeout']),
+            limits=httpx.Limits(
+                max_connections=options['max_connections'],
+                max_keepalive_connections=options['max_keepalive_connections'],
+                keepalive_expiry=options['keepalive_expiry']
+            ),
+            http2=http2
+        )
+    
+    async def close(self):
+        """关闭客户端及其连接池"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+# 初始化HTTP客户端管理器
+http_client = HttpClientManager()
+
 class MessageProcessor:
     """消息处理器"""
     
@@ -94,15 +204,42 @@ class MessageProcessor:
             if extra:
                 payload.update(extra)
             logger.info(f"[Adapter] 正在转发消息到后端: {payload}")
-            async with httpx.AsyncClient() as client:
-                await client.post(
-                    f"{config.http_backend_url}/messages",
-                    json=payload,
-                    timeout=5
-                )
+            await http_client.client.post("/messages", json=payload)
         except Exception as e:
             logger.error(f"[Adapter] 发送到后端失败: {e}")
     
+    @staticmethod
+    async def send_batch_to_backend(items: List[Dict[str, Any]]):
+        """批量发送消息到HTTP后端，所有消息在一次请求、一个事务中保存"""
+        if not items:
+            return
+        try:
+            logger.info(f"[Adapter] 正在批量转发 {len(items)} 条消息到后端")
+            resp = await http_client.client.post("/messages/batch", json=items)
+            result = resp.json()
+            for item in result.get('results', []):
+                if not item.get('success'):
+                    logger.warning(f"[Adapter] 后端保存消息失败: {item}")
+        except Exception as e:
+            logger.error(f"[Adapter] 批量发送到后端失败: {e}")
+    
+    @staticmethod
+    async def load_image_b64(msg: Dict[str, Any]) -> Optional[str]:
+        """
+        获取后端消息中的图片Base64，新消息的图片需从 /blobs 下载
+        
+        图片在后端已不存在（404）时返回 None；网络错误等暂时性失败直接抛出，由调用方重试。
+        """
+        if msg.get('image_b64'):
+            return msg['image_b64']
+        if not msg.get('image_url'):
+            return ''
+        resp = await http_client.client.get(msg['image_url'])
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return base64.b64encode(resp.content).decode('ascii')
+    
     @staticmethod
     def parse_maibot_message(message) -> Dict[str, Any]:
         """统一解析MaiBot Core消息"""
@@ -112,24 +249,31 @@ class MessageProcessor:
         nickname = None
         from_user = 'maimai'
         session_id = None
+        group_id = None
         
         # dict结构
         if isinstance(message, dict):
             segments = message.get('message_segment', [])
             if isinstance(segments, dict):
-                if segments.get('type') == 'text':
-                    text += segments.get('data', '')
-                elif segments.get('type') == 'image':
-                    image_b64 = segments.get('data', '')
-                    msg_type = 'image'
-            elif isinstance(segments, list):
+                segments = [segments]
+            # 展开 seglist（Core 回复通常是 seglist 包裹的多个片段）
+            while any(isinstance(seg, dict) and seg.get('type') == 'seglist' for seg in segments):
+                expanded = []
                 for seg in segments:
-                    if isinstance(seg, dict):
-                        if seg.get('type') == 'text':
-                            text += seg.get('data', '')
-                        elif seg.get('type') == 'image':
-                            image_b64 = seg.get('data', '')
-                            msg_type = 'image'
+                    if isinstance(seg, dict) and seg.get('type') == 'seglist':
+                        expanded.extend(seg.get('data') or [])
+                    else:
+                        expanded.append(seg)
+                segments = expanded
+            for seg in segments:
+                if isinstance(seg, dict):
+                    if seg.get('type') == 'text':
+                        text += seg.get('data', '')
+                    elif seg.get('type') == 'image':
+                        image_b64 = seg.get('data', '')
+                        msg_type = 'image'
+            group_info = (message.get('message_info') or {}).get('group_info') or {}
+            group_id = group_info.get('group_id')
         # MessageBase结构
         else:
             for seg in message.message_segment:
@@ -141,10 +285,15 @@ class MessageProcessor:
             if hasattr(message, 'message_info') and hasattr(message.message_info, 'user_info'):
                 nickname = "maimai"
                 from_user = 'maimai'
+            group_info = getattr(getattr(message, 'message_info', None), 'group_info', None)
+            group_id = getattr(group_info, 'group_id', None)
         
         # 尝试从 message.extra 取 session_id
         if hasattr(message, 'extra') and isinstance(message.extra, dict):
             session_id = message.extra.get('session_id')
+        # extra 不会经过 WebSocket 传输，Core 的回复按群组ID找回会话
+        if not session_id and group_id:
+            session_id = db_manager.get_session_id(str(group_id))
         
         return {
             'type': msg_type,
@@ -162,11 +311,14 @@ async def handle_from_maibot(message: MessageBase):
         logger.info(f"[MaiBot] 收到消息: {parsed}")
         # 取 session_id，优先 extra 里的
         session_id = parsed.get('session_id') or 'default'
-        extra = {'type': parsed['type']} if parsed['type'] == 'image' else {}
+        base = {"from_user": parsed['from_user'], "nickname": parsed['nickname'] or "web用户", "session_id": session_id}
+        # 文本与图片拆成两条消息，在一次批量请求中保存
+        items = []
+        if parsed['text']:
+            items.append({**base, "type": "text", "text": parsed['text']})
         if parsed['type'] == 'image' and parsed['image_b64']:
-            extra['image_b64'] = parsed['image_b64']
-        extra['session_id'] = session_id
-        await MessageProcessor.send_to_backend(parsed['text'], from_user=parsed['from_user'], nickname=parsed['nickname'], extra=extra)
+            items.append({**base, "type": "image", "text": "", "image_b64": parsed['image_b64']})
+        await MessageProcessor.send_batch_to_backend(items)
         logger.info(f"[Adapter] 正在转发MaiBot Core消息到后端: {parsed}")
     except Exception as e:
         logger.error(f"[Adapter] 处理MaiBot Core消息转发到后端时出错: {e}")
@@ -174,113 +326,543 @@ async def handle_from_maibot(message: MessageBase):
 router.register_class_handler(handle_from_maibot)
 
 class DatabaseManager:
-    """数据库管理器"""
+    """
+    数据库管理器
+    
+    使用适配器自己的数据库文件（不与后端的 chat.db 争用写锁），整个进程共用
+    一个 WAL 模式的连接。会话与群组的映射在启动时载入内存中的 LRU，转发消息时
+    查找映射不访问磁盘；新建的映射先放在内存中，由 flush_loop 批量写入。
+    """
+    
+    # 旧版本与后端共用的数据库，首次使用新数据库时从中迁移映射和转发进度
+    LEGACY_DB_PATH = os.path.join(os.path.dirname(__file__), '../http_server/backend/chat.db')
     
     def __init__(self):
         self.db_path = config.db_path
+        self.cache_size = config.mapping_cache_size
+        # 转发进度表是否在本次启动时新建（首次运行不转发历史消息）
+        self.offsets_created = False
+        self._conn: Optional[sqlite3.Connection] = None
+        # session_id -> group_id（LRU）及反向索引
+        self._groups: "OrderedDict[str, str]" = OrderedDict()
+        self._sessions: Dict[str, str] = {}
+        # 所有映射都在内存中时，未命中即说明数据库中也没有
+        self._complete = True
+        # 尚未写入数据库的新映射
+        self._pending: Dict[str, str] = {}
         self._init_db()
     
     def _init_db(self):
-        """初始化数据库"""
+        """初始化数据库并载入映射"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.execute('CREATE TABLE IF NOT EXISTS session_group (session_id TEXT PRIMARY KEY, group_id TEXT)')
-            conn.commit()
-            conn.close()
+            self._conn = sqlite3.connect(self.db_path)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            created = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='session_group'"
+            ).fetchone() is None
+            self._conn.execute('CREATE TABLE IF NOT EXISTS session_group (session_id TEXT PRIMARY KEY, group_id TEXT)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS session_group_group_id ON session_group (group_id)')
+            self.offsets_created = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='adapter_offsets'"
+            ).fetchone() is None
+            self._conn.execute('CREATE TABLE IF NOT EXISTS adapter_offsets (session_id TEXT PRIMARY KEY, last_id INTEGER NOT NULL)')
+            self._conn.commit()
+            if created:
+                self._migrate_legacy()
+            self._load_groups()
         except Exception as e:
             logger.error(f"初始化数据库失败: {e}")
     
+    def _migrate_legacy(self):
+        """从旧版本共用的 chat.db 迁移会话映射和转发进度"""
+        legacy = os.path.abspath(self.LEGACY_DB_PATH)
+        if legacy == os.path.abspath(self.db_path) or not os.path.exists(legacy):
+            return
+        try:
+            self._conn.execute('ATTACH DATABASE ? AS legacy', (legacy,))
+            try:
+                tables = {row[0] for row in self._conn.execute("SELECT name FROM legacy.sqlite_master WHERE type='table'")}
+                if 'session_group' in tables:
+                    self._conn.execute('INSERT OR IGNORE INTO session_group SELECT session_id, group_id FROM legacy.session_group')
+                if 'adapter_offsets' in tables:
+                    self._conn.execute('INSERT OR IGNORE INTO adapter_offsets SELECT session_id, last_id FROM legacy.adapter_offsets')
+                    self.offsets_created = False
+                self._conn.commit()
+            finally:
+                self._conn.execute('DETACH DATABASE legacy')
+            logger.info(f"已从 {legacy} 迁移会话映射与转发进度")
+        except Exception as e:
+            logger.error(f"迁移旧数据库失败: {e}")
+    
+    def _load_groups(self):
+        """启动时载入会话映射，超过缓存容量时只保留一部分"""
+        rows = self._conn.execute('SELECT session_id, group_id FROM session_group LIMIT ?', (self.cache_size + 1,)).fetchall()
+        self._complete = len(rows) <= self.cache_size
+        for session_id, group_id in rows[:self.cache_size]:
+            self._remember(session_id, group_id)
+        logger.info(f"已载入 {len(self._groups)} 个会话映射")
+    
+    def _remember(self, session_id: str, group_id: str):
+        """加入 LRU，超过容量时淘汰最久未使用的映射（未写入的映射保留在 _pending 中）"""
+        self._groups[session_id] = group_id
+        self._groups.move_to_end(session_id)
+        self._sessions[group_id] = session_id
+        while len(self._groups) > self.cache_size:
+            evicted_session, evicted_group = self._groups.popitem(last=False)
+            if self._sessions.get(evicted_group) == evicted_session:
+                del self._sessions[evicted_group]
+            self._complete = False
+    
+    def get_session_id(self, group_id: str) -> Optional[str]:
+        """根据群组ID查找会话ID"""
+        session_id = self._sessions.get(group_id)
+        if session_id is not None:
+            self._groups.move_to_end(session_id)
+            return session_id
+        for pending_session, pending_group in self._pending.items():
+            if pending_group == group_id:
+                return pending_session
+        if self._complete:
+            return None
+        try:
+            row = self._conn.execute('SELECT session_id FROM session_group WHERE group_id=?', (group_id,)).fetchone()
+            if row is None:
+                return None
+            self._remember(row[0], group_id)
+            return row[0]
+        except Exception as e:
+            logger.error(f"数据库操作失败: {e}")
+            return None
+    
     def get_or_create_group_id(self, session_id: str) -> str:
         """获取或创建群组ID"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cur = conn.execute('SELECT group_id FROM session_group WHERE session_id=?', (session_id,))
-            row = cur.fetchone()
-            if row:
-                conn.close()
-                return row[0]
+        group_id = self._groups.get(session_id) or self._pending.get(session_id)
+        if group_id is None and not self._complete:
+            try:
+                row = self._conn.execute('SELECT group_id FROM session_group WHERE session_id=?', (session_id,)).fetchone()
+                group_id = row[0] if row else None
+            except Exception as e:
+                logger.error(f"数据库操作失败: {e}")
+                return session_id
+        if group_id is None:
             group_id = session_id  # 你也可以用 uuid 或自增ID
-            conn.execute('INSERT INTO session_group (session_id, group_id) VALUES (?, ?)', (session_id, group_id))
-            conn.commit()
-            conn.close()
-            return group_id
+            self._pending[session_id] = group_id
+        self._remember(session_id, group_id)
+        return group_id
+    
+    def flush(self):
+        """把新建的会话映射批量写入数据库"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            with self._conn:
+                self._conn.executemany(
+                    'INSERT OR IGNORE INTO session_group (session_id, group_id) VALUES (?, ?)',
+                    list(pending.items())
+                )
         except Exception as e:
-            logger.error(f"数据库操作失败: {e}")
-            return session_id
+            logger.error(f"保存会话映射失败: {e}")
+            # 下次重试，期间新建的映射优先
+            self._pending = {**pending, **self._pending}
+    
+    async def flush_loop(self, interval: float):
+        """定期写入新建的会话映射"""
+        while True:
+            await asyncio.sleep(interval)
+            self.flush()
+    
+    def close(self):
+        """写入剩余的映射并关闭连接"""
+        self.flush()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+    
+    def get_offsets(self) -> Dict[str, int]:
+        """各会话已转发到MaiBot Core的最后一条消息ID"""
+        try:
+            rows = self._conn.execute('SELECT session_id, last_id FROM adapter_offsets').fetchall()
+            return {session_id: last_id for session_id, last_id in rows}
+        except Exception as e:
+            logger.error(f"读取转发进度失败: {e}")
+            return {}
+    
+    def save_offsets(self, offsets: Dict[str, int]):
+        """保存转发进度，只会向前推进"""
+        if not offsets:
+            return
+        try:
+            with self._conn:
+                self._conn.executemany(
+                    'INSERT INTO adapter_offsets (session_id, last_id) VALUES (?, ?) '
+                    'ON CONFLICT(session_id) DO UPDATE SET last_id = MAX(last_id, excluded.last_id)',
+                    list(offsets.items())
+                )
+        except Exception as e:
+            logger.error(f"保存转发进度失败: {e}")
+    
+    def reset_offset(self, session_id: str):
+        """清除会话的转发进度（会话的消息被清空后从头转发）"""
+        try:
+            with self._conn:
+                self._conn.execute('DELETE FROM adapter_offsets WHERE session_id=?', (session_id,))
+        except Exception as e:
+            logger.error(f"清除转发进度失败: {e}")
 
 # 初始化数据库管理器
 db_manager = DatabaseManager()
 
+class ForwardScheduler:
+    """
+    按会话公平调度的转发队列（差额轮询 DRR）
+    
+    每个会话一个先进先出队列，轮到某个会话时它最多连续转发 quantum 条消息，
+    然后排到队尾，单个会话积压再多也不会推迟其他会话的消息。同一会话同时
+    只有一条消息在转发，保证会话内的顺序；所有会话合计最多 max_in_flight 条。
+    
+    转发失败的消息放回会话队首，该会话暂停并按指数退避重试，成功之前该会话
+    后面的消息不会转发（转发进度也不会越过失败的消息）。
+    """
+    
+    RETRY_BASE_DELAY = 1.0
+    RETRY_MAX_DELAY = 60.0
+    
+    def __init__(self, send: Callable[[str, Any], Awaitable[None]], max_in_flight: int, quantum: int):
+        self._send = send
+        self.max_in_flight = max_in_flight
+        self.quantum = quantum
+        self._queues: Dict[str, Deque[Tuple[float, Any]]] = {}
+        # 有待转发消息且没有消息在转发的会话，按轮转顺序排列
+        self._ready: Deque[str] = deque()
+        self._deficit: Dict[str, int] = {}
+        self._in_flight: set = set()
+        # 等待重试的会话及其连续失败次数
+        self._paused: set = set()
+        self._failures: Dict[str, int] = {}
+        self._tasks: set = set()
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._wakeup = asyncio.Event()
+        # 上次报告以来各会话的转发数与排队耗时
+        self._stats: Dict[str, Dict[str, float]] = {}
+    
+    @property
+    def pending(self) -> int:
+        """排队中的消息总数"""
+        return sum(len(queue) for queue in self._queues.values())
+    
+    def has_pending(self, session_id: str) -> bool:
+        """会话是否有排队中、正在转发或等待重试的消息"""
+        return bool(self._queues.get(session_id)) or session_id in self._in_flight or session_id in self._paused
+    
+    def enqueue(self, session_id: str, item: Any):
+        """把消息加入会话的队列"""
+        queue = self._queues.get(session_id)
+        if queue is None:
+            queue = self._queues[session_id] = deque()
+        queue.append((time.monotonic(), item))
+        if len(queue) == 1 and session_id not in self._in_flight and session_id not in self._paused:
+            self._ready.append(session_id)
+            self._wakeup.set()
+    
+    async def run(self):
+        """按轮转顺序取出消息并转发"""
+        while True:
+            await self._slots.acquire()
+            while not self._ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            session_id = self._ready.popleft()
+            if self._deficit.get(session_id, 0) <= 0:
+                # 新的一轮，补充额度
+                self._deficit[session_id] = self.quantum
+            self._deficit[session_id] -= 1
+            enqueued_at, item = self._queues[session_id].popleft()
+            self._in_flight.add(session_id)
+            task = asyncio.create_task(self._forward(session_id, enqueued_at, item))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    async def _forward(self, session_id: str, enqueued_at: float, item: Any):
+        wait = time.monotonic() - enqueued_at
+        retry_delay = None
+        try:
+            await self._send(session_id, item)
+            self._failures.pop(session_id, None)
+            self._record(session_id, wait)
+        except Exception as e:
+            failures = self._failures.get(session_id, 0) + 1
+            self._failures[session_id] = failures
+            retry_delay = min(self.RETRY_MAX_DELAY, self.RETRY_BASE_DELAY * 2 ** (failures - 1))
+            logger.error(f"[Adapter] 转发会话 {session_id} 的消息出错（第 {failures} 次）: {e}，{retry_delay:.1f}s 后重试")
+        finally:
+            self._in_flight.discard(session_id)
+            self._slots.release()
+            if retry_delay is not None:
+                # 放回队首并暂停该会话，结束本轮
+                self._queues.setdefault(session_id, deque()).appendleft((enqueued_at, item))
+                self._deficit.pop(session_id, None)
+                self._paused.add(session_id)
+                asyncio.get_running_loop().call_later(retry_delay, self._resume, session_id)
+            elif self._queues.get(session_id):
+                # 本轮额度未用完时继续轮到该会话，否则排到队尾
+                if self._deficit.get(session_id, 0) > 0:
+                    self._ready.appendleft(session_id)
+                else:
+                    self._ready.append(session_id)
+                self._wakeup.set()
+            else:
+                self._queues.pop(session_id, None)
+                self._deficit.pop(session_id, None)
+    
+    def _resume(self, session_id: str):
+        """退避结束，会话重新参与轮转"""
+        self._paused.discard(session_id)
+        if self._queues.get(session_id) and session_id not in self._in_flight:
+            self._ready.append(session_id)
+            self._wakeup.set()
+    
+    def _record(self, session_id: str, wait: float):
+        stats = self._stats.setdefault(session_id, {'forwarded': 0, 'wait_total': 0.0, 'wait_max': 0.0})
+        stats['forwarded'] += 1
+        stats['wait_total'] += wait
+        stats['wait_max'] = max(stats['wait_max'], wait)
+    
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """各会话的队列深度、最早一条消息已等待的秒数，以及上次报告以来的转发数与排队耗时"""
+        now = time.monotonic()
+        result = {}
+        for session_id in set(self._queues) | set(self._stats):
+            queue = self._queues.get(session_id)
+            stats = self._stats.get(session_id, {})
+            forwarded = stats.get('forwarded', 0)
+            result[session_id] = {
+                'depth': len(queue) if queue else 0,
+                'oldest_wait': now - queue[0][0] if queue else 0.0,
+                'forwarded': forwarded,
+                'avg_wait': stats['wait_total'] / forwarded if forwarded else 0.0,
+                'max_wait': stats.get('wait_max', 0.0),
+            }
+        return result
+    
+    def report(self):
+        """输出各会话的排队情况并重置统计"""
+        snapshot = self.snapshot()
+        self._stats.clear()
+        if not snapshot:
+            return
+        logger.info(f"[Adapter] 转发队列: {self.pending} 条排队, {len(self._in_flight)} 条转发中")
+        for session_id, item in sorted(snapshot.items(), key=lambda kv: -kv[1]['depth']):
+            logger.info(
+                f"[Adapter]   会话 {session_id}: 排队 {item['depth']} 条 (最早已等待 {item['oldest_wait']:.2f}s), "
+                f"已转发 {item['forwarded']} 条, 平均等待 {item['avg_wait']:.3f}s, 最长等待 {item['max_wait']:.3f}s"
+            )
+    
+    async def report_loop(self, interval: float):
+        """定期输出排队情况"""
+        if interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            self.report()
+
 class MessagePoller:
     """消息轮询器"""
     
+    # 机器人自己发出的消息，由后端过滤掉，防止循环转发
+    BOT_USER = "maimai"
+    SESSION_PAGE_SIZE = 100
+    MESSAGE_PAGE_SIZE = 200
+    
     def __init__(self):
-        self.last_message_count = 0
+        # 各会话已拉取（加入转发队列）的最后一条消息ID，启动时从数据库恢复
+        self.offsets: Optional[Dict[str, int]] = None
+        # 长轮询 /messages/wait 的游标，None 表示需要重新获取并补拉
+        self.feed_cursor: Optional[str] = None
+        self.feed_reset = False
+        self.use_feed = config.feed == 'wait'
+        self.scheduler = ForwardScheduler(self.forward_message, config.forward_max_in_flight, config.forward_quantum)
     
-    async def poll_and_send(self):
-        """轮询http后端新消息并转发到MaiBot Core"""
-        try:
-            resp = requests.get(f"{config.http_backend_url}/messages")
+    @staticmethod
+    async def build_message(msg: Dict[str, Any], group_id: str) -> Optional[MessageBase]:
+        """把后端消息转换为发往MaiBot Core的消息，空消息返回 None，图片下载失败时抛出异常"""
+        user_info = UserInfo(platform=config.platform_id, user_id=msg.get("from_user", "web"), user_nickname=msg.get("nickname") or "web用户")
+        group_info = GroupInfo(platform=config.platform_id, group_id=group_id, group_name=f"会话{group_id}")
+        message_info = BaseMessageInfo(
+            platform=config.platform_id,
+            message_id=str(time.time()),
+            time=time.time(),
+            user_info=user_info,
+            group_info=group_info,
+            format_info={"content_format": ["text"], "accept_format": ["text", "image"]}
+        )
+        
+        # 适配图片消息
+        image_b64 = await MessageProcessor.load_image_b64(msg) if msg.get('type') == 'image' else ''
+        if image_b64 is None:
+            # 图片已被删除（如数据被清空），重试也无法恢复
+            logger.warning(f"[Adapter] 图片已不存在，跳过消息: {msg.get('image_url')}")
+            return None
+        if image_b64:
+            seg = Seg("seglist", [Seg("image", image_b64)])
+        elif (msg.get('type') == 'image' or (msg.get('text') and msg.get('text', '').startswith('/9j'))) and msg.get('text'):
+            # 兼容type缺失但text为b64图片的情况
+            seg = Seg("seglist", [Seg("image", msg["text"])])
+        elif msg.get('type') == 'text' or msg.get('text'):
+            seg = Seg("seglist", [Seg("text", msg["text"])])
+        else:
+            # 兜底：空消息不转发
+            logger.warning(f"[Adapter] 跳过空消息: {msg}")
+            return None
+        return MessageBase(message_info=message_info, message_segment=seg)
+    
+    async def forward_message(self, session_id: str, msg: Dict[str, Any]):
+        """转发一条消息到MaiBot Core（由调度器调用），成功后记录转发进度"""
+        group_id = db_manager.get_or_create_group_id(session_id)
+        message = await self.build_message(msg, group_id)
+        if message is not None:
+            # 在 message 对象中附加 session_id，便于下游回传
+            if not hasattr(message, 'extra'):
+                message.extra = {}
+            message.extra['session_id'] = session_id
+            await router.send_message(message)
+        db_manager.save_offsets({session_id: msg['id']})
+    
+    async def _list_sessions(self, complete: bool = False) -> List[Dict[str, Any]]:
+        """
+        从 /sessions 按最近活跃分页获取会话
+        
+        complete 为 False 时，某一页中没有会话出现新消息就停止翻页（更早活跃的会话不会有新消息）。
+        """
+        sessions = []
+        offset = 0
+        while True:
+            resp = await http_client.client.get(
+                "/sessions", params={"sort": "recent", "limit": self.SESSION_PAGE_SIZE, "offset": offset}
+            )
+            resp.raise_for_status()
+            data = resp.json()
+            page = data.get('sessions', [])
+            sessions.extend(page)
+            if data.get('next_offset') is None:
+                break
+            if not complete and not any(self._has_new_messages(item) for item in page):
+                break
+            offset = data['next_offset']
+        return sessions
+    
+    def _has_new_messages(self, session: Dict[str, Any]) -> bool:
+        return (session.get('last_message_id') or 0) > self.offsets.get(session['session_id'], 0)
+    
+    async def _load_offsets(self):
+        """恢复各会话的转发进度；首次运行时从各会话当前最新的消息开始，不转发历史消息"""
+        offsets = db_manager.get_offsets()
+        if db_manager.offsets_created and not offsets:
+            sessions = await self._list_sessions(complete=True)
+            offsets = {item['session_id']: item.get('last_message_id') or 0 for item in sessions}
+            db_manager.save_offsets(offsets)
+            logger.info(f"[Adapter] 首次运行，从 {len(offsets)} 个会话的最新消息开始转发")
+        else:
+            logger.info(f"[Adapter] 恢复 {len(offsets)} 个会话的转发进度")
+        db_manager.offsets_created = False
+        self.offsets = offsets
+    
+    async def _poll_session(self, session_id: str):
+        """拉取会话中上次之后的新消息并加入转发队列"""
+        after_id = self.offsets.get(session_id, 0)
+        while True:
+            resp = await http_client.client.get("/messages", params={
+                "session_id": session_id,
+                "after_id": after_id,
+                "limit": self.MESSAGE_PAGE_SIZE,
+                "exclude_from_user": self.BOT_USER,
+            })
+            resp.raise_for_status()
             msgs = resp.json()
-            self.last_message_count = len(msgs) if isinstance(msgs, list) else 0
-        except Exception as e:
-            logger.error(f"[Adapter] 启动时获取消息失败: {e}")
-            self.last_message_count = 0
+            for msg in msgs:
+                self.scheduler.enqueue(session_id, msg)
+            # 游标会越过被排除的消息
+            after_id = max(after_id, int(resp.headers.get("X-Next-Cursor") or (msgs[-1]['id'] if msgs else 0)))
+            self.offsets[session_id] = after_id
+            if resp.headers.get("X-Has-More") != "true":
+                break
+        if not self.scheduler.has_pending(session_id):
+            # 没有待转发的消息时直接记录进度（只有被排除的消息）
+            db_manager.save_offsets({session_id: after_id})
+    
+    async def _poll_sessions(self, resync: bool = False):
+        """
+        按转发进度拉取所有有新消息的会话
         
+        resync 为 True 时（后端数据被清空后）读取全部会话，并清除已不存在的会话的转发进度。
+        """
+        sessions = await self._list_sessions(complete=resync)
+        if resync:
+            existing = {item['session_id'] for item in sessions}
+            for session_id in list(self.offsets):
+                if session_id not in existing and not self.scheduler.has_pending(session_id):
+                    self.offsets.pop(session_id)
+                    db_manager.reset_offset(session_id)
+        for session in sessions:
+            session_id = session['session_id']
+            if ((session.get('last_message_id') or 0) < self.offsets.get(session_id, 0)
+                    and not self.scheduler.has_pending(session_id)):
+                # 消息ID回退说明后端数据已被清空，新消息的ID会从头分配
+                logger.warning(f"[Adapter] 会话 {session_id} 的消息已被清空，重新开始转发")
+                self.offsets.pop(session_id, None)
+                db_manager.reset_offset(session_id)
+            if self._has_new_messages(session):
+                await self._poll_session(session_id)
+    
+    async def _wait_feed(self):
+        """长轮询 /messages/wait，把返回的新消息按会话加入转发队列"""
+        params = {"limit": self.MESSAGE_PAGE_SIZE, "exclude_from_user": self.BOT_USER}
+        if self.feed_cursor is not None:
+            params.update(after_id=self.feed_cursor, timeout=config.wait_timeout)
+        resp = await http_client.client.get(
+            "/messages/wait", params=params,
+            timeout=config.wait_timeout + config.http_client['timeout']
+        )
+        if resp.status_code == 404:
+            logger.warning("[Adapter] 后端不支持 /messages/wait，改为定时轮询")
+            self.use_feed = False
+            return
+        resp.raise_for_status()
+        data = resp.json()
+        if data.get('reset'):
+            # 后端数据被清空，重新获取游标并按会话补拉（会同时重置转发进度）
+            self.feed_cursor = None
+            self.feed_reset = True
+            return
+        for msg in data.get('messages', []):
+            session_id = msg.get('session_id') or 'default'
+            # 补拉与长轮询可能返回同一条消息，按转发进度去重
+            if msg['id'] > self.offsets.get(session_id, 0):
+                self.scheduler.enqueue(session_id, msg)
+                self.offsets[session_id] = msg['id']
+        self.feed_cursor = data['next_cursor']
+    
+    async def poll_and_send(self):
+        """获取http后端各会话的新消息，按会话加入转发队列"""
         while True:
             try:
-                resp = requests.get(f"{config.http_backend_url}/messages")
-                msgs = resp.json()
-                if not isinstance(msgs, list):
-                    logger.warning(f"[Adapter] /messages 返回内容不是列表: {msgs}")
-                    await asyncio.sleep(config.poll_interval)
+                if self.offsets is None:
+                    await self._load_offsets()
+                if self.use_feed and self.feed_cursor is None:
+                    # 先取得当前游标再补拉，补拉期间写入的消息由之后的长轮询返回
+                    await self._wait_feed()
+                    await self._poll_sessions(resync=self.feed_reset)
+                    self.feed_reset = False
                     continue
-                
-                if self.last_message_count < 0 or self.last_message_count > len(msgs):
-                    self.last_message_count = 0
-                
-                for msg in msgs[self.last_message_count:]:
-                    # 跳过自己发出的消息，防止循环转发
-                    if (msg.get("nickname") == "maimai") or (msg.get("from_user") == "maimai"):
-                        continue
-                    
-                    session_id = msg.get("session_id", "default")
-                    group_id = db_manager.get_or_create_group_id(session_id)
-                    user_info = UserInfo(platform=config.platform_id, user_id=msg.get("from_user", "web"), user_nickname=msg.get("nickname") or "web用户")
-                    group_info = GroupInfo(platform=config.platform_id, group_id=group_id, group_name=f"会话{group_id}")
-                    message_info = BaseMessageInfo(
-                        platform=config.platform_id,
-                        message_id=str(time.time()),
-                        time=time.time(),
-                        user_info=user_info,
-                        group_info=group_info,
-                        format_info={"content_format": ["text"], "accept_format": ["text", "image"]}
-                    )
-                    
-                    # 适配图片消息
-                    if msg.get('type') == 'image' and msg.get('image_b64'):
-                        seg = Seg("seglist", [Seg("image", msg["image_b64"])])
-                    elif (msg.get('type') == 'image' or (msg.get('text') and msg.get('text', '').startswith('/9j'))) and msg.get('text'):
-                        # 兼容type缺失但text为b64图片的情况
-                        seg = Seg("seglist", [Seg("image", msg["text"])])
-                    elif msg.get('type') == 'text' or msg.get('text'):
-                        seg = Seg("seglist", [Seg("text", msg["text"])])
-                    else:
-                        if msg.get('type') or msg.get('text') == "":
-                            # 兜底：空消息不转发
-                            logger.warning(f"[Adapter] 跳过空消息: {msg}")
-                            continue
-                    
-                    message = MessageBase(message_info=message_info, message_segment=seg)
-                    # 在 message 对象中附加 session_id，便于下游回传
-                    if not hasattr(message, 'extra'):
-                        message.extra = {}
-                    message.extra['session_id'] = session_id
-                    await router.send_message(message)
-                
-                self.last_message_count = len(msgs)
+                if self.use_feed:
+                    # 没有新消息时在后端等待，不需要再间隔轮询
+                    await self._wait_feed()
+                    continue
+                await self._poll_sessions()
             except Exception as e:
                 logger.error(f"[Adapter] 轮询或转发消息出错: {e}")
+                self.feed_cursor = None
             await asyncio.sleep(config.poll_interval)
 
 # 初始化消息轮询器
@@ -303,12 +885,20 @@ def send_message_to_maibot(text: str, user_id: str = "cli"):
 
 async def main():
     """主函数"""
+    logger.remove()
+    logger.add(sys.stderr, level=config.log_level)
     router_task = asyncio.create_task(router.run())
     poll_task = asyncio.create_task(poller.poll_and_send())
-    await asyncio.gather(router_task, poll_task)
+    forward_task = asyncio.create_task(poller.scheduler.run())
+    report_task = asyncio.create_task(poller.scheduler.report_loop(config.forward_report_interval))
+    flush_task = asyncio.create_task(db_manager.flush_loop(config.mapping_flush_interval))
+    try:
+        await asyncio.gather(router_task, poll_task, forward_task, report_task, flush_task)
+    finally:
+        await http_client.close()
+        db_manager.close()
 
 if __name__ == "__main__":
-    import sys
     if len(sys.argv) > 1:
         # 命令行发送消息到MaiBot Core
         send_message_to_maibot(' '.join(sys.argv[1:]))
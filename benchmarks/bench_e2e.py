@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+端到端延迟与吞吐基准测试
+
+完整链路: 浏览器 POST /messages -> 后端 -> 适配器 MessagePoller -> Core
+WebSocket -> handle_from_maibot -> 后端 -> 浏览器（WebSocket 推送）。
+
+测试启动三个组件：
+- 后端：子进程运行 http_server/main.py（生产模式，使用临时数据目录）
+- 适配器：子进程运行 adapter/maimai_http_adapter.py（临时配置文件）
+- Core：进程内的 fake_core.FakeCore，收到消息后回显
+
+每个模拟会话通过 WebSocket 订阅消息并发送带编号的消息，收到对应回显的
+时间减去发送时间即为往返延迟。结果以 JSON 输出（延迟分位数、吞吐、
+各进程 CPU 与内存），便于在版本间对比。
+
+依赖: maim_message、websockets、httpx；psutil（可选，用于统计资源占用）
+
+用法:
+    python benchmarks/bench_e2e.py --sessions 1 --messages 200
+    python benchmarks/bench_e2e.py --sessions 8 --messages 100 --rate 5 --workers 2 --output e2e.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import httpx
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_core import ECHO_PREFIX, FakeCore  # noqa: E402
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+BENCH_PREFIX = 'bench '
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """最近秩法计算分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def wait_for_port(port: int, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"端口 {port} 在 {timeout} 秒内未就绪")
+
+
+def write_adapter_config(path: str, args: argparse.Namespace, data_dir: str) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"""[adapter]
+platform_id = "maimai_http_adapter"
+poll_interval = {args.poll_interval}
+
+[connection]
+ws_url = "ws://127.0.0.1:{args.core_port}/ws"
+http_backend_url = "http://127.0.0.1:{args.backend_port}"
+
+[database]
+db_path = {json.dumps(os.path.join(data_dir, 'adapter.db'))}
+
+[logging]
+level = "WARNING"
+""")
+
+
+class ResourceMonitor:
+    """定期采样子进程（含其子进程）的 CPU 时间与常驻内存"""
+
+    def __init__(self, processes: Dict[str, subprocess.Popen]):
+        self.processes = processes
+        self.cpu_start: Dict[str, float] = {}
+        self.cpu_end: Dict[str, float] = {}
+        self.rss_peak: Dict[str, int] = {name: 0 for name in processes}
+
+    def _tree(self, pid: int) -> list:
+        try:
+            proc = psutil.Process(pid)
+            return [proc, *proc.children(recursive=True)]
+        except psutil.Error:
+            return []
+
+    def _sample(self) -> Dict[str, float]:
+        cpu = {}
+        for name, popen in self.processes.items():
+            total_cpu, total_rss = 0.0, 0
+            for proc in self._tree(popen.pid):
+                try:
+                    times = proc.cpu_times()
+                    total_cpu += times.user + times.system
+                    total_rss += proc.memory_info().rss
+                except psutil.Error:
+                    continue
+            cpu[name] = total_cpu
+            self.rss_peak[name] = max(self.rss_peak[name], total_rss)
+        return cpu
+
+    async def run(self, interval: float = 0.5) -> None:
+        if psutil is None:
+            return
+        self.cpu_start = self._sample()
+        while True:
+            await asyncio.sleep(interval)
+            self.cpu_end = self._sample()
+
+    def report(self) -> Optional[dict]:
+        if psutil is None:
+            return None
+        self.cpu_end = self._sample()
+        return {
+            name: {
+                'cpu_seconds': round(self.cpu_end.get(name, 0) - self.cpu_start.get(name, 0), 3),
+                'rss_peak_bytes': self.rss_peak[name],
+            }
+            for name in self.processes
+        }
+
+
+class SessionClient:
+    """模拟一个浏览器会话：订阅推送并发送消息"""
+
+    def __init__(self, session_id: str, base_url: str, ws_url: str, run_id: str):
+        self.session_id = session_id
+        self.base_url = base_url
+        self.ws_url = f"{ws_url}/ws/sessions/{session_id}"
+        self.run_id = run_id
+        self.sent_at: Dict[str, float] = {}
+        self.latencies: List[float] = []
+        self.waiters: Dict[str, asyncio.Event] = {}
+        self.errors = 0
+
+    def _token(self, seq: int) -> str:
+        return f"{self.run_id}:{self.session_id}:{seq}"
+
+    async def listen(self, ws) -> None:
+        async for raw in ws:
+            if raw == 'pong':
+                continue
+            frame = json.loads(raw)
+            now = time.perf_counter()
+            for msg in frame.get('messages', []):
+                text = msg.get('text', '')
+                if msg.get('from_user') != 'maimai' or not text.startswith(ECHO_PREFIX + BENCH_PREFIX):
+                    continue
+                token = text[len(ECHO_PREFIX + BENCH_PREFIX):]
+                sent = self.sent_at.pop(token, None)
+                if sent is not None:
+                    self.latencies.append(now - sent)
+                    event = self.waiters.pop(token, None)
+                    if event is not None:
+                        event.set()
+
+    async def send(self, client: httpx.AsyncClient, seq: int) -> Optional[asyncio.Event]:
+        token = self._token(seq)
+        event = asyncio.Event()
+        self.waiters[token] = event
+        self.sent_at[token] = time.perf_counter()
+        try:
+            resp = await client.post(
+                f"{self.base_url}/messages",
+                params={'session_id': self.session_id},
+                json={'from_user': 'web', 'text': BENCH_PREFIX + token, 'type': 'text'},
+            )
+            if resp.status_code != 200 or not resp.json().get('success'):
+                raise RuntimeError(resp.text)
+        except Exception:
+            self.errors += 1
+            self.sent_at.pop(token, None)
+            self.waiters.pop(token, None)
+            return None
+        return event
+
+    async def run(self, client: httpx.AsyncClient, count: int, rate: float, timeout: float) -> None:
+        async with websockets.connect(self.ws_url) as ws:
+            listener = asyncio.create_task(self.listen(ws))
+            try:
+                events = []
+                for seq in range(count):
+                    event = await self.send(client, seq)
+                    if event is None:
+                        continue
+                    if rate > 0:
+                        events.append(event)
+                        await asyncio.sleep(1 / rate)
+                    else:
+                        # 闭环：收到回显后再发下一条
+                        try:
+                            await asyncio.wait_for(event.wait(), timeout)
+                        except asyncio.TimeoutError:
+                            pass
+                if events:
+                    try:
+                        await asyncio.wait_for(asyncio.gather(*(event.wait() for event in events)), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                listener.cancel()
+
+
+async def warm_up(base_url: str, ws_url: str, timeout: float) -> None:
+    """等待整条链路打通（适配器连上 Core 并开始轮询）"""
+    client = SessionClient('default', base_url, ws_url, 'warmup')
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=10) as http:
+        async with websockets.connect(client.ws_url) as ws:
+            listener = asyncio.create_task(client.listen(ws))
+            try:
+                seq = 0
+                while time.monotonic() < deadline:
+                    event = await client.send(http, seq)
+                    seq += 1
+                    if event is None:
+                        await asyncio.sleep(0.5)
+                        continue
+                    try:
+                        await asyncio.wait_for(event.wait(), 2)
+                        return
+                    except asyncio.TimeoutError:
+                        continue
+            finally:
+                listener.cancel()
+    raise RuntimeError("预热超时：链路未打通，请检查适配器日志")
+
+
+async def run_benchmark(args: argparse.Namespace, data_dir: str) -> dict:
+    base_url = f"http://127.0.0.1:{args.backend_port}"
+    ws_url = f"ws://127.0.0.1:{args.backend_port}"
+
+    core = FakeCore(port=args.core_port, delay=args.core_delay_ms / 1000)
+    core_task = asyncio.create_task(core.run())
+
+    env = {**os.environ, 'PYTHONUNBUFFERED': '1'}
+    backend_env = {
+        **env,
+        'MAIMBOT_ENV': 'production',
+        'MAIMBOT_WORKERS': str(args.workers),
+        'MAIMBOT_HOST': '127.0.0.1',
+        'MAIMBOT_PORT': str(args.backend_port),
+        'MAIMBOT_DATA_DIR': data_dir,
+        # 压测吞吐，不测限流
+        'MAIMBOT_RATE_LIMIT': '0',
+    }
+    adapter_config = os.path.join(data_dir, 'adapter.toml')
+    write_adapter_config(adapter_config, args, data_dir)
+
+    logs = {name: open(os.path.join(data_dir, f'{name}.log'), 'wb') for name in ('backend', 'adapter')}
+    processes: Dict[str, subprocess.Popen] = {}
+    try:
+        processes['backend'] = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'http_server', 'main.py')],
+            cwd=os.path.join(ROOT, 'http_server'), env=backend_env,
+            stdout=logs['backend'], stderr=subprocess.STDOUT,
+        )
+        await asyncio.to_thread(wait_for_port, args.backend_port, 30)
+        await asyncio.to_thread(wait_for_port, args.core_port, 10)
+        processes['adapter'] = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'adapter', 'maimai_http_adapter.py')],
+            cwd=os.path.join(ROOT, 'adapter'), env={**env, 'MAIMBOT_ADAPTER_CONFIG': adapter_config},
+            stdout=logs['adapter'], stderr=subprocess.STDOUT,
+        )
+        await warm_up(base_url, ws_url, args.timeout)
+
+        monitor = ResourceMonitor(processes)
+        monitor_task = asyncio.create_task(monitor.run())
+        # 第一个会话使用 default，其余为 bench-N
+        session_ids = ['default'] + [f'bench-{index}' for index in range(1, args.sessions)]
+        run_id = uuid.uuid4().hex[:8]
+        clients = [SessionClient(session_id, base_url, ws_url, run_id) for session_id in session_ids]
+
+        limits = httpx.Limits(max_connections=max(args.sessions, 10))
+        async with httpx.AsyncClient(timeout=10, limits=limits) as http:
+            start = time.perf_counter()
+            await asyncio.gather(*(client.run(http, args.messages, args.rate, args.timeout) for client in clients))
+            elapsed = time.perf_counter() - start
+        monitor_task.cancel()
+        resources = monitor.report()
+    finally:
+        for proc in processes.values():
+            proc.terminate()
+        for proc in processes.values():
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        for log in logs.values():
+            log.close()
+        core_task.cancel()
+
+    latencies_ms = [value * 1000 for client in clients for value in client.latencies]
+    sent = args.sessions * args.messages
+    received = len(latencies_ms)
+    return {
+        'benchmark': 'e2e',
+        'config': {
+            'sessions': args.sessions,
+            'messages_per_session': args.messages,
+            'rate_per_session': args.rate,
+            'workers': args.workers,
+            'poll_interval': args.poll_interval,
+            'core_delay_ms': args.core_delay_ms,
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'sent': sent,
+        'received': received,
+        'lost': sent - received,
+        'send_errors': sum(client.errors for client in clients),
+        'core': {'received': core.received, 'replied': core.replied},
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_msgs_per_second': round(received / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'p50': percentile(latencies_ms, 50),
+            'p95': percentile(latencies_ms, 95),
+            'p99': percentile(latencies_ms, 99),
+            'max': max(latencies_ms) if latencies_ms else None,
+            'mean': sum(latencies_ms) / received if received else None,
+        },
+        'resources': resources,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=1, help='并发会话数（第一个为 default）')
+    parser.add_argument('--messages', type=int, default=100, help='每个会话发送的消息数')
+    parser.add_argument('--rate', type=float, default=0, help='每个会话每秒发送条数，0 表示收到回显后再发下一条')
+    parser.add_argument('--workers', type=int, default=1, help='后端工作进程数')
+    parser.add_argument('--poll-interval', type=float, default=0.1, help='适配器轮询间隔（秒）')
+    parser.add_argument('--core-delay-ms', type=float, default=0.0, help='模拟 Core 处理耗时')
+    parser.add_argument('--timeout', type=float, default=30.0, help='等待回显的超时时间（秒）')
+    parser.add_argument('--backend-port', type=int, default=18050)
+    parser.add_argument('--core-port', type=int, default=18000)
+    parser.add_argument('--output', help='结果写入文件（默认输出到标准输出）')
+    parser.add_argument('--keep-data', action='store_true', help='保留临时数据目录与日志')
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='maimbot-e2e-')
+    try:
+        result = asyncio.run(run_benchmark(args, data_dir))
+    finally:
+        if args.keep_data:
+            print(f"数据与日志保留在: {data_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+消息历史序列化基准测试
+
+对比 GET /messages 的两种输出方式：
+- legacy: 逐行构造 peewee 模型 -> MessageResponse -> jsonable_encoder -> json.dumps
+  （即原先 response_model=List[MessageResponse] 的处理过程）
+- stream: ChatService.iter_messages_json，按ID分块查询元组并用 orjson 编码
+
+输出 JSON 格式的耗时（墙钟 / CPU）与 tracemalloc 峰值内存，便于在版本间对比。
+
+用法:
+    python benchmarks/bench_message_serialization.py --messages 20000 --text-size 200
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'http_server'))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from backend.config import config  # noqa: E402
+from backend.models import ChatMessage, db, initialize_database  # noqa: E402
+from backend.schemas import MessageResponse  # noqa: E402
+from backend.serialization import orjson  # noqa: E402
+from backend.services import ChatService  # noqa: E402
+
+SESSION_ID = 'bench'
+
+
+def populate(count: int, text_size: int) -> None:
+    """写入测试消息"""
+    alphabet = string.ascii_letters + '你好世界麦麦'
+    rows = [
+        {
+            'session_id': SESSION_ID,
+            'from_user': random.choice(('web', 'maimai')),
+            'text': ''.join(random.choices(alphabet, k=text_size)),
+            'type': 'text',
+        }
+        for _ in range(count)
+    ]
+    with db.atomic():
+        for start in range(0, count, 500):
+            ChatMessage.insert_many(rows[start:start + 500]).execute()
+
+
+def legacy_path() -> int:
+    """原先的实现：完整模型对象 + Pydantic + jsonable_encoder"""
+    messages = (ChatMessage
+                .select()
+                .where(ChatMessage.session_id == SESSION_ID)
+                .order_by(ChatMessage.created_at.asc()))
+    responses = [
+        MessageResponse(
+            id=msg.id,
+            session_id=msg.session_id,
+            from_user=msg.from_user or "",
+            text=msg.text or "",
+            type=msg.type or "text",
+            image_b64=msg.image_b64 or ""
+        )
+        for msg in messages
+    ]
+    return len(json.dumps(jsonable_encoder(responses)).encode('utf-8'))
+
+
+def stream_path() -> int:
+    """新实现：分块元组查询 + orjson，逐块消费"""
+    upper_id = ChatService.get_last_message_id(SESSION_ID)
+    return sum(
+        len(chunk)
+        for chunk in ChatService.iter_messages_json(SESSION_ID, 0, upper_id, config.message_stream_chunk_size)
+    )
+
+
+def measure(func, repeat: int) -> dict:
+    """测量耗时与峰值内存"""
+    wall, cpu = [], []
+    size = 0
+    for _ in range(repeat):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        size = func()
+        wall.append(time.perf_counter() - wall_start)
+        cpu.append(time.process_time() - cpu_start)
+
+    # 单独一轮统计内存，避免 tracemalloc 的开销影响计时
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'bytes': size,
+        'wall_seconds_min': round(min(wall), 6),
+        'wall_seconds_avg': round(sum(wall) / len(wall), 6),
+        'cpu_seconds_min': round(min(cpu), 6),
+        'peak_memory_bytes': peak,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000, help='会话中的消息数')
+    parser.add_argument('--text-size', type=int, default=200, help='每条消息的文本长度')
+    parser.add_argument('--repeat', type=int, default=5, help='每种方式重复次数')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db.init(os.path.join(tmp_dir, 'bench.db'), **db.connect_params)
+        initialize_database()
+        populate(args.messages, args.text_size)
+
+        legacy = measure(legacy_path, args.repeat)
+        stream = measure(stream_path, args.repeat)
+        db.close_all()
+
+    print(json.dumps({
+        'benchmark': 'message_serialization',
+        'messages': args.messages,
+        'text_size': args.text_size,
+        'repeat': args.repeat,
+        'orjson': orjson is not None,
+        'results': {'legacy': legacy, 'stream': stream},
+        'speedup_cpu': round(legacy['cpu_seconds_min'] / max(stream['cpu_seconds_min'], 1e-9), 2),
+        'memory_ratio': round(legacy['peak_memory_bytes'] / max(stream['peak_memory_bytes'], 1), 2),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+模拟 MaiBot Core 的 WebSocket 服务
+
+使用 maim_message 的 MessageServer 接收适配器转发的消息，把文本原样加上
+前缀后作为麦麦的回复发回（保留 group_info，适配器据此找回会话）。
+可单独运行，也可由 bench_e2e.py 在进程内启动。
+
+用法:
+    python benchmarks/fake_core.py --port 18000 --delay-ms 0
+"""
+import argparse
+import asyncio
+import time
+from typing import Any, Dict
+
+from maim_message import BaseMessageInfo, MessageBase, MessageServer, Seg, UserInfo
+
+# 回复文本的前缀
+ECHO_PREFIX = 'echo: '
+
+
+def _extract_text(segment: Seg) -> str:
+    """拼接消息片段中的文本（展开 seglist）"""
+    if segment.type == 'seglist':
+        return ''.join(_extract_text(child) for child in segment.data)
+    if segment.type == 'text':
+        return segment.data
+    return ''
+
+
+class FakeCore:
+    """回显消息的 Core"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 18000, delay: float = 0.0):
+        self.delay = delay
+        self.received = 0
+        self.replied = 0
+        self.server = MessageServer(host=host, port=port)
+        self.server.register_message_handler(self.handle)
+
+    async def handle(self, message_dict: Dict[str, Any]) -> None:
+        self.received += 1
+        message = MessageBase.from_dict(message_dict)
+        text = _extract_text(message.message_segment)
+        if not text:
+            return
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+        info = message.message_info
+        reply_info = BaseMessageInfo(
+            platform=info.platform,
+            message_id=f"reply-{info.message_id}",
+            time=time.time(),
+            user_info=UserInfo(platform=info.platform, user_id='maimai', user_nickname='麦麦'),
+            group_info=info.group_info,
+            format_info={"content_format": ["text"], "accept_format": ["text", "image"]}
+        )
+        reply = MessageBase(
+            message_info=reply_info,
+            message_segment=Seg('seglist', [Seg('text', ECHO_PREFIX + text)])
+        )
+        await self.server.send_message(reply)
+        self.replied += 1
+
+    async def run(self) -> None:
+        await self.server.run()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18000)
+    parser.add_argument('--delay-ms', type=float, default=0.0, help='模拟 Core 处理耗时')
+    args = parser.parse_args()
+    asyncio.run(FakeCore(args.host, args.port, args.delay_ms / 1000).run())
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,8 @@
 MaiMbot WebUI Adapter - 主应用程序
 一个基于 FastAPI 和 React 的聊天机器人 Web 界面适配器
 """
+import asyncio
+import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
@@ -9,9 +11,45 @@ import logging
 from loguru import logger
 
 from backend.config import config
-from backend.models import initialize_database
+from backend.models import initialize_database, message_db
+from backend.services import BlobService, ConfigService, prepare_derivatives
+from backend.database import db_executor, run_in_db
+from backend.images import image_pipeline
+from backend.writer import message_writer
+from backend.retention import RetentionService, retention_loop
+from backend.change_feed import change_feed
 from backend.routes import api_router
+from backend.middleware import CompressionMiddleware
 from backend.frontend_launcher import FrontendLauncher
+from backend.static import FrontendStaticFiles, precompress_directory
+
+
+def prepare_database() -> None:
+    """建表、补充新增列并迁移旧图片；多进程部署时由启动脚本在创建工作进程前执行一次"""
+    initialize_database()
+    BlobService.migrate_legacy_images()
+
+
+async def backfill_image_derivatives() -> None:
+    """为启用缩略图之前保存的图片消息补充衍生版本，分批执行"""
+    # 多进程部署时只由抢到执行权的进程补充，每批之后续期
+    if config.multi_process and not await run_in_db(BlobService.claim_backfill):
+        return
+    total = 0
+    for shard in range(len(message_db.shards)):
+        after_id = 0
+        while True:
+            after_id, image_hashes = await run_in_db(BlobService.backfill_batch, after_id, shard=shard)
+            for image_hash in image_hashes:
+                thumb_hash, display_hash = await prepare_derivatives(image_hash)
+                if thumb_hash:
+                    total += await run_in_db(BlobService.apply_derivatives, image_hash, thumb_hash, display_hash, shard)
+            if config.multi_process:
+                await run_in_db(BlobService.claim_backfill, True)
+            if not after_id:
+                break
+    if total:
+        logger.info(f"已为 {total} 条图片消息补充缩略图")
 
 
 @asynccontextmanager
@@ -20,18 +58,57 @@ async def lifespan(app: FastAPI):
     # 启动时初始化
     logger.info("🚀 正在启动 MaiMbot WebUI Adapter...")
     
-    # 初始化数据库
-    initialize_database()
+    # 初始化数据库，之后的所有查询都在数据库线程池中执行
+    db_executor.start()
+    if not config.database_prepared:
+        await run_in_db(prepare_database)
+    message_writer.start()
     logger.info("✅ 数据库初始化完成")
     
-    # 启动前端服务
-    frontend_launcher = FrontendLauncher()
-    frontend_launcher.start_frontend()
-    logger.info("✅ 前端服务启动完成")
+    # 预加载配置缓存，之后的配置读取不再访问数据库
+    await run_in_db(ConfigService.warm_cache)
+    logger.info("✅ 配置缓存加载完成")
+    
+    # 启动图片处理进程池，并为已有图片补充缩略图
+    backfill_task = None
+    if image_pipeline.enabled:
+        image_pipeline.start()
+        backfill_task = asyncio.create_task(backfill_image_derivatives())
+    
+    # 启动消息保留任务
+    retention_task = None
+    if config.retention_enabled:
+        await run_in_db(RetentionService.ensure_incremental_vacuum)
+        retention_task = asyncio.create_task(retention_loop())
+        logger.info("✅ 消息保留任务已启动")
+    
+    # 多进程部署时感知其他工作进程写入的消息和修改的配置
+    if config.multi_process:
+        await change_feed.start()
+    
+    # 生产模式由后端直接提供前端构建产物，开发模式启动前端开发服务器
+    if config.is_production:
+        if os.path.isdir(config.frontend_dist_dir):
+            await asyncio.to_thread(precompress_directory, config.frontend_dist_dir)
+        else:
+            logger.warning(f"未找到前端构建产物，请先执行 npm run build。路径: {config.frontend_dist_dir}")
+    else:
+        frontend_launcher = FrontendLauncher()
+        frontend_launcher.start_frontend()
+        logger.info("✅ 前端服务启动完成")
     
     yield
     
     # 关闭时清理
+    if config.multi_process:
+        await change_feed.stop()
+    if retention_task is not None:
+        retention_task.cancel()
+    if backfill_task is not None:
+        backfill_task.cancel()
+    message_writer.stop()
+    image_pipeline.shutdown()
+    db_executor.shutdown()
     logger.info("👋 MaiMbot WebUI Adapter 已关闭")
 
 
@@ -51,11 +128,19 @@ def create_app() -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "X-Prev-Cursor", "X-Has-More", "ETag"],
     )
     
+    # 响应压缩（br/gzip）
+    app.add_middleware(CompressionMiddleware)
+    
     # 注册路由
     app.include_router(api_router)
     
+    # 生产模式提供前端页面，挂载在最后，不影响 API 路由
+    if config.is_production and os.path.isdir(config.frontend_dist_dir):
+        app.mount("/", FrontendStaticFiles(directory=config.frontend_dist_dir, html=True), name="frontend")
+    
     # 配置日志
     logging.basicConfig(level=logging.INFO)
     
@@ -0,0 +1,205 @@
+"""
+内容寻址的二进制存储（按 SHA-256 去重）
+"""
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from typing import Optional, Tuple
+
+from backend.config import config
+
+
+_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# 常见图片格式的文件头
+_MAGIC_NUMBERS = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+)
+
+
+def sniff_mime_type(head: bytes) -> str:
+    """根据文件头判断 MIME 类型"""
+    for magic, mime_type in _MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return mime_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单段 Range 请求头，返回闭区间 (start, end)
+
+    格式不支持时返回 None（按完整内容响应），范围无法满足时抛出 ValueError。
+    """
+    match = re.fullmatch(r'\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*', header or '')
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    start_text, end_text = match.groups()
+    if start_text == '':
+        # 后缀范围: bytes=-N
+        length = int(end_text)
+        if length == 0:
+            raise ValueError('empty suffix range')
+        return max(size - length, 0), size - 1
+    start = int(start_text)
+    end = int(end_text) if end_text else size - 1
+    if start >= size or end < start:
+        raise ValueError('unsatisfiable range')
+    return start, min(end, size - 1)
+
+
+class BlobWriter:
+    """
+    分块写入内容，边写边计算哈希
+
+    内容先写入存储目录下的临时文件，commit 时按哈希移动到最终位置，
+    discard 删除临时文件。
+    """
+
+    def __init__(self, store: 'BlobStore'):
+        self.store = store
+        self.size = 0
+        self.head = b''
+        # commit 后表示内容是否由本次写入新建（此前不存在），以及新建时设置的修改时间
+        self.created = False
+        self.mtime_ns = 0
+        self._hasher = hashlib.sha256()
+        os.makedirs(store.root, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=store.root, suffix='.upload')
+        self._file = os.fdopen(fd, 'wb')
+
+    def write(self, chunk: bytes) -> None:
+        """写入一块内容"""
+        if len(self.head) < 16:
+            self.head += chunk[:16 - len(self.head)]
+        self._hasher.update(chunk)
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self) -> str:
+        """完成写入并返回哈希，已存在相同内容时丢弃临时文件"""
+        self._file.close()
+        blob_hash = self._hasher.hexdigest()
+        path = self.store.path_for(blob_hash)
+        if self.store.claim(blob_hash):
+            os.remove(self._tmp_path)
+            return blob_hash
+        # 在移动前设置修改时间，release 据此判断内容是否被再次写入过
+        self.mtime_ns = time.time_ns()
+        os.utime(self._tmp_path, ns=(self.mtime_ns, self.mtime_ns))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self._tmp_path, path)
+        self.created = True
+        return blob_hash
+
+    def discard(self) -> None:
+        """放弃写入"""
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class BlobStore:
+    """磁盘上的内容寻址存储，文件按哈希前两位分目录"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    @staticmethod
+    def is_valid_hash(blob_hash: str) -> bool:
+        """校验哈希格式"""
+        return bool(_HASH_RE.match(blob_hash or ''))
+
+    def path_for(self, blob_hash: str) -> str:
+        """获取哈希对应的文件路径"""
+        return os.path.join(self.root, blob_hash[:2], blob_hash)
+
+    def exists(self, blob_hash: str) -> bool:
+        """判断内容是否已存储"""
+        return os.path.exists(self.path_for(blob_hash))
+
+    def put_bytes(self, data: bytes) -> str:
+        """存储内容并返回其 SHA-256，已存在时不重复写入"""
+        blob_hash = hashlib.sha256(data).hexdigest()
+        path = self.path_for(blob_hash)
+        if self.claim(blob_hash):
+            return blob_hash
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再原子替换，避免读到不完整的内容
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return blob_hash
+
+    def writer(self) -> BlobWriter:
+        """创建分块写入器"""
+        return BlobWriter(self)
+
+    def read(self, blob_hash: str, start: int = 0, length: Optional[int] = None) -> bytes:
+        """读取内容（可指定范围）"""
+        with open(self.path_for(blob_hash), 'rb') as f:
+            f.seek(start)
+            return f.read() if length is None else f.read(length)
+
+    def size(self, blob_hash: str) -> int:
+        """获取内容大小"""
+        return os.path.getsize(self.path_for(blob_hash))
+
+    def claim(self, blob_hash: str) -> bool:
+        """
+        再次写入已存储的内容时调用，不存在时返回 False（由调用方写入）
+
+        把修改时间加 1 纳秒，表示内容又被一次写入使用，新建者不会再通过
+        release 删除它。
+        """
+        path = self.path_for(blob_hash)
+        try:
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def release(self, blob_hash: str, mtime_ns: int) -> bool:
+        """
+        删除由 BlobWriter 新建、之后没有被再次写入（claim）的内容，返回是否已删除
+
+        先把文件移走再检查修改时间：移走之前的 claim 会改变修改时间（文件被放回），
+        之后的 claim 找不到文件，由对方重新写入。
+        """
+        path = self.path_for(blob_hash)
+        removed_path = f'{path}.{os.getpid()}.{threading.get_ident()}.release'
+        try:
+            os.replace(path, removed_path)
+        except FileNotFoundError:
+            return False
+        if os.stat(removed_path).st_mtime_ns != mtime_ns:
+            os.replace(removed_path, path)
+            return False
+        os.remove(removed_path)
+        return True
+
+    def clear(self) -> None:
+        """删除所有内容"""
+        if os.path.isdir(self.root):
+            shutil.rmtree(self.root)
+
+
+# 全局存储实例
+blob_store = BlobStore(config.blob_dir)
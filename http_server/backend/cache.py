@@ -0,0 +1,78 @@
+"""
+进程内配置缓存
+
+背景、立绘、头像、主题等配置读取频繁但很少修改，启动时加载到内存，
+修改时由 set_* 方法同步写入（write-through）。
+"""
+import threading
+from typing import Any, Callable, Dict
+
+
+class ConfigCache:
+    """线程安全的配置缓存，记录命中与未命中次数"""
+
+    def __init__(self):
+        self._values: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        # 每次写入或失效都会递增，用于丢弃并发加载得到的旧值
+        self._generation = 0
+        self._hits: Dict[str, int] = {}
+        self._misses: Dict[str, int] = {}
+
+    @property
+    def version(self) -> int:
+        """配置版本号，任何配置写入或失效后递增，用于生成 ETag"""
+        with self._lock:
+            return self._generation
+
+    def get(self, key: str, loader: Callable[[], Any]) -> Any:
+        """读取缓存，未命中时调用 loader 加载并缓存"""
+        with self._lock:
+            if key in self._values:
+                self._hits[key] = self._hits.get(key, 0) + 1
+                return self._values[key]
+            self._misses[key] = self._misses.get(key, 0) + 1
+            generation = self._generation
+
+        value = loader()
+        with self._lock:
+            if generation == self._generation:
+                self._values[key] = value
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        """写入缓存"""
+        with self._lock:
+            self._generation += 1
+            self._values[key] = value
+
+    def invalidate(self, key: str = None) -> None:
+        """使指定配置（或全部配置）失效"""
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取命中统计"""
+        with self._lock:
+            keys = set(self._hits) | set(self._misses) | set(self._values)
+            return {
+                "hits": sum(self._hits.values()),
+                "misses": sum(self._misses.values()),
+                "size": len(self._values),
+                "keys": {
+                    key: {
+                        "hits": self._hits.get(key, 0),
+                        "misses": self._misses.get(key, 0),
+                        "cached": key in self._values
+                    }
+                    for key in sorted(keys)
+                }
+            }
+
+
+# 全局配置缓存
+config_cache = ConfigCache()
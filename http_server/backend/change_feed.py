@@ -0,0 +1,146 @@
+"""
+跨进程变更通知
+
+多工作进程部署时，每个进程只知道自己写入的消息。这里用一个专用连接
+轮询 SQLite 的 PRAGMA data_version（其他连接提交事务后该值会变化），
+发现变化后读取新消息并交给本进程的 message_broker 发布，使连接到任意
+进程的客户端都能收到实时推送；同时根据 app_meta 中的修订号使配置缓存
+和 ETag 版本失效。
+
+消息分片存储时，每个分片文件各有一个专用连接和已发布的最大消息ID。
+"""
+import asyncio
+import sqlite3
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from backend.cache import config_cache
+from backend.config import config
+from backend.database import run_in_db
+from backend.events import message_broker
+from backend.models import AppMeta, message_db
+from backend.schemas import MessageResponse
+from backend.services import ChatService
+
+
+class ChangeFeed:
+    """轮询数据库变更并在本进程内发布"""
+
+    def __init__(self, interval: float, batch_size: int = 500):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._conn: Optional[sqlite3.Connection] = None
+        self._data_version: Optional[int] = None
+        # 各消息分片的专用连接、data_version 与已发布的最大消息ID（未分片时只有主库一项）
+        self._shard_conns: List[sqlite3.Connection] = []
+        self._shard_versions: List[int] = []
+        self._last_ids: List[int] = []
+        self._revisions: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def prime(self) -> None:
+        """记录当前状态，之后只发布此后的变更"""
+        # data_version 只对同一连接的前后两次读取有意义，因此使用专用连接
+        self._conn = sqlite3.connect(config.database_url, check_same_thread=False)
+        self._data_version = self._read_data_version(self._conn)
+        self._shard_conns, self._shard_versions, self._last_ids = [], [], []
+        for database in message_db.each_shard():
+            if database is message_db.obj:
+                conn = self._conn
+            else:
+                conn = sqlite3.connect(database.database, check_same_thread=False)
+            self._shard_conns.append(conn)
+            self._shard_versions.append(self._read_data_version(conn))
+            last_id = ChatService.get_max_message_id()
+            if last_id is None:
+                raise RuntimeError("无法读取消息分片的最大消息ID")
+            self._last_ids.append(last_id)
+        self._revisions = AppMeta.values()
+
+    @staticmethod
+    def _read_data_version(conn: sqlite3.Connection) -> int:
+        return conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def poll(self) -> int:
+        """检查一次变更，返回发布的消息数"""
+        data_version = self._read_data_version(self._conn)
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self._check_revisions()
+
+        published = 0
+        for index, _ in enumerate(message_db.each_shard()):
+            shard_version = self._read_data_version(self._shard_conns[index])
+            if shard_version == self._shard_versions[index]:
+                continue
+            self._shard_versions[index] = shard_version
+            published += self._publish_new_messages(index)
+        return published
+
+    def _check_revisions(self) -> None:
+        """根据修订号使配置缓存和消息版本失效"""
+        revisions = AppMeta.values()
+        if revisions.get(AppMeta.CONFIG_REVISION) != self._revisions.get(AppMeta.CONFIG_REVISION):
+            config_cache.invalidate()
+        if revisions.get(AppMeta.MESSAGES_EPOCH) != self._revisions.get(AppMeta.MESSAGES_EPOCH):
+            # 消息被清空，ID 从头分配
+            message_broker.invalidate()
+            self._last_ids = [0] * len(self._last_ids)
+        elif revisions.get(AppMeta.MESSAGES_REVISION) != self._revisions.get(AppMeta.MESSAGES_REVISION):
+            message_broker.invalidate()
+        self._revisions = revisions
+
+    def _publish_new_messages(self, index: int) -> int:
+        """发布当前分片中新写入的消息"""
+        published = 0
+        while True:
+            messages = ChatService.get_messages_since(self._last_ids[index], self.batch_size)
+            if not messages:
+                break
+            self._last_ids[index] = messages[-1].id
+            by_session: Dict[str, List[MessageResponse]] = {}
+            for msg in messages:
+                by_session.setdefault(msg.session_id, []).append(msg)
+            # 本进程写入的消息已经发布过，message_broker 会按ID忽略
+            for session_id, session_messages in by_session.items():
+                message_broker.publish(session_id, session_messages)
+            published += len(messages)
+            if len(messages) < self.batch_size:
+                break
+        return published
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await run_in_db(self.poll)
+            except Exception as e:
+                logger.error(f"[变更通知] 轮询失败: {e}")
+
+    async def start(self) -> None:
+        """启动轮询任务"""
+        await run_in_db(self.prime)
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"[变更通知] 已启动，轮询间隔 {self.interval * 1000:.0f}ms")
+
+    async def stop(self) -> None:
+        """停止轮询任务"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for conn in self._shard_conns:
+            if conn is not self._conn:
+                conn.close()
+        self._shard_conns = []
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+# 全局变更通知
+change_feed = ChangeFeed(config.change_poll_interval)
@@ -12,12 +12,94 @@ class Config:
     def __init__(self):
         self.base_dir = os.path.dirname(__file__)
         self.db_path = os.path.join(self.base_dir, 'chat.db')
+        self.blob_dir = os.path.join(self.base_dir, 'blobs')
+        self.archive_dir = os.path.join(self.base_dir, 'archive')
         self.config_path = os.path.join(self.base_dir, '../public/server_config.json')
+        # 前端构建产物目录（npm run build），生产模式下由后端直接提供
+        self.frontend_dist_dir = os.path.abspath(os.path.join(self.base_dir, '..', 'dist'))
         
         # 默认配置
         self.host = '127.0.0.1'
         self.port = 8050
         
+        # 运行模式: development（单进程、自动重载、启动前端开发服务器）或 production
+        self.environment = 'development'
+        # 生产模式的工作进程数，0 表示使用 CPU 核数
+        self.workers = 0
+        self.keep_alive_timeout = 30
+        self.backlog = 2048
+        # 多进程时轮询 SQLite data_version 感知其他进程写入的间隔（秒）
+        self.change_poll_interval = 0.05
+        
+        # 消息分页单页最大条数
+        self.message_page_max_limit = 1000
+        # 未指定 limit 时流式输出历史消息，每次查询的条数
+        self.message_stream_chunk_size = 500
+        # 批量发送单次请求最多包含的消息数
+        self.message_batch_max_size = 500
+        
+        # 数据库线程池大小（同时也是连接池的常驻连接数）
+        self.db_pool_size = 8
+        # SQLite 连接参数，每个新连接建立时设置
+        self.db_pragmas = {
+            'journal_mode': 'wal',
+            'synchronous': 'normal',        # WAL 模式下 NORMAL 已能保证数据一致
+            'cache_size': -64 * 1024,       # 64MB 页缓存
+            'mmap_size': 256 * 1024 * 1024,
+            'temp_store': 'memory',
+            'busy_timeout': 5000,
+        }
+        
+        # 消息分片数：大于 1 时按 session_id 的哈希把消息分散到多个数据库文件，
+        # 每个分片有独立的写锁和写线程（配置、图片等仍在主库）
+        self.db_shards = 1
+        
+        # 消息组提交：单个事务最多合并的消息数，以及第一条消息到达后的最长等待时间
+        self.write_batch_max_size = 64
+        self.write_batch_max_delay_ms = 2.0
+        
+        # 消息保留策略，0 表示不限制；超出的消息归档为压缩的 NDJSON 后删除
+        self.retention_max_messages_per_session = 0
+        self.retention_max_age_days = 0
+        self.retention_interval_seconds = 3600
+        self.retention_batch_size = 1000
+        self.archive_compression = 'gzip'   # gzip 或 zstd（需要安装 zstandard）
+        
+        # 图片衍生版本（需要安装 Pillow）：展示图与缩略图的最长边、格式和质量
+        self.image_derivatives_enabled = True
+        self.image_workers = max(1, (os.cpu_count() or 2) // 2)
+        self.image_display_max_size = 1280
+        self.image_thumb_max_size = 320
+        self.image_format = 'webp'          # webp 或 jpeg
+        self.image_display_quality = 82
+        self.image_thumb_quality = 70
+        self.image_max_pixels = 50_000_000  # 超过该像素数的图片视为无效（防止解压炸弹）
+        
+        # 图片上传（POST /messages/image）：大小上限、读取分块大小和允许的格式
+        self.upload_max_bytes = 20 * 1024 * 1024
+        self.upload_chunk_size = 64 * 1024
+        self.upload_allowed_mime_types = ('image/png', 'image/jpeg', 'image/gif', 'image/webp', 'image/bmp')
+        
+        # 限流：按会话、按客户端 IP 的发送速率（条/秒）与突发上限，0 表示不限制
+        self.rate_limit_enabled = True
+        self.rate_limit_session_rate = 5.0
+        self.rate_limit_session_burst = 20
+        self.rate_limit_client_rate = 20.0
+        self.rate_limit_client_burst = 60
+        # 不按 IP 限流的客户端（如与后端同机运行的适配器），仍受按会话的限制
+        self.rate_limit_exempt_clients: tuple = ()
+        # 同时处理的请求数上限，超过时直接返回 429，0 表示不限制
+        self.admission_max_concurrent = self.db_pool_size * 16
+        
+        # 长轮询 /messages/wait：单次最长等待时间（秒）与同时等待的连接数上限（不占用上面的并发名额）
+        self.feed_max_timeout = 60.0
+        self.feed_max_waiters = 1024
+        
+        # 响应压缩：小于该字节数的响应不压缩；安装 brotli-asgi 后优先使用 br
+        self.compression_minimum_size = 1024
+        self.compression_gzip_level = 6
+        self.compression_brotli_quality = 4
+        
         # 加载服务器配置
         self._load_server_config()
     
@@ -29,13 +111,104 @@ class Config:
                     config = json.load(f)
                     self.host = config.get('host', self.host)
                     self.port = int(config.get('port', self.port))
+                    self.environment = config.get('environment', self.environment)
+                    self.workers = int(config.get('workers', self.workers))
+                    self.keep_alive_timeout = int(config.get('keep_alive_timeout', self.keep_alive_timeout))
+                    self.backlog = int(config.get('backlog', self.backlog))
+                    self.db_shards = int(config.get('db_shards', self.db_shards))
+                    
+                    write_batch = config.get('write_batch', {})
+                    self.write_batch_max_size = max(1, int(write_batch.get('max_size', self.write_batch_max_size)))
+                    self.write_batch_max_delay_ms = float(write_batch.get('max_delay_ms', self.write_batch_max_delay_ms))
+                    
+                    retention = config.get('retention', {})
+                    self.retention_max_messages_per_session = int(retention.get(
+                        'max_messages_per_session', self.retention_max_messages_per_session))
+                    self.retention_max_age_days = float(retention.get('max_age_days', self.retention_max_age_days))
+                    self.retention_interval_seconds = float(retention.get('interval_seconds', self.retention_interval_seconds))
+                    self.archive_compression = retention.get('compression', self.archive_compression)
+                    
+                    rate_limit = config.get('rate_limit', {})
+                    self.rate_limit_enabled = bool(rate_limit.get('enabled', self.rate_limit_enabled))
+                    self.rate_limit_session_rate = float(rate_limit.get('session_rate', self.rate_limit_session_rate))
+                    self.rate_limit_session_burst = float(rate_limit.get('session_burst', self.rate_limit_session_burst))
+                    self.rate_limit_client_rate = float(rate_limit.get('client_rate', self.rate_limit_client_rate))
+                    self.rate_limit_client_burst = float(rate_limit.get('client_burst', self.rate_limit_client_burst))
+                    self.rate_limit_exempt_clients = tuple(rate_limit.get('exempt_clients', self.rate_limit_exempt_clients))
+                    self.admission_max_concurrent = int(rate_limit.get('max_concurrent', self.admission_max_concurrent))
+                    
+                    feed = config.get('feed', {})
+                    self.feed_max_timeout = float(feed.get('max_timeout', self.feed_max_timeout))
+                    self.feed_max_waiters = int(feed.get('max_waiters', self.feed_max_waiters))
+                    
+                    upload = config.get('upload', {})
+                    self.upload_max_bytes = int(upload.get('max_bytes', self.upload_max_bytes))
+                    
+                    image = config.get('image', {})
+                    self.image_derivatives_enabled = bool(image.get('enabled', self.image_derivatives_enabled))
+                    self.image_workers = max(1, int(image.get('workers', self.image_workers)))
+                    self.image_display_max_size = int(image.get('display_max_size', self.image_display_max_size))
+                    self.image_thumb_max_size = int(image.get('thumb_max_size', self.image_thumb_max_size))
+                    self.image_format = image.get('format', self.image_format)
+                    self.image_display_quality = int(image.get('display_quality', self.image_display_quality))
+                    self.image_thumb_quality = int(image.get('thumb_quality', self.image_thumb_quality))
+                    self.image_max_pixels = int(image.get('max_pixels', self.image_max_pixels))
             except Exception as e:
                 print(f"加载配置文件失败: {e}")
+        
+        # 环境变量优先，启动脚本通过它们把命令行参数传给各工作进程
+        self.environment = os.environ.get('MAIMBOT_ENV', self.environment)
+        self.workers = int(os.environ.get('MAIMBOT_WORKERS', self.workers))
+        self.host = os.environ.get('MAIMBOT_HOST', self.host)
+        self.port = int(os.environ.get('MAIMBOT_PORT', self.port))
+        self.db_shards = int(os.environ.get('MAIMBOT_DB_SHARDS', self.db_shards))
+        # 启动脚本已完成建表和迁移时设置，工作进程不再各自执行
+        self.database_prepared = os.environ.get('MAIMBOT_DB_PREPARED') == '1'
+        if 'MAIMBOT_RATE_LIMIT' in os.environ:
+            self.rate_limit_enabled = os.environ['MAIMBOT_RATE_LIMIT'] not in ('0', 'false', 'off')
+        # 数据目录（数据库、图片、归档），用于基准测试等需要隔离数据的场景
+        data_dir = os.environ.get('MAIMBOT_DATA_DIR')
+        if data_dir:
+            self.db_path = os.path.join(data_dir, 'chat.db')
+            self.blob_dir = os.path.join(data_dir, 'blobs')
+            self.archive_dir = os.path.join(data_dir, 'archive')
+    
+    @property
+    def is_production(self) -> bool:
+        """是否为生产模式"""
+        return self.environment == 'production'
+    
+    @property
+    def worker_count(self) -> int:
+        """实际的工作进程数，开发模式始终为 1"""
+        if not self.is_production:
+            return 1
+        return self.workers if self.workers > 0 else (os.cpu_count() or 1)
+    
+    @property
+    def multi_process(self) -> bool:
+        """是否有多个进程同时访问数据库"""
+        return self.worker_count > 1
+    
+    @property
+    def retention_enabled(self) -> bool:
+        """是否启用了消息保留策略"""
+        return self.retention_max_messages_per_session > 0 or self.retention_max_age_days > 0
     
     @property
     def database_url(self) -> str:
         """获取数据库URL"""
         return self.db_path
+    
+    @property
+    def sharded(self) -> bool:
+        """消息是否分片存储"""
+        return self.db_shards > 1
+    
+    def shard_path(self, index: int) -> str:
+        """消息分片的数据库文件路径，与主库同目录，如 chat.shard0.db"""
+        root, ext = os.path.splitext(self.db_path)
+        return f"{root}.shard{index}{ext}"
 
 
 # 全局配置实例
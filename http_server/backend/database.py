@@ -0,0 +1,72 @@
+"""
+数据库执行层
+
+peewee 的查询是同步的，路由中直接调用会阻塞事件循环。这里提供一个
+有界线程池，每个任务从连接池借用一个连接执行，结束后归还。
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from loguru import logger
+
+from backend.config import config
+from backend.models import db, message_db
+
+
+class DatabaseExecutor:
+    """在有界线程池中执行数据库操作"""
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def start(self) -> None:
+        """启动线程池"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix='db-worker'
+            )
+            logger.info(f"数据库线程池已启动: {self.max_workers} 个线程")
+
+    def shutdown(self) -> None:
+        """等待进行中的任务完成并关闭所有连接"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        db.close_all()
+        message_db.close_all_shards()
+        logger.info("数据库线程池已关闭")
+
+    @staticmethod
+    def _call(func: Callable, args: tuple, kwargs: dict) -> Any:
+        # 不使用 connection_context：func 自身可能关闭连接（如删除数据库文件）
+        db.connect(reuse_if_open=True)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if not db.is_closed():
+                db.close()
+            # 消息分片的连接在查询时按需打开，同样归还连接池
+            message_db.close_shards()
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """在线程池中执行 func 并等待结果"""
+        if self._executor is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            functools.partial(self._call, func, args, kwargs)
+        )
+
+
+# 全局数据库执行器
+db_executor = DatabaseExecutor(config.db_pool_size)
+
+
+async def run_in_db(func: Callable, *args, **kwargs) -> Any:
+    """在数据库线程池中执行同步函数"""
+    return await db_executor.run(func, *args, **kwargs)
@@ -0,0 +1,125 @@
+"""
+进程内消息事件分发（发布/订阅）
+"""
+import asyncio
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+
+class Subscription:
+    """会话订阅，消息通过所属事件循环的队列投递；session_id 为 None 时订阅所有会话"""
+
+    def __init__(self, session_id: Optional[str], loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.session_id = session_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        # 队列溢出后消费者需要按游标从数据库重新同步
+        self.overflowed = False
+
+    def _deliver(self, messages: list) -> None:
+        """在订阅者的事件循环中执行"""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(messages)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self) -> list:
+        """等待下一批消息"""
+        return await self.queue.get()
+
+    def reset(self) -> None:
+        """丢弃积压的消息并清除溢出标记"""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.overflowed = False
+
+
+class MessageBroker:
+    """
+    按会话分发新消息
+
+    publish 可以在任意线程调用，消息会通过 call_soon_threadsafe
+    投递到各订阅者所在的事件循环。
+    """
+
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        # 会话版本号：每次发布或失效时递增，用于生成 ETag
+        self._versions: Dict[str, int] = {}
+        # 全局纪元：清空数据等影响所有会话的操作时递增
+        self._epoch = 0
+        # 最近发布过的消息ID，同一条消息可能由本进程和跨进程变更通知各发布一次
+        self._recent_ids: Set[Tuple[str, int]] = set()
+        self._recent_order: deque = deque()
+        self.recent_size = 4096
+
+    def version(self, session_id: str) -> str:
+        """获取会话当前的版本标识，会话内容变化后一定不同"""
+        with self._lock:
+            return f"{self._epoch}.{self._versions.get(session_id, 0)}"
+
+    def invalidate(self, session_id: Optional[str] = None) -> None:
+        """标记会话（或所有会话）的内容已变化，例如消息被删除"""
+        with self._lock:
+            if session_id is None:
+                self._epoch += 1
+                self._versions.clear()
+                # 清空数据后消息ID会重新分配
+                self._recent_ids.clear()
+                self._recent_order.clear()
+            else:
+                self._versions[session_id] = self._versions.get(session_id, 0) + 1
+
+    def subscriber_count(self) -> int:
+        """当前的订阅连接数"""
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def subscribe(self, session_id: Optional[str]) -> Subscription:
+        """订阅会话，None 表示所有会话（需在事件循环中调用）"""
+        subscription = Subscription(session_id, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(session_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """取消订阅"""
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.session_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.session_id]
+
+    def publish(self, session_id: str, messages: List) -> None:
+        """向会话的所有订阅者发布新消息，已发布过的消息ID会被忽略"""
+        with self._lock:
+            # 分片存储时不同会话的消息ID可能相同，按 (会话, ID) 判断
+            messages = [msg for msg in messages if (session_id, msg.id) not in self._recent_ids]
+            if not messages:
+                return
+            for msg in messages:
+                self._recent_ids.add((session_id, msg.id))
+                self._recent_order.append((session_id, msg.id))
+            while len(self._recent_order) > self.recent_size:
+                self._recent_ids.discard(self._recent_order.popleft())
+            self._versions[session_id] = self._versions.get(session_id, 0) + 1
+            subscribers = [*self._subscribers.get(session_id, ()), *self._subscribers.get(None, ())]
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._deliver, messages)
+            except RuntimeError:
+                # 事件循环已关闭
+                logger.debug(f"[事件分发] 订阅者事件循环已关闭 [session_id={session_id}]")
+
+
+# 全局消息分发器
+message_broker = MessageBroker()
@@ -1,7 +1,9 @@
 """
-前端启动器模块
+前端启动器模块（仅开发模式使用）
 """
 import os
+import shutil
+import socket
 import subprocess
 import webbrowser
 import threading
@@ -12,10 +14,22 @@ from loguru import logger
 class FrontendLauncher:
     """前端启动器"""
     
-    def __init__(self, frontend_port: int = 5173):
+    def __init__(self, frontend_port: int = 5173, startup_timeout: float = 30.0):
         self.frontend_port = frontend_port
+        self.startup_timeout = startup_timeout
         self.frontend_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-        
+    
+    def _wait_for_port(self) -> bool:
+        """等待前端开发服务器开始监听"""
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection(('127.0.0.1', self.frontend_port), timeout=0.5):
+                    return True
+            except OSError:
+                time.sleep(0.2)
+        return False
+    
     def start_frontend(self) -> None:
         """启动前端服务"""
         def run_frontend():
@@ -24,23 +38,30 @@ class FrontendLauncher:
                 logger.warning(f"未找到前端 package.json，前端未启动。路径: {self.frontend_dir}")
                 return
             
+            # Windows 上为 npm.cmd，直接按完整路径执行，不经过 shell
+            npm = shutil.which('npm')
+            if npm is None:
+                logger.warning("未找到 npm，前端未启动")
+                return
+            
             try:
                 # 启动前端开发服务器
                 logger.info("正在启动前端服务...")
                 subprocess.Popen(
-                    ["npm", "run", "dev"], 
-                    cwd=self.frontend_dir, 
-                    shell=True
+                    [npm, "run", "dev", "--", "--port", str(self.frontend_port)],
+                    cwd=self.frontend_dir
                 )
                 
                 # 等待前端服务启动
-                time.sleep(3)
+                if not self._wait_for_port():
+                    logger.warning(f"前端服务在 {self.startup_timeout:.0f} 秒内未就绪")
+                    return
                 
                 # 自动打开浏览器
                 browser_url = f"http://localhost:{self.frontend_port}"
                 logger.info(f"打开浏览器: {browser_url}")
                 webbrowser.open_new_tab(browser_url)
-                
+            
             except Exception as e:
                 logger.error(f"启动前端失败: {e}")
         
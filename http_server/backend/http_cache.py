@@ -0,0 +1,44 @@
+"""
+HTTP 条件请求（ETag / If-None-Match）
+
+ETag 由内存中的版本号生成，判断是否命中不需要查询数据库。版本号只在
+进程内有效，因此 ETag 中带有进程启动时生成的随机标识，重启后旧的
+ETag 自然失效。压缩会改变响应字节，所以使用弱 ETag。
+"""
+import uuid
+
+from fastapi import Request, Response
+
+# 进程启动标识
+BOOT_ID = uuid.uuid4().hex[:12]
+
+
+def make_etag(*parts) -> str:
+    """根据版本号和请求参数生成弱 ETag"""
+    return 'W/"' + '-'.join([BOOT_ID, *('' if part is None else str(part) for part in parts)]) + '"'
+
+
+def _strip_weak(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """If-None-Match 是否与当前 ETag 匹配（弱比较）"""
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    current = _strip_weak(etag)
+    return any(_strip_weak(tag) == current for tag in header.split(','))
+
+
+def cache_headers(etag: str) -> dict:
+    """需要携带的缓存相关响应头：允许缓存但每次都需要重新验证"""
+    return {'ETag': etag, 'Cache-Control': 'no-cache'}
+
+
+def not_modified_response(etag: str) -> Response:
+    """304 响应"""
+    return Response(status_code=304, headers=cache_headers(etag))
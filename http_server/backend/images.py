@@ -0,0 +1,143 @@
+"""
+图片衍生版本（缩略图 / 展示图）生成
+
+图片入库时解码校验，并生成限制尺寸的展示图和小尺寸缩略图（默认 WebP）。
+解码和编码是 CPU 密集操作，在独立的进程池中执行，不占用事件循环和
+数据库线程的 GIL。未安装 Pillow 时不生成衍生版本，消息直接引用原图。
+"""
+import asyncio
+import io
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional
+
+from loguru import logger
+
+from backend.config import config
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    ImageOps = None
+
+
+# 输出格式对应的 Pillow 格式名与 MIME 类型
+_OUTPUT_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+
+def _encode(image, max_size: int, output_format: str, quality: int) -> bytes:
+    """缩放到最长边不超过 max_size 并编码"""
+    pil_format, _ = _OUTPUT_FORMATS[output_format]
+    image = image.copy()
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        # JPEG 不支持透明通道，铺白色背景
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = background
+    elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    output = io.BytesIO()
+    if pil_format == 'WEBP':
+        image.save(output, format=pil_format, quality=quality, method=4)
+    else:
+        image.save(output, format=pil_format, quality=quality, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def make_derivatives(data: bytes, display_max: int, thumb_max: int, output_format: str,
+                     display_quality: int, thumb_quality: int, max_pixels: int) -> Dict[str, Any]:
+    """
+    解码校验图片并生成展示图与缩略图（在工作进程中执行）
+
+    返回 {"valid", "width", "height", "display", "thumb", "mime_type", "error"}；
+    原图已经足够小时 display 为 None，动图只生成缩略图（展示时使用原图保留动画）。
+    """
+    result: Dict[str, Any] = {
+        'valid': False, 'width': 0, 'height': 0,
+        'display': None, 'thumb': None, 'mime_type': _OUTPUT_FORMATS[output_format][1], 'error': None,
+    }
+    try:
+        Image.MAX_IMAGE_PIXELS = max_pixels
+        with Image.open(io.BytesIO(data)) as probe:
+            probe.verify()
+        # verify 之后需要重新打开才能读取像素
+        with Image.open(io.BytesIO(data)) as image:
+            image.load()
+            # exif_transpose 返回的副本不再带有 is_animated，需在转换前读取
+            animated = getattr(image, 'is_animated', False)
+            image = ImageOps.exif_transpose(image)
+            width, height = image.size
+            result.update(valid=True, width=width, height=height)
+
+            if not animated and max(width, height) > display_max:
+                result['display'] = _encode(image, display_max, output_format, display_quality)
+            elif not animated and len(data) > 512 * 1024:
+                # 尺寸不大但体积大（如未压缩的 PNG），重新编码
+                encoded = _encode(image, display_max, output_format, display_quality)
+                if len(encoded) < len(data):
+                    result['display'] = encoded
+            result['thumb'] = _encode(image, thumb_max, output_format, thumb_quality)
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+class ImagePipeline:
+    """图片衍生版本生成进程池"""
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def enabled(self) -> bool:
+        """是否生成衍生版本"""
+        return Image is not None and config.image_derivatives_enabled
+
+    def start(self) -> None:
+        """启动进程池"""
+        if not self.enabled or self._executor is not None:
+            return
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        logger.info(f"图片处理进程池已启动: {self.max_workers} 个进程")
+
+    def shutdown(self) -> None:
+        """关闭进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def process(self, data: bytes) -> Optional[Dict[str, Any]]:
+        """
+        生成衍生版本，未启用时返回 None
+
+        进程池未启动时（如脚本中直接调用服务）在当前进程执行。
+        """
+        if not self.enabled:
+            return None
+        if self._executor is None:
+            return make_derivatives(*self._args(data))
+        return self._executor.submit(make_derivatives, *self._args(data)).result()
+
+    async def process_async(self, data: bytes) -> Optional[Dict[str, Any]]:
+        """与 process 相同，在事件循环中等待结果，不占用调用方线程"""
+        if not self.enabled:
+            return None
+        if self._executor is None:
+            return await asyncio.to_thread(make_derivatives, *self._args(data))
+        return await asyncio.wrap_future(self._executor.submit(make_derivatives, *self._args(data)))
+
+    @staticmethod
+    def _args(data: bytes) -> tuple:
+        return (
+            data, config.image_display_max_size, config.image_thumb_max_size, config.image_format,
+            config.image_display_quality, config.image_thumb_quality, config.image_max_pixels,
+        )
+
+
+# 全局图片处理进程池
+image_pipeline = ImagePipeline(config.image_workers)
@@ -0,0 +1,215 @@
+"""
+运行指标（Prometheus 文本格式）
+
+轻量实现的计数器、仪表和直方图，每个指标一把锁，可在事件循环和数据库
+线程池中并发更新。GET /metrics 输出 Prometheus text exposition 格式。
+
+多进程部署时每个工作进程各自统计，/metrics 返回处理该请求的进程的数据。
+"""
+import bisect
+import functools
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 请求与查询耗时的默认分桶（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 消息体积分桶（字节）
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """指标基类，按标签值组合分别记录"""
+
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labelvalues: Tuple) -> Tuple[str, ...]:
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+        return tuple(str(value) for value in labelvalues)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            items = sorted(self._children.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+    def _render_samples(self, items) -> Iterable[str]:
+        for labelvalues, value in items:
+            yield f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}'
+
+
+class Counter(_Metric):
+    """只增计数器"""
+
+    type_name = 'counter'
+
+    def inc(self, *labelvalues, amount: float = 1) -> None:
+        key = self._key(labelvalues)
+        with self._lock:
+            self._children[key] = self._children.get(key, 0) + amount
+
+    def value(self, *labelvalues) -> float:
+        with self._lock:
+            return self._children.get(self._key(labelvalues), 0)
+
+
+class Gauge(_Metric):
+    """可增可减的仪表"""
+
+    type_name = 'gauge'
+
+    def inc(self, *labelvalues, amount: float = 1) -> None:
+        key = self._key(labelvalues)
+        with self._lock:
+            self._children[key] = self._children.get(key, 0) + amount
+
+    def dec(self, *labelvalues, amount: float = 1) -> None:
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, value: float, *labelvalues) -> None:
+        key = self._key(labelvalues)
+        with self._lock:
+            self._children[key] = value
+
+
+class Histogram(_Metric):
+    """分桶直方图，记录各桶计数、总和与总数"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labelvalues) -> None:
+        key = self._key(labelvalues)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                # [各桶计数（非累计，最后一个为 +Inf）, 总和, 总数]
+                child = self._children[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            child[0][index] += 1
+            child[1] += value
+            child[2] += 1
+
+    def _render_samples(self, items) -> Iterable[str]:
+        bounds = [*self.buckets, float('inf')]
+        for labelvalues, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, f'le="{_format_value(bound)}"')
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f'{self.name}_sum{labels} {_format_value(total)}'
+            yield f'{self.name}_count{labels} {count}'
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        # 输出时才计算的指标（如缓存命中数），返回 (名称, 类型, 说明, [(标签字典, 值)])
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Tuple[dict, float]]]]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, type_name, documentation, samples in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {type_name}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# 全局注册表
+registry = Registry()
+
+# HTTP 请求
+http_request_duration = registry.register(Histogram(
+    'maimbot_http_request_duration_seconds', 'HTTP 请求处理耗时', ('method', 'route')))
+http_requests_total = registry.register(Counter(
+    'maimbot_http_requests_total', 'HTTP 请求数', ('method', 'route', 'status')))
+http_requests_in_flight = registry.register(Gauge(
+    'maimbot_http_requests_in_flight', '正在处理的 HTTP 请求数', ('method', 'route')))
+
+# 数据库查询（按服务方法）
+db_query_duration = registry.register(Histogram(
+    'maimbot_db_query_seconds', '服务方法的数据库访问耗时', ('method',)))
+db_query_errors = registry.register(Counter(
+    'maimbot_db_query_errors_total', '服务方法抛出的异常数', ('method',)))
+
+# 限流
+rate_limit_rejections = registry.register(Counter(
+    'maimbot_rate_limited_total', '被限流拒绝的请求数（session / client / concurrency / feed）', ('reason',)))
+
+# 消息写入
+messages_ingested = registry.register(Counter(
+    'maimbot_messages_ingested_total', '保存的消息数', ('source', 'result')))
+message_payload_bytes = registry.register(Histogram(
+    'maimbot_message_payload_bytes', '消息体积（文本与图片数据）', (), SIZE_BUCKETS))
+message_batch_size = registry.register(Histogram(
+    'maimbot_message_batch_size', '批量发送的单次消息数', (), (1, 2, 5, 10, 20, 50, 100, 200, 500)))
+write_batch_rows = registry.register(Histogram(
+    'maimbot_write_batch_rows', '写入队列每次事务提交的消息数', (), (1, 2, 4, 8, 16, 32, 64, 128, 256)))
+
+
+def timed_query(func: Optional[Callable] = None, *, name: Optional[str] = None):
+    """记录服务方法耗时的装饰器，用在 @staticmethod 之下"""
+    def decorator(inner: Callable) -> Callable:
+        label = name or inner.__qualname__
+
+        @functools.wraps(inner)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return inner(*args, **kwargs)
+            except Exception:
+                db_query_errors.inc(label)
+                raise
+            finally:
+                db_query_duration.observe(time.perf_counter() - start, label)
+        return wrapper
+
+    return decorator(func) if func is not None else decorator
@@ -0,0 +1,122 @@
+"""
+HTTP 中间件
+"""
+import time
+from typing import Callable, Tuple
+
+from fastapi import Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+from loguru import logger
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from backend.config import config
+from backend.metrics import http_request_duration, http_requests_in_flight, http_requests_total
+from backend.ratelimit import admission, too_many_requests
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+
+class CompressionMiddleware:
+    """
+    按 Accept-Encoding 协商压缩响应
+
+    安装了 brotli-asgi 时支持 br 并在客户端不支持时回退到 gzip，否则只使用 gzip。
+    图片等二进制内容本身已压缩，且需要支持 Range 请求，按路径前缀排除。
+    """
+
+    def __init__(self, app: ASGIApp, exclude_paths: Tuple[str, ...] = ('/blobs/',)):
+        self.app = app
+        self.exclude_paths = exclude_paths
+        if BrotliMiddleware is not None:
+            self.compressed_app = BrotliMiddleware(
+                app,
+                quality=config.compression_brotli_quality,
+                minimum_size=config.compression_minimum_size,
+                gzip_fallback=True,
+            )
+            logger.debug("响应压缩: br + gzip")
+        else:
+            self.compressed_app = GZipMiddleware(
+                app,
+                minimum_size=config.compression_minimum_size,
+                compresslevel=config.compression_gzip_level,
+            )
+            logger.debug("响应压缩: gzip")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and not scope["path"].startswith(self.exclude_paths):
+            await self.compressed_app(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+class _AdmittedStreamingResponse:
+    """包装流式响应，响应体输出完毕（或连接中断）后才释放并发名额"""
+
+    def __init__(self, response: StreamingResponse):
+        self.response = response
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            admission.release()
+
+
+class TimedRoute(APIRoute):
+    """
+    记录请求耗时、请求数与并发数的路由类
+
+    以路由模板（如 /blobs/{blob_hash}）作为标签，避免路径参数导致标签无限增长。
+    流式响应只统计到响应对象返回为止。
+
+    同时执行准入控制：正在处理的请求数达到上限时直接返回 429，
+    不让请求在数据库线程池前排队拖慢其他请求（/metrics 和长轮询
+    /messages/wait 不受限制，后者单独限制等待连接数）。流式响应
+    （不分页的历史消息、导出）在响应体输出完毕后才释放名额。
+    """
+
+    # 不受并发上限限制的路由
+    ADMISSION_EXEMPT = ('/metrics', '/messages/wait')
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        route = self.path
+        admitted = route not in self.ADMISSION_EXEMPT
+
+        async def timed_handler(request: Request) -> Response:
+            method = request.method
+            if admitted and not admission.try_acquire():
+                http_requests_total.inc(method, route, 429)
+                raise too_many_requests('concurrency', 1)
+            http_requests_in_flight.inc(method, route)
+            start = time.perf_counter()
+            status = 500
+            holding = admitted
+            try:
+                response = await handler(request)
+                status = response.status_code
+                if holding and isinstance(response, StreamingResponse):
+                    holding = False
+                    return _AdmittedStreamingResponse(response)
+                return response
+            except Exception as e:
+                # HTTPException 等按其状态码统计
+                status = getattr(e, 'status_code', 500)
+                raise
+            finally:
+                http_request_duration.observe(time.perf_counter() - start, method, route)
+                http_requests_total.inc(method, route, status)
+                http_requests_in_flight.dec(method, route)
+                if holding:
+                    admission.release()
+
+        return timed_handler
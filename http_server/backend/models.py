@@ -2,15 +2,34 @@
 数据库模型定义
 """
 from peewee import (
-    SqliteDatabase, Model, CharField, TextField, 
-    DateTimeField, PrimaryKeyField
+    Model, CharField, TextField, 
+    DateTimeField, PrimaryKeyField, IntegerField, OperationalError
 )
+from playhouse.migrate import SqliteMigrator, migrate
+from playhouse.pool import PooledSqliteDatabase
+from loguru import logger
 from datetime import datetime
 from backend.config import config
+from backend.sharding import MessageDatabase
 
 
-# 数据库连接
-db = SqliteDatabase(config.database_url)
+def _create_database(path: str) -> PooledSqliteDatabase:
+    # 数据库连接池，线程池之外的调用（如启动脚本）会临时多占用几个连接。
+    # 连接归还后可能被其他线程借用，因此关闭 sqlite3 的同线程检查。
+    return PooledSqliteDatabase(
+        path,
+        max_connections=config.db_pool_size + 4,
+        pragmas=config.db_pragmas,
+        check_same_thread=False
+    )
+
+
+db = _create_database(config.database_url)
+
+# 消息表所在的数据库：未分片时就是主库，分片时按 session_id 路由
+message_db = MessageDatabase(db)
+if config.sharded:
+    message_db.configure([_create_database(config.shard_path(index)) for index in range(config.db_shards)])
 
 
 class BaseModel(Model):
@@ -19,20 +38,67 @@ class BaseModel(Model):
         database = db
 
 
-class ChatMessage(BaseModel):
+class MessageModel(Model):
+    """存储在消息库（分片）中的模型"""
+    class Meta:
+        database = message_db
+
+
+class ChatMessage(MessageModel):
     """聊天消息模型"""
     id = PrimaryKeyField()
     session_id = CharField(default='default', help_text='会话ID')
     from_user = CharField(help_text='发送者')
     text = TextField(default='', help_text='文本内容')
     type = CharField(default='text', help_text='消息类型')
-    image_b64 = TextField(default='', help_text='图片Base64数据')
+    image_b64 = TextField(default='', help_text='图片Base64数据（旧数据，新消息使用 image_hash）')
+    image_hash = CharField(default='', help_text='图片内容的SHA-256，对应 /blobs/{hash}')
+    thumb_hash = CharField(default='', help_text='缩略图的SHA-256，没有衍生版本时为空')
+    display_hash = CharField(default='', help_text='展示图的SHA-256，原图足够小时为空')
     created_at = DateTimeField(default=datetime.now, help_text='创建时间')
     
     class Meta:
         table_name = 'chat_messages'
         indexes = (
             (('session_id', 'created_at'), False),
+            (('session_id', 'id'), False),
+        )
+
+
+class ChatBlob(BaseModel):
+    """二进制内容元数据，内容按哈希存储在磁盘上"""
+    hash = CharField(primary_key=True, max_length=64, help_text='内容的SHA-256')
+    mime_type = CharField(default='application/octet-stream', help_text='MIME类型')
+    size = IntegerField(default=0, help_text='字节数')
+    width = IntegerField(default=0, help_text='图片宽度（像素），非图片或未解码时为0')
+    height = IntegerField(default=0, help_text='图片高度（像素）')
+    thumb_hash = CharField(default='', help_text='缩略图的SHA-256')
+    display_hash = CharField(default='', help_text='展示图的SHA-256')
+    # 0 未处理，1 已处理，-1 不是有效图片
+    derivatives_status = IntegerField(default=0, help_text='衍生版本生成状态')
+    created_at = DateTimeField(default=datetime.now, help_text='创建时间')
+    
+    class Meta:
+        table_name = 'chat_blobs'
+
+
+class ChatSession(MessageModel):
+    """
+    会话索引，由 chat_messages 上的触发器维护
+
+    列出会话时只需读取该表，不必对全部消息分组统计。
+    """
+    session_id = CharField(primary_key=True, help_text='会话ID')
+    message_count = IntegerField(default=0, help_text='消息数')
+    last_message_id = IntegerField(default=0, help_text='最后一条消息的ID')
+    last_message_at = DateTimeField(null=True, help_text='最后一条消息的时间')
+    last_preview = TextField(default='', help_text='最后一条消息的预览文本')
+    
+    class Meta:
+        table_name = 'chat_sessions'
+        indexes = (
+            (('last_message_at',), False),
+            (('message_count',), False),
         )
 
 
@@ -82,27 +148,218 @@ class ApiKeyConfig(BaseModel):
         table_name = 'api_key_config'
 
 
+class AppMeta(BaseModel):
+    """
+    应用元数据（整数计数器）
+
+    多进程部署时各进程通过这里的修订号感知彼此对配置和消息的
+    删除类修改，以及协调只需一个进程执行的定时任务。
+    """
+    key = CharField(primary_key=True, help_text='名称')
+    value = IntegerField(default=0, help_text='计数值')
+    
+    # 配置修订号：任一配置被修改时递增
+    CONFIG_REVISION = 'config_revision'
+    # 消息修订号：消息被删除（保留策略归档）时递增
+    MESSAGES_REVISION = 'messages_revision'
+    # 消息纪元：清空全部消息（消息ID重新分配）时递增
+    MESSAGES_EPOCH = 'messages_epoch'
+    
+    class Meta:
+        table_name = 'app_meta'
+    
+    @classmethod
+    def bump(cls, key: str) -> None:
+        """修订号加一"""
+        cls.insert(key=key, value=1).on_conflict(
+            conflict_target=[cls.key],
+            update={cls.value: cls.value + 1}
+        ).execute()
+    
+    @classmethod
+    def values(cls) -> dict:
+        """读取所有计数值"""
+        return dict(cls.select(cls.key, cls.value).tuples())
+    
+    @classmethod
+    def claim(cls, key: str, now: int, next_value: int) -> bool:
+        """当计数值不大于 now 时原子地改为 next_value，成功表示由当前进程执行"""
+        cls.insert(key=key, value=0).on_conflict_ignore().execute()
+        updated = (cls
+                   .update(value=next_value)
+                   .where((cls.key == key) & (cls.value <= now))
+                   .execute())
+        return updated == 1
+
+
+def _ensure_columns(model, *field_names):
+    """为旧版本数据库补充新增的列"""
+    database = model._meta.database
+    if isinstance(database, MessageDatabase):
+        database = database.current
+    table = model._meta.table_name
+    existing = {column.name for column in database.get_columns(table)}
+    migrator = SqliteMigrator(database)
+    operations = [
+        migrator.add_column(table, model._meta.fields[name].column_name, model._meta.fields[name])
+        for name in field_names
+        if model._meta.fields[name].column_name not in existing
+    ]
+    if operations:
+        migrate(*operations)
+
+
+# 消息全文索引（FTS5 外部内容表，由触发器与 chat_messages 保持同步）
+SEARCH_INDEX_TABLE = 'chat_messages_fts'
+
+_SEARCH_INDEX_TRIGGERS = (
+    f"""CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ai AFTER INSERT ON chat_messages
+    WHEN new.text != '' BEGIN
+        INSERT INTO {SEARCH_INDEX_TABLE}(rowid, text) VALUES (new.id, new.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ad AFTER DELETE ON chat_messages
+    WHEN old.text != '' BEGIN
+        INSERT INTO {SEARCH_INDEX_TABLE}({SEARCH_INDEX_TABLE}, rowid, text) VALUES ('delete', old.id, old.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_messages_fts_au AFTER UPDATE OF text ON chat_messages BEGIN
+        INSERT INTO {SEARCH_INDEX_TABLE}({SEARCH_INDEX_TABLE}, rowid, text)
+            SELECT 'delete', old.id, old.text WHERE old.text != '';
+        INSERT INTO {SEARCH_INDEX_TABLE}(rowid, text)
+            SELECT new.id, new.text WHERE new.text != '';
+    END""",
+)
+
+
+# 会话索引的预览文本长度与触发器
+SESSION_PREVIEW_LENGTH = 100
+
+_SESSION_PREVIEW_SQL = (
+    "CASE WHEN {row}.text != '' THEN substr({row}.text, 1, " + str(SESSION_PREVIEW_LENGTH) + ") "
+    "WHEN {row}.image_hash != '' OR {row}.image_b64 != '' THEN '[图片]' ELSE '' END"
+)
+
+_SESSION_INDEX_TRIGGERS = (
+    f"""CREATE TRIGGER IF NOT EXISTS chat_sessions_ai AFTER INSERT ON chat_messages BEGIN
+        INSERT INTO chat_sessions(session_id, message_count, last_message_id, last_message_at, last_preview)
+            VALUES (new.session_id, 1, new.id, new.created_at, {_SESSION_PREVIEW_SQL.format(row='new')})
+            ON CONFLICT(session_id) DO UPDATE SET
+                message_count = message_count + 1,
+                last_message_id = excluded.last_message_id,
+                last_message_at = excluded.last_message_at,
+                last_preview = excluded.last_preview
+            WHERE excluded.last_message_id > last_message_id;
+        UPDATE chat_sessions SET message_count = message_count + 1
+            WHERE session_id = new.session_id AND last_message_id > new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_sessions_ad AFTER DELETE ON chat_messages BEGIN
+        DELETE FROM chat_sessions WHERE session_id = old.session_id AND message_count <= 1;
+        UPDATE chat_sessions SET message_count = message_count - 1
+            WHERE session_id = old.session_id AND last_message_id != old.id;
+        UPDATE chat_sessions SET
+            message_count = message_count - 1,
+            last_message_id = (SELECT MAX(id) FROM chat_messages WHERE session_id = old.session_id),
+            last_message_at = (SELECT created_at FROM chat_messages
+                               WHERE session_id = old.session_id ORDER BY id DESC LIMIT 1),
+            last_preview = (SELECT {_SESSION_PREVIEW_SQL.format(row='m')} FROM chat_messages AS m
+                            WHERE m.session_id = old.session_id ORDER BY m.id DESC LIMIT 1)
+        WHERE session_id = old.session_id AND last_message_id = old.id;
+    END""",
+)
+
+
+def _create_session_index(database):
+    """创建会话索引的触发器，首次创建时根据已有消息填充"""
+    exists = database.execute_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'chat_sessions_ai'"
+    ).fetchone()
+    if exists:
+        return
+    with database.atomic():
+        database.execute_sql("DELETE FROM chat_sessions")
+        database.execute_sql(
+            "INSERT INTO chat_sessions(session_id, message_count, last_message_id, last_message_at, last_preview) "
+            f"SELECT m.session_id, s.message_count, m.id, m.created_at, {_SESSION_PREVIEW_SQL.format(row='m')} "
+            "FROM (SELECT session_id, COUNT(*) AS message_count, MAX(id) AS last_id "
+            "      FROM chat_messages GROUP BY session_id) AS s "
+            "JOIN chat_messages AS m ON m.id = s.last_id"
+        )
+        for trigger in _SESSION_INDEX_TRIGGERS:
+            database.execute_sql(trigger)
+
+
+def _create_search_index(database):
+    """
+    创建消息全文索引
+
+    优先使用 trigram 分词（支持中文子串匹配），SQLite 版本过旧时退回
+    unicode61。SQLite 未编译 FTS5 时跳过，搜索退化为 LIKE 扫描。
+    """
+    if database.table_exists(SEARCH_INDEX_TABLE):
+        return
+    for tokenizer in ('trigram', 'unicode61'):
+        try:
+            database.execute_sql(
+                f"CREATE VIRTUAL TABLE {SEARCH_INDEX_TABLE} USING fts5("
+                f"text, content='chat_messages', content_rowid='id', tokenize='{tokenizer}')"
+            )
+            break
+        except OperationalError:
+            # 另一个进程已同时创建了索引
+            if database.table_exists(SEARCH_INDEX_TABLE):
+                return
+            continue
+    else:
+        logger.warning("SQLite 不支持 FTS5，消息搜索将使用 LIKE 扫描")
+        return
+    for trigger in _SEARCH_INDEX_TRIGGERS:
+        database.execute_sql(trigger)
+    # 为已有消息建立索引
+    database.execute_sql(f"INSERT INTO {SEARCH_INDEX_TABLE}({SEARCH_INDEX_TABLE}) VALUES ('rebuild')")
+
+
 def initialize_database():
     """初始化数据库"""
     with db:
         db.create_tables([
-            ChatMessage, 
+            ChatBlob,
             BackgroundConfig, 
             SpriteConfig, 
             AvatarConfig,
             ThemeConfig,
-            ApiKeyConfig
+            ApiKeyConfig,
+            AppMeta
         ], safe=True)
+        _ensure_columns(ChatBlob, 'width', 'height', 'thumb_hash', 'display_hash', 'derivatives_status')
+    
+    # 消息表、全文索引和会话索引建在每个消息分片中（未分片时为主库）
+    for database in message_db.each_shard():
+        with database:
+            database.create_tables([ChatMessage, ChatSession], safe=True)
+            _ensure_columns(ChatMessage, 'image_hash', 'thumb_hash', 'display_hash')
+            _create_search_index(database)
+            _create_session_index(database)
+    
+    if message_db.sharded:
+        table = ChatMessage._meta.table_name
+        with db:
+            unsplit = db.table_exists(table) and db.execute_sql(f"SELECT 1 FROM {table} LIMIT 1").fetchone()
+        if unsplit:
+            logger.warning("主库中仍有未拆分的消息，请执行 python -m backend.sharding split")
 
 
 # 所有模型类
 __all__ = [
     'db',
+    'message_db',
     'ChatMessage',
+    'ChatBlob',
+    'ChatSession',
     'BackgroundConfig', 
     'SpriteConfig',
     'AvatarConfig',
     'ThemeConfig',
     'ApiKeyConfig',
+    'AppMeta',
+    'SEARCH_INDEX_TABLE',
     'initialize_database'
 ]
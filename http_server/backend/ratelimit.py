@@ -0,0 +1,134 @@
+"""
+准入控制与限流
+
+- 令牌桶：按会话和客户端 IP 限制发送消息的速率，允许短时突发
+- 并发上限：同时处理的请求数超过上限时直接拒绝，而不是在数据库线程池前排队
+- 长轮询 /messages/wait 大部分时间在等待新消息，不计入上面的并发上限，单独限制等待连接数
+
+被拒绝的请求返回 429 和 Retry-After，拒绝次数记录在 /metrics 中。
+多进程部署时每个工作进程分别计数。
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+
+from backend.config import config
+from backend.metrics import rate_limit_rejections
+
+
+class TokenBucketLimiter:
+    """
+    按键的令牌桶
+
+    每个键以 rate 个/秒的速度补充令牌，最多积累 burst 个。只保留最近
+    使用的 max_keys 个键，被淘汰的键下次出现时视为令牌已满。
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, cost: float = 1) -> float:
+        """尝试消耗 cost 个令牌，成功返回 0，否则返回需要等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            # 大于桶容量的请求（如批量发送）在桶满时放行，令牌记为负数，之后的请求需等待补足
+            needed = min(cost, self.burst)
+            if bucket[0] >= needed:
+                bucket[0] -= cost
+                return 0.0
+            return (needed - bucket[0]) / self.rate
+
+    def refund(self, key: str, cost: float = 1) -> None:
+        """退还 acquire 成功消耗的令牌（同一请求的后续检查被拒绝时使用）"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(self.burst, bucket[0] + cost)
+
+
+class ConcurrencyLimiter:
+    """非阻塞的并发计数，超过上限时 try_acquire 返回 False"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._active = 0
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> int:
+        """正在处理的请求数"""
+        return self._active
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.limit > 0 and self._active >= self.limit:
+                return False
+            self._active += 1
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self._active -= 1
+
+
+def too_many_requests(reason: str, retry_after: float) -> HTTPException:
+    """构造 429 响应并记录拒绝次数"""
+    rate_limit_rejections.inc(reason)
+    return HTTPException(
+        status_code=429,
+        detail="请求过于频繁，请稍后再试",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+# 全局限流器
+session_limiter = TokenBucketLimiter(config.rate_limit_session_rate, config.rate_limit_session_burst)
+client_limiter = TokenBucketLimiter(config.rate_limit_client_rate, config.rate_limit_client_burst)
+admission = ConcurrencyLimiter(config.admission_max_concurrent)
+feed_waiters = ConcurrencyLimiter(config.feed_max_waiters)
+
+
+def check_send_rate(client: Optional[str], session_costs: Dict[str, int]) -> None:
+    """
+    检查发送消息的速率，超限时抛出 429
+
+    session_costs 为各会话本次发送的消息数；先检查客户端 IP，再检查各会话。
+    任一检查被拒绝时退还之前已扣除的令牌，被拒绝的请求不消耗配额。
+    """
+    if not config.rate_limit_enabled:
+        return
+    total = sum(session_costs.values())
+    charged = []
+    if client and client not in config.rate_limit_exempt_clients:
+        retry_after = client_limiter.acquire(client, total)
+        if retry_after:
+            raise too_many_requests('client', retry_after)
+        charged.append((client_limiter, client, total))
+    for session_id, cost in session_costs.items():
+        retry_after = session_limiter.acquire(session_id, cost)
+        if retry_after:
+            for limiter, key, charged_cost in charged:
+                limiter.refund(key, charged_cost)
+            raise too_many_requests('session', retry_after)
+        charged.append((session_limiter, session_id, cost))
@@ -0,0 +1,183 @@
+"""
+消息保留与归档
+
+按会话的最大消息数和最长保留时间清理 chat_messages。过期消息先写入
+归档目录下按会话划分的压缩 NDJSON 分段文件，再从数据库删除，最后通过
+incremental_vacuum 归还空闲页，让热表和数据库文件保持在有限大小。
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from backend.config import config
+from backend.database import run_in_db
+from backend.events import message_broker
+from backend.models import AppMeta, ChatMessage, ChatSession, message_db
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# PRAGMA auto_vacuum 的取值
+_AUTO_VACUUM_INCREMENTAL = 2
+
+# app_meta 中记录下一轮清理最早执行时间（Unix 时间戳）的键
+RETENTION_NEXT_RUN = 'retention_next_run'
+
+
+class RetentionService:
+    """消息保留服务"""
+
+    @staticmethod
+    def ensure_incremental_vacuum() -> None:
+        """将消息库（各分片）切换为 auto_vacuum=INCREMENTAL（旧数据库需要一次完整 VACUUM）"""
+        for _ in message_db.each_shard():
+            if message_db.pragma('auto_vacuum') == _AUTO_VACUUM_INCREMENTAL:
+                continue
+            logger.info("正在切换数据库为增量 VACUUM 模式，首次执行可能需要一些时间...")
+            message_db.pragma('auto_vacuum', _AUTO_VACUUM_INCREMENTAL)
+            message_db.execute_sql('VACUUM')
+
+    @staticmethod
+    def run_once() -> Dict[str, int]:
+        """执行一轮清理，返回归档的消息数和涉及的会话数"""
+        archived = 0
+        sessions = 0
+        try:
+            for _ in message_db.each_shard():
+                shard_archived = 0
+                session_ids = [row[0] for row in ChatSession.select(ChatSession.session_id).tuples()]
+                for session_id in session_ids:
+                    cutoff_id = RetentionService._cutoff_id(session_id)
+                    if cutoff_id is None:
+                        continue
+                    count = RetentionService._archive_session(session_id, cutoff_id)
+                    if count:
+                        shard_archived += count
+                        sessions += 1
+                if shard_archived:
+                    message_db.execute_sql('PRAGMA incremental_vacuum')
+                archived += shard_archived
+            if archived:
+                AppMeta.bump(AppMeta.MESSAGES_REVISION)
+                logger.info(f"[消息保留] 已归档 {archived} 条消息，涉及 {sessions} 个会话")
+        except Exception as e:
+            logger.error(f"[消息保留] 清理失败: {e}")
+        return {"archived": archived, "sessions": sessions}
+
+    @staticmethod
+    def claim_run() -> bool:
+        """抢占本轮清理的执行权"""
+        try:
+            now = int(time.time())
+            # 略早于下一轮到期，避免各进程的计时误差导致整轮被跳过
+            next_run = now + max(int(config.retention_interval_seconds * 0.9), 1)
+            return AppMeta.claim(RETENTION_NEXT_RUN, now, next_run)
+        except Exception as e:
+            logger.error(f"[消息保留] 获取执行权失败: {e}")
+            return False
+    
+    @staticmethod
+    def _cutoff_id(session_id: str) -> Optional[int]:
+        """计算会话中需要归档的最大消息ID，没有过期消息时返回 None"""
+        cutoff_ids = []
+        if config.retention_max_messages_per_session > 0:
+            row = (ChatMessage
+                   .select(ChatMessage.id)
+                   .where(ChatMessage.session_id == session_id)
+                   .order_by(ChatMessage.id.desc())
+                   .offset(config.retention_max_messages_per_session)
+                   .limit(1)
+                   .tuples()
+                   .first())
+            if row:
+                cutoff_ids.append(row[0])
+        if config.retention_max_age_days > 0:
+            expire_before = datetime.now() - timedelta(days=config.retention_max_age_days)
+            row = (ChatMessage
+                   .select(ChatMessage.id)
+                   .where((ChatMessage.session_id == session_id) & (ChatMessage.created_at < expire_before))
+                   .order_by(ChatMessage.id.desc())
+                   .limit(1)
+                   .tuples()
+                   .first())
+            if row:
+                cutoff_ids.append(row[0])
+        return max(cutoff_ids) if cutoff_ids else None
+
+    @staticmethod
+    def _archive_session(session_id: str, cutoff_id: int) -> int:
+        """分批归档并删除会话中ID不大于 cutoff_id 的消息"""
+        archived = 0
+        while True:
+            rows = list(ChatMessage
+                        .select()
+                        .where((ChatMessage.session_id == session_id) & (ChatMessage.id <= cutoff_id))
+                        .order_by(ChatMessage.id)
+                        .limit(config.retention_batch_size)
+                        .dicts())
+            if not rows:
+                return archived
+            # 先落盘归档文件再删除，异常中断时最多产生重复归档而不会丢数据
+            RetentionService._write_segment(session_id, rows)
+            with message_db.atomic():
+                (ChatMessage
+                 .delete()
+                 .where((ChatMessage.session_id == session_id)
+                        & (ChatMessage.id >= rows[0]['id'])
+                        & (ChatMessage.id <= rows[-1]['id']))
+                 .execute())
+            message_broker.invalidate(session_id)
+            archived += len(rows)
+
+    @staticmethod
+    def _write_segment(session_id: str, rows: List[Dict[str, Any]]) -> str:
+        """写入一个归档分段文件"""
+        session_dir = os.path.join(config.archive_dir, RetentionService._session_dirname(session_id))
+        os.makedirs(session_dir, exist_ok=True)
+
+        use_zstd = config.archive_compression == 'zstd' and zstandard is not None
+        if config.archive_compression == 'zstd' and zstandard is None:
+            logger.warning("[消息保留] 未安装 zstandard，改用 gzip 压缩归档")
+        extension = 'ndjson.zst' if use_zstd else 'ndjson.gz'
+        path = os.path.join(session_dir, f"{rows[0]['id']:012d}-{rows[-1]['id']:012d}.{extension}")
+
+        payload = ''.join(
+            json.dumps(row, ensure_ascii=False, default=str) + '\n' for row in rows
+        ).encode('utf-8')
+        data = zstandard.ZstdCompressor().compress(payload) if use_zstd else gzip.compress(payload)
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return path
+
+    @staticmethod
+    def _session_dirname(session_id: str) -> str:
+        """会话ID转换为安全的目录名"""
+        safe = re.sub(r'[^A-Za-z0-9_-]', '_', session_id) or '_'
+        if safe != session_id:
+            # 替换过字符时追加哈希，避免不同会话映射到同一目录
+            safe = f"{safe}-{hashlib.sha1(session_id.encode('utf-8')).hexdigest()[:8]}"
+        return safe
+
+
+async def retention_loop() -> None:
+    """按配置的间隔定期执行清理，多进程时每轮只由抢到执行权的一个进程执行"""
+    while True:
+        if await run_in_db(RetentionService.claim_run):
+            await run_in_db(RetentionService.run_once)
+        await asyncio.sleep(config.retention_interval_seconds)
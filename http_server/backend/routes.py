@@ -1,35 +1,248 @@
 """
 API路由定义
 """
-from fastapi import APIRouter, Request, HTTPException
-from typing import List
+import asyncio
+from collections import Counter
+from fastapi import APIRouter, Request, Response, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
 
 from backend.schemas import (
-    MessageRequest, MessageResponse, UrlRequest, UrlResponse,
+    MessageRequest, MessageResponse, MessageBatchResponse, MessageSearchResponse, MessageFeedResponse,
+    SessionListResponse,
+    UrlRequest, UrlResponse,
     AvatarConfigRequest, AvatarConfigResponse, StandardResponse,
-    ThemeRequest, ThemeResponse, ApiKeyRequest, ApiKeyResponse, ApiKeysResponse
+    ThemeRequest, ThemeResponse, ApiKeyRequest, ApiKeyResponse, ApiKeysResponse,
+    CacheStatsResponse
 )
-from backend.services import ChatService, ConfigService, ThemeService, ApiKeyService, DatabaseService
+from backend.services import (
+    ChatService, SearchService, SessionService, BlobService, ConfigService, ThemeService, ApiKeyService, DatabaseService,
+    prepare_derivatives, prepare_message_image
+)
+from backend.blobs import blob_store, parse_range, sniff_mime_type
+from backend.config import config
+from backend.events import message_broker
+from backend.database import run_in_db
+from backend.cache import config_cache
+from backend.http_cache import make_etag, is_not_modified, cache_headers, not_modified_response
+from backend.retention import RetentionService
+from backend.serialization import dumps
+from backend.metrics import registry
+from backend.middleware import TimedRoute
+from backend.writer import message_writer
+from backend.ratelimit import admission, feed_waiters, check_send_rate, too_many_requests
+
+
+# 创建路由器，每个路由记录耗时与并发数
+api_router = APIRouter(route_class=TimedRoute)
+
+
+def _collect_runtime_metrics():
+    """输出时读取的运行状态"""
+    stats = config_cache.stats()
+    yield ('maimbot_config_cache_hits_total', 'counter', '配置缓存命中次数', [({}, stats['hits'])])
+    yield ('maimbot_config_cache_misses_total', 'counter', '配置缓存未命中次数', [({}, stats['misses'])])
+    yield ('maimbot_websocket_subscribers', 'gauge', '实时推送连接数', [({}, message_broker.subscriber_count())])
+    yield ('maimbot_write_queue_depth', 'gauge', '等待写入的消息组数', [({}, message_writer.queue_depth)])
+    yield ('maimbot_admission_active', 'gauge', '准入控制下正在处理的请求数', [({}, admission.active)])
+    yield ('maimbot_feed_waiters', 'gauge', '正在等待新消息的长轮询连接数', [({}, feed_waiters.active)])
 
 
-# 创建路由器
-api_router = APIRouter()
+registry.add_collector(_collect_runtime_metrics)
 
 
 @api_router.get("/messages", response_model=List[MessageResponse])
-async def get_messages(request: Request):
-    """获取消息列表"""
+async def get_messages(
+    request: Request,
+    after_id: Optional[int] = Query(None, ge=0, description="只返回ID大于该值的消息"),
+    before_id: Optional[int] = Query(None, ge=1, description="只返回ID小于该值的消息"),
+    limit: Optional[int] = Query(None, ge=1, le=config.message_page_max_limit, description="最多返回条数"),
+    exclude_from_user: Optional[str] = Query(None, description="不返回该发送者的消息"),
+):
+    """
+    获取消息列表
+
+    响应头携带游标:
+    - X-Next-Cursor: 下一次增量拉取应使用的 after_id
+    - X-Prev-Cursor: 继续向前翻页应使用的 before_id（没有更早的消息时不返回）
+    - X-Has-More: 增量拉取被 limit 截断时为 true
+
+    指定 limit 时一次查询并直接编码；未指定时按ID分块查询并以流的形式
+    输出 JSON 数组，内存占用与历史长度无关。
+
+    响应携带由会话版本号生成的 ETag，会话没有变化时 If-None-Match
+    直接返回 304，不查询数据库。
+
+    指定 exclude_from_user 且增量拉取未被截断时，X-Next-Cursor 会越过
+    被排除的消息，下一次拉取不再重复扫描它们。
+    """
     session_id = request.query_params.get('session_id', 'default')
-    messages = ChatService.get_messages(session_id)
-    return messages
+    # 版本号必须在查询之前读取：查询期间写入的消息会使版本号变化，不会误判为未修改
+    etag = make_etag('m', message_broker.version(session_id), after_id, before_id, limit, exclude_from_user)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    
+    if limit is not None:
+        # 同样在查询之前读取：不超过该ID的未排除消息都会出现在结果中
+        scanned_id = (await run_in_db(ChatService.get_last_message_id, session_id)
+                      if exclude_from_user is not None and before_id is None else 0)
+        rows = await run_in_db(ChatService.get_message_rows, session_id, after_id, before_id, limit,
+                               exclude_from_user)
+        truncated = len(rows) >= limit
+        next_cursor = rows[-1]["id"] if rows else (after_id or 0)
+        if not truncated:
+            next_cursor = max(next_cursor, scanned_id)
+        headers = {
+            "X-Next-Cursor": str(next_cursor),
+            "X-Has-More": "true" if truncated and after_id is not None else "false",
+            **cache_headers(etag),
+        }
+        if truncated and after_id is None:
+            headers["X-Prev-Cursor"] = str(rows[0]["id"])
+        return Response(content=dumps(rows), media_type="application/json", headers=headers)
+    
+    # 先确定本次响应的ID上界，游标在开始输出前即可写入响应头
+    start_id = after_id or 0
+    upper_id = await run_in_db(ChatService.get_last_message_id, session_id)
+    if before_id is not None:
+        upper_id = min(upper_id, before_id - 1)
+    chunks = ChatService.iter_messages_json(
+        session_id, start_id, upper_id, config.message_stream_chunk_size, exclude_from_user
+    )
+    
+    async def stream():
+        while True:
+            chunk = await run_in_db(next, chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    
+    return StreamingResponse(
+        stream(),
+        media_type="application/json",
+        headers={
+            "X-Next-Cursor": str(max(upper_id, start_id)),
+            "X-Has-More": "false",
+            **cache_headers(etag),
+        }
+    )
+
+
+def _parse_feed_cursor(value: str) -> List[int]:
+    """解析 /messages/wait 的游标：各消息分片的最大消息ID，以逗号分隔"""
+    try:
+        cursors = [int(part) for part in value.split(',')]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的游标")
+    if any(cursor < 0 for cursor in cursors):
+        raise HTTPException(status_code=400, detail="无效的游标")
+    return cursors
+
+
+def _feed_response(messages: list, cursors: List[int], has_more: bool = False, reset: bool = False) -> Response:
+    content = {
+        "messages": messages,
+        "next_cursor": ','.join(str(cursor) for cursor in cursors),
+        "has_more": has_more,
+        "reset": reset,
+    }
+    return Response(content=dumps(content), media_type="application/json")
+
+
+@api_router.get("/messages/wait", response_model=MessageFeedResponse)
+async def wait_for_messages(
+    after_id: Optional[str] = Query(None, description="游标（上次响应的 next_cursor）；不传时立即返回当前游标"),
+    timeout: float = Query(30, ge=0, le=config.feed_max_timeout, description="没有新消息时最长等待的秒数"),
+    limit: int = Query(200, ge=1, le=config.message_page_max_limit, description="每个消息分片最多返回条数"),
+    exclude_from_user: Optional[str] = Query(None, description="不返回该发送者的消息"),
+):
+    """
+    长轮询所有会话的新消息
+
+    游标之后已有消息时立即返回，否则等待到有新消息写入或超时（超时返回空列表）。
+    供适配器等后台消费者使用：空闲时不重复查询数据库，新消息写入后立即返回。
+    游标为各消息分片已读取的最大消息ID（未分片时就是消息ID），以逗号分隔。
+
+    等待期间不占用准入控制的并发名额，同时等待的连接数单独限制。
+    """
+    if not feed_waiters.try_acquire():
+        raise too_many_requests('feed', 1)
+    try:
+        if after_id is None:
+            head = await run_in_db(ChatService.get_feed_head)
+            if head is None:
+                raise HTTPException(status_code=503, detail="暂时无法读取消息")
+            return _feed_response([], head)
+        cursors = _parse_feed_cursor(after_id)
+        # 先订阅再查询，查询之后写入的消息一定会唤醒等待
+        subscription = message_broker.subscribe(None)
+        try:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            while True:
+                feed = await run_in_db(ChatService.get_feed, cursors, limit, exclude_from_user)
+                remaining = deadline - loop.time()
+                if feed["messages"] or feed["reset"] or remaining <= 0:
+                    return _feed_response(feed["messages"], feed["cursors"], feed["has_more"], feed["reset"])
+                # 只有被排除的消息时游标同样前进
+                cursors = feed["cursors"]
+                try:
+                    await asyncio.wait_for(subscription.get(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                # 消息以数据库为准，丢弃队列中积压的通知
+                subscription.reset()
+        finally:
+            message_broker.unsubscribe(subscription)
+    finally:
+        feed_waiters.release()
+
+
+@api_router.get("/messages/search", response_model=MessageSearchResponse)
+async def search_messages(
+    q: str = Query(..., min_length=1, description="搜索关键词，多个词以空格分隔"),
+    session_id: Optional[str] = Query(None, description="只搜索指定会话"),
+    limit: int = Query(20, ge=1, le=100, description="每页条数"),
+    offset: int = Query(0, ge=0, description="分页偏移"),
+):
+    """按相关度全文搜索聊天记录"""
+    results = await run_in_db(SearchService.search, q, session_id, limit, offset)
+    return MessageSearchResponse(
+        results=results,
+        next_offset=offset + limit if len(results) == limit else None
+    )
+
+
+def _client_host(request: Request) -> Optional[str]:
+    return request.client.host if request.client else None
+
+
+@api_router.get("/sessions", response_model=SessionListResponse)
+async def list_sessions(
+    sort: str = Query('recent', pattern='^(recent|count|name)$',
+                      description="排序方式：recent 最近活跃、count 消息数、name 会话ID"),
+    limit: int = Query(50, ge=1, le=500, description="每页条数"),
+    offset: int = Query(0, ge=0, description="分页偏移"),
+):
+    """列出会话及其消息数、最后一条消息"""
+    result = await run_in_db(SessionService.list_sessions, sort, limit, offset)
+    return SessionListResponse(
+        sessions=result["sessions"],
+        total=result["total"],
+        next_offset=offset + limit if offset + limit < result["total"] else None
+    )
 
 
 @api_router.post("/messages", response_model=StandardResponse)
 @api_router.post("/send_message", response_model=StandardResponse)
 async def send_message(message: MessageRequest, request: Request):
     """发送消息"""
-    session_id = request.query_params.get('session_id', 'default')
-    success = ChatService.send_message(message, session_id)
+    session_id = message.session_id or request.query_params.get('session_id', 'default')
+    check_send_rate(_client_host(request), {session_id: 1})
+    # 图片的解码与缩略图生成不占用数据库线程
+    image = await prepare_message_image(message)
+    success = await run_in_db(ChatService.send_message, message, session_id, image)
     
     return StandardResponse(
         success=success,
@@ -37,17 +250,211 @@ async def send_message(message: MessageRequest, request: Request):
     )
 
 
+@api_router.post("/messages/batch", response_model=MessageBatchResponse)
+async def send_messages(messages: List[MessageRequest], request: Request):
+    """批量发送消息，所有消息在同一个事务中写入，返回每条消息的结果"""
+    if len(messages) > config.message_batch_max_size:
+        raise HTTPException(
+            status_code=413,
+            detail=f"单次最多发送 {config.message_batch_max_size} 条消息"
+        )
+    session_id = request.query_params.get('session_id', 'default')
+    check_send_rate(_client_host(request), Counter(message.session_id or session_id for message in messages))
+    images = await asyncio.gather(*(prepare_message_image(message) for message in messages))
+    results = await run_in_db(ChatService.send_messages, messages, session_id, images)
+    return MessageBatchResponse(
+        success=all(result["success"] for result in results),
+        results=results
+    )
+
+
+def _upload_too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"图片不能超过 {config.upload_max_bytes / (1024 * 1024):g}MB")
+
+
+@api_router.post("/messages/image", response_model=StandardResponse)
+async def upload_image(
+    request: Request,
+    session_id: str = Query('default', description="会话ID"),
+    from_user: str = Query('web', description="发送者")
+):
+    """
+    上传图片并作为消息发送，请求体为图片原始内容（Content-Type 为图片类型）
+
+    请求体分块写入临时文件并同时计算哈希，不在内存中保留完整内容；
+    超过大小上限或不是支持的图片格式时尽早拒绝。
+    """
+    check_send_rate(_client_host(request), {session_id: 1})
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in config.upload_allowed_mime_types and content_type != "application/octet-stream":
+        raise HTTPException(status_code=415, detail=f"不支持的图片类型: {content_type or '未知'}")
+    declared_length = request.headers.get("content-length")
+    if declared_length and declared_length.isdigit() and int(declared_length) > config.upload_max_bytes:
+        raise _upload_too_large()
+    
+    writer = await asyncio.to_thread(blob_store.writer)
+    try:
+        buffer = bytearray()
+        async for chunk in request.stream():
+            buffer += chunk
+            if writer.size + len(buffer) > config.upload_max_bytes:
+                raise _upload_too_large()
+            if len(buffer) >= config.upload_chunk_size:
+                await asyncio.to_thread(writer.write, bytes(buffer))
+                buffer.clear()
+                # 首块写入后即可根据文件头判断格式
+                if sniff_mime_type(writer.head) not in config.upload_allowed_mime_types:
+                    raise HTTPException(status_code=415, detail="文件内容不是支持的图片格式")
+        if buffer:
+            await asyncio.to_thread(writer.write, bytes(buffer))
+        if writer.size == 0:
+            raise HTTPException(status_code=400, detail="请求体为空")
+        mime_type = sniff_mime_type(writer.head)
+        if mime_type not in config.upload_allowed_mime_types:
+            raise HTTPException(status_code=415, detail="文件内容不是支持的图片格式")
+        image_hash = await asyncio.to_thread(writer.commit)
+    except BaseException:
+        await asyncio.to_thread(writer.discard)
+        raise
+    
+    derivatives = await prepare_derivatives(image_hash, mime_type, writer.size)
+    message = await run_in_db(ChatService.send_image, image_hash, mime_type, writer.size, from_user, session_id, derivatives)
+    if message is None and writer.created:
+        # 发送失败时不留下无人引用的新图片
+        await run_in_db(BlobService.discard_upload, image_hash, writer.mtime_ns, mime_type, writer.size)
+    return StandardResponse(
+        success=message is not None,
+        message="图片发送成功" if message is not None else "图片发送失败",
+        data=message
+    )
+
+
+@api_router.websocket("/ws/sessions/{session_id}")
+async def session_websocket(
+    websocket: WebSocket,
+    session_id: str,
+    after_id: Optional[int] = Query(None, ge=0, description="断线重连时最后收到的消息ID"),
+):
+    """
+    会话消息实时推送
+
+    连接时携带 after_id 会先补发该ID之后的历史消息（按页分帧发送），之后推送新消息。
+    首次打开会话应先通过 GET /messages?limit= 加载最近一页，再以返回的游标连接。
+    服务端帧格式: {"type": "messages", "messages": [...], "cursor": 最后一条消息ID}
+    """
+    await websocket.accept()
+    # 先订阅再补发历史，避免两者之间的消息丢失
+    subscription = message_broker.subscribe(session_id)
+    cursor = after_id or 0
+    
+    async def push(messages: List[MessageResponse]) -> None:
+        nonlocal cursor
+        messages = [msg for msg in messages if msg.id > cursor]
+        if not messages:
+            return
+        cursor = messages[-1].id
+        await websocket.send_json({
+            "type": "messages",
+            "messages": jsonable_encoder(messages),
+            "cursor": cursor
+        })
+    
+    async def replay() -> None:
+        # 按页从数据库补发游标之后的消息，单帧大小有上限
+        page_size = config.message_stream_chunk_size
+        while True:
+            page = await run_in_db(ChatService.get_messages, session_id, after_id=cursor, limit=page_size)
+            await push(page)
+            if len(page) < page_size:
+                break
+    
+    async def receive_loop() -> None:
+        # 处理客户端心跳，同时感知连接断开
+        while True:
+            data = await websocket.receive_text()
+            if data == "ping":
+                await websocket.send_text("pong")
+    
+    receiver = asyncio.create_task(receive_loop())
+    try:
+        if after_id is not None:
+            await replay()
+        else:
+            # 未携带游标时只推送新消息
+            latest = await run_in_db(ChatService.get_messages, session_id, limit=1)
+            cursor = latest[-1].id if latest else 0
+        
+        while True:
+            getter = asyncio.create_task(subscription.get())
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                getter.cancel()
+                break
+            messages = getter.result()
+            if subscription.overflowed:
+                # 推送积压过多，改为按游标从数据库重新同步
+                subscription.reset()
+                await replay()
+                continue
+            await push(messages)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        if receiver.done() and not receiver.cancelled():
+            # 取出连接断开异常，避免未处理警告
+            receiver.exception()
+        message_broker.unsubscribe(subscription)
+
+
+@api_router.api_route("/blobs/{blob_hash}", methods=["GET", "HEAD"])
+async def get_blob(blob_hash: str, request: Request):
+    """按哈希获取图片等二进制内容，支持 ETag 与单段 Range 请求"""
+    blob = await run_in_db(BlobService.get_blob, blob_hash)
+    if blob is None:
+        raise HTTPException(status_code=404, detail="内容不存在")
+    
+    etag = f'"{blob.hash}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+        "X-Content-Type-Options": "nosniff",
+    }
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    
+    size = blob_store.size(blob.hash)
+    try:
+        byte_range = parse_range(request.headers.get("range", ""), size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    
+    start, end = byte_range if byte_range else (0, size - 1)
+    status_code = 206 if byte_range else 200
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    
+    content = b"" if request.method == "HEAD" else await run_in_db(blob_store.read, blob.hash, start, end - start + 1)
+    return Response(content=content, status_code=status_code, media_type=blob.mime_type, headers=headers)
+
+
 @api_router.get("/background", response_model=UrlResponse)
-async def get_background():
+async def get_background(request: Request, response: Response):
     """获取背景配置"""
-    url = ConfigService.get_background()
+    etag = make_etag('c', config_cache.version)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers.update(cache_headers(etag))
+    url = await run_in_db(ConfigService.get_background)
     return UrlResponse(url=url)
 
 
 @api_router.post("/background", response_model=StandardResponse)
 async def set_background(data: UrlRequest):
     """设置背景配置"""
-    success = ConfigService.set_background(data.url)
+    success = await run_in_db(ConfigService.set_background, data.url)
     return StandardResponse(
         success=success,
         message="背景设置成功" if success else "背景设置失败"
@@ -55,16 +462,20 @@ async def set_background(data: UrlRequest):
 
 
 @api_router.get("/sprite", response_model=UrlResponse)
-async def get_sprite():
+async def get_sprite(request: Request, response: Response):
     """获取立绘配置"""
-    url = ConfigService.get_sprite()
+    etag = make_etag('c', config_cache.version)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers.update(cache_headers(etag))
+    url = await run_in_db(ConfigService.get_sprite)
     return UrlResponse(url=url)
 
 
 @api_router.post("/sprite", response_model=StandardResponse)
 async def set_sprite(data: UrlRequest):
     """设置立绘配置"""
-    success = ConfigService.set_sprite(data.url)
+    success = await run_in_db(ConfigService.set_sprite, data.url)
     return StandardResponse(
         success=success,
         message="立绘设置成功" if success else "立绘设置失败"
@@ -72,34 +483,49 @@ async def set_sprite(data: UrlRequest):
 
 
 @api_router.get("/avatar_config", response_model=AvatarConfigResponse)
-async def get_avatar_config():
+async def get_avatar_config(request: Request, response: Response):
     """获取头像配置"""
-    config = ConfigService.get_avatar_config()
+    etag = make_etag('c', config_cache.version)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers.update(cache_headers(etag))
+    config = await run_in_db(ConfigService.get_avatar_config)
     return AvatarConfigResponse(**config)
 
 
 @api_router.post("/avatar_config", response_model=StandardResponse)
 async def set_avatar_config(data: AvatarConfigRequest):
     """设置头像配置"""
-    success = ConfigService.set_avatar_config(data.user, data.bot)
+    success = await run_in_db(ConfigService.set_avatar_config, data.user, data.bot)
     return StandardResponse(
         success=success,
         message="头像配置成功" if success else "头像配置失败"
     )
 
 
+@api_router.get("/config_cache/stats", response_model=CacheStatsResponse)
+async def get_config_cache_stats():
+    """获取配置缓存命中统计"""
+    stats = ConfigService.get_cache_stats()
+    return CacheStatsResponse(**stats)
+
+
 # 主题相关API
 @api_router.get("/theme", response_model=ThemeResponse)
-async def get_theme():
+async def get_theme(request: Request, response: Response):
     """获取主题配置"""
-    theme = ThemeService.get_theme()
+    etag = make_etag('c', config_cache.version)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers.update(cache_headers(etag))
+    theme = await run_in_db(ThemeService.get_theme)
     return ThemeResponse(theme=theme)
 
 
 @api_router.post("/theme", response_model=StandardResponse)
 async def set_theme(data: ThemeRequest):
     """设置主题配置"""
-    success = ThemeService.set_theme(data.theme)
+    success = await run_in_db(ThemeService.set_theme, data.theme)
     return StandardResponse(
         success=success,
         message="主题设置成功" if success else "主题设置失败"
@@ -110,14 +536,14 @@ async def set_theme(data: ThemeRequest):
 @api_router.get("/api_keys", response_model=ApiKeysResponse)
 async def get_api_keys():
     """获取所有API密钥"""
-    keys = ApiKeyService.get_all_api_keys()
+    keys = await run_in_db(ApiKeyService.get_all_api_keys)
     return ApiKeysResponse(keys=keys)
 
 
 @api_router.post("/api_key", response_model=StandardResponse)
 async def set_api_key(data: ApiKeyRequest):
     """设置API密钥"""
-    success = ApiKeyService.set_api_key(data.key, data.value)
+    success = await run_in_db(ApiKeyService.set_api_key, data.key, data.value)
     return StandardResponse(
         success=success,
         message="API密钥设置成功" if success else "API密钥设置失败"
@@ -128,7 +554,7 @@ async def set_api_key(data: ApiKeyRequest):
 @api_router.post("/database/clear", response_model=StandardResponse)
 async def clear_database():
     """清空数据"""
-    success = DatabaseService.clear_data()
+    success = await run_in_db(DatabaseService.clear_data)
     return StandardResponse(
         success=success,
         message="数据清空成功" if success else "数据清空失败"
@@ -138,8 +564,27 @@ async def clear_database():
 @api_router.delete("/database", response_model=StandardResponse)
 async def delete_database():
     """删除数据库"""
-    success = DatabaseService.clear_database()
+    success = await run_in_db(DatabaseService.clear_database)
     return StandardResponse(
         success=success,
         message="数据库删除成功" if success else "数据库删除失败"
     )
+
+
+@api_router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus 文本格式的运行指标"""
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@api_router.post("/database/retention", response_model=StandardResponse)
+async def run_retention():
+    """立即按保留策略归档并清理过期消息"""
+    if not config.retention_enabled:
+        return StandardResponse(success=False, message="未配置消息保留策略")
+    result = await run_in_db(RetentionService.run_once)
+    return StandardResponse(
+        success=True,
+        message=f"已归档 {result['archived']} 条消息",
+        data=result
+    )
@@ -11,14 +11,76 @@ class MessageRequest(BaseModel):
     text: Optional[str] = Field("", description="文本内容")
     type: Optional[str] = Field("text", description="消息类型")
     image_b64: Optional[str] = Field("", description="图片Base64数据")
+    session_id: Optional[str] = Field(None, description="会话ID，未指定时使用查询参数 session_id")
+
+
+class MessageBatchItemResult(BaseModel):
+    """批量发送中单条消息的结果"""
+    index: int = Field(..., description="在请求数组中的位置")
+    success: bool = Field(..., description="是否保存成功")
+    id: Optional[int] = Field(None, description="消息ID")
+    message: Optional[str] = Field(None, description="结果说明")
+
+
+class MessageBatchResponse(BaseModel):
+    """批量发送响应模型"""
+    success: bool = Field(..., description="是否全部保存成功")
+    results: List[MessageBatchItemResult]
 
 
 class MessageResponse(BaseModel):
     """消息响应模型"""
+    id: int = Field(0, description="消息ID，可作为分页游标")
+    session_id: str = Field("default", description="会话ID")
     from_user: str
     text: str
     type: str
-    image_b64: str
+    image_b64: str = Field("", description="旧数据的图片Base64，新消息为空")
+    image_hash: str = Field("", description="图片内容的SHA-256")
+    image_url: str = Field("", description="原图地址，形如 /blobs/{hash}")
+    thumb_url: str = Field("", description="缩略图地址，没有缩略图时与 image_url 相同")
+    display_url: str = Field("", description="展示图地址（限制尺寸），没有展示图时与 image_url 相同")
+
+
+class MessageSearchHit(BaseModel):
+    """消息搜索结果"""
+    id: int
+    session_id: str
+    from_user: str
+    type: str
+    text: str
+    snippet: str = Field(..., description="匹配片段，命中部分以 <mark></mark> 标记")
+    created_at: Optional[str] = None
+
+
+class MessageSearchResponse(BaseModel):
+    """消息搜索响应模型"""
+    results: List[MessageSearchHit]
+    next_offset: Optional[int] = Field(None, description="下一页的 offset，没有更多结果时为空")
+
+
+class MessageFeedResponse(BaseModel):
+    """长轮询新消息响应模型"""
+    messages: List[MessageResponse]
+    next_cursor: str = Field(..., description="下一次请求使用的游标")
+    has_more: bool = Field(False, description="结果被 limit 截断，应立即继续请求")
+    reset: bool = Field(False, description="游标超过了现有的最大消息ID（数据已被清空），消费者应重新同步")
+
+
+class SessionSummary(BaseModel):
+    """会话概要"""
+    session_id: str
+    message_count: int = Field(..., description="消息数")
+    last_message_id: int = Field(..., description="最后一条消息的ID")
+    last_message_at: Optional[str] = Field(None, description="最后一条消息的时间")
+    last_preview: str = Field("", description="最后一条消息的预览文本，图片为 [图片]")
+
+
+class SessionListResponse(BaseModel):
+    """会话列表响应模型"""
+    sessions: List[SessionSummary]
+    total: int = Field(..., description="会话总数")
+    next_offset: Optional[int] = Field(None, description="下一页的 offset，没有更多会话时为空")
 
 
 class UrlRequest(BaseModel):
@@ -75,3 +137,11 @@ class ApiKeyResponse(BaseModel):
 class ApiKeysResponse(BaseModel):
     """API密钥列表响应模型"""
     keys: List[ApiKeyResponse]
+
+
+class CacheStatsResponse(BaseModel):
+    """配置缓存统计响应模型"""
+    hits: int = Field(..., description="命中次数")
+    misses: int = Field(..., description="未命中次数（即读取数据库的次数）")
+    size: int = Field(..., description="已缓存的配置项数量")
+    keys: Dict[str, Dict[str, Any]] = Field(..., description="各配置项的命中统计")
@@ -0,0 +1,20 @@
+"""
+JSON 序列化工具
+
+安装了 orjson 时使用 orjson（比标准库快数倍且直接输出 bytes），
+否则退回标准库 json。
+"""
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    """序列化为 UTF-8 编码的 JSON"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
@@ -1,52 +1,321 @@
 """
 业务服务层
 """
-from typing import List, Optional, Dict, Any
+import asyncio
+import base64
+import binascii
+import time
+from datetime import datetime
+from typing import List, Optional, Dict, Any, Iterator, Tuple
 from loguru import logger
+from peewee import fn
 
 from backend.models import (
-    ChatMessage, BackgroundConfig, SpriteConfig, 
-    AvatarConfig, ThemeConfig, ApiKeyConfig, db
+    ChatMessage, ChatBlob, ChatSession, BackgroundConfig, SpriteConfig, 
+    AvatarConfig, ThemeConfig, ApiKeyConfig, AppMeta, SEARCH_INDEX_TABLE, db, message_db
 )
+from backend.blobs import blob_store, sniff_mime_type
+from backend.images import image_pipeline
 from backend.schemas import MessageRequest, MessageResponse
+from backend.events import message_broker
+from backend.writer import message_writer
+from backend.cache import config_cache
+from backend.serialization import dumps
+from backend.database import run_in_db
+from backend.metrics import timed_query, messages_ingested, message_payload_bytes, message_batch_size
+
+
+# 完成旧图片迁移后写入 PRAGMA user_version 的值
+LEGACY_IMAGES_MIGRATED_VERSION = 1
+
+# ChatBlob.derivatives_status 的取值
+DERIVATIVES_PENDING = 0
+DERIVATIVES_READY = 1
+DERIVATIVES_INVALID = -1
 
 
 class ChatService:
     """聊天服务"""
     
+    # 消息查询只取响应需要的列
+    _MESSAGE_COLUMNS = (
+        ChatMessage.id, ChatMessage.session_id, ChatMessage.from_user, ChatMessage.text,
+        ChatMessage.type, ChatMessage.image_b64, ChatMessage.image_hash,
+        ChatMessage.thumb_hash, ChatMessage.display_hash
+    )
+    
+    @staticmethod
+    def _image_urls(image_hash: str, thumb_hash: str, display_hash: str) -> Dict[str, str]:
+        """原图、缩略图、展示图地址，缺少衍生版本时退回原图"""
+        if not image_hash:
+            return {"image_url": "", "thumb_url": "", "display_url": ""}
+        image_url = f"/blobs/{image_hash}"
+        return {
+            "image_url": image_url,
+            "thumb_url": f"/blobs/{thumb_hash}" if thumb_hash else image_url,
+            "display_url": f"/blobs/{display_hash}" if display_hash else image_url,
+        }
+    
     @staticmethod
-    def get_messages(session_id: str = 'default') -> List[MessageResponse]:
-        """获取会话消息列表"""
+    def _to_response(msg: ChatMessage) -> MessageResponse:
+        """将消息记录转换为响应模型"""
+        return MessageResponse(
+            id=msg.id,
+            session_id=msg.session_id,
+            from_user=msg.from_user or "",
+            text=msg.text or "",
+            type=msg.type or "text",
+            image_b64=msg.image_b64 or "",
+            image_hash=msg.image_hash or "",
+            **ChatService._image_urls(msg.image_hash, msg.thumb_hash, msg.display_hash)
+        )
+    
+    @staticmethod
+    def _message_query(session_id: str, after_id: Optional[int] = None,
+                       before_id: Optional[int] = None, limit: Optional[int] = None,
+                       exclude_from_user: Optional[str] = None):
+        """
+        构造消息查询，返回 (query, reverse)
+
+        reverse 为 True 时查询按ID降序取最新的 limit 条，结果需要反转为升序。
+        """
+        query = (ChatMessage
+                 .select(*ChatService._MESSAGE_COLUMNS)
+                 .where(ChatMessage.session_id == session_id))
+        if exclude_from_user is not None:
+            query = query.where(ChatMessage.from_user != exclude_from_user)
+        if after_id is not None:
+            query = query.where(ChatMessage.id > after_id)
+        if before_id is not None:
+            query = query.where(ChatMessage.id < before_id)
+        
+        if limit is not None and after_id is None:
+            return query.order_by(ChatMessage.id.desc()).limit(limit), True
+        query = query.order_by(ChatMessage.id.asc())
+        if limit is not None:
+            query = query.limit(limit)
+        return query, False
+    
+    @staticmethod
+    def _row_to_dict(row: tuple) -> Dict[str, Any]:
+        """将 _MESSAGE_COLUMNS 顺序的元组转换为响应字典（与 MessageResponse 字段一致）"""
+        msg_id, session_id, from_user, text, msg_type, image_b64, image_hash, thumb_hash, display_hash = row
+        return {
+            "id": msg_id,
+            "session_id": session_id,
+            "from_user": from_user or "",
+            "text": text or "",
+            "type": msg_type or "text",
+            "image_b64": image_b64 or "",
+            "image_hash": image_hash or "",
+            **ChatService._image_urls(image_hash, thumb_hash, display_hash)
+        }
+    
+    @staticmethod
+    def get_messages(session_id: str = 'default', after_id: Optional[int] = None,
+                     before_id: Optional[int] = None, limit: Optional[int] = None,
+                     exclude_from_user: Optional[str] = None) -> List[MessageResponse]:
+        """
+        获取会话消息列表（按消息ID升序）
+
+        - after_id: 只返回ID大于该值的消息，用于增量拉取
+        - before_id: 只返回ID小于该值的消息，用于向前翻页
+        - limit: 最多返回条数；未指定 after_id 时返回最新的 limit 条
+        - exclude_from_user: 不返回该发送者的消息（如适配器排除机器人自己的消息）
+        """
+        return [
+            MessageResponse(**row)
+            for row in ChatService.get_message_rows(session_id, after_id, before_id, limit, exclude_from_user)
+        ]
+    
+    @staticmethod
+    @timed_query
+    def get_message_rows(session_id: str = 'default', after_id: Optional[int] = None,
+                         before_id: Optional[int] = None, limit: Optional[int] = None,
+                         exclude_from_user: Optional[str] = None) -> List[Dict[str, Any]]:
+        """与 get_messages 相同，但直接返回字典，不构造模型对象"""
         try:
-            messages = (ChatMessage
-                       .select()
-                       .where(ChatMessage.session_id == session_id)
-                       .order_by(ChatMessage.created_at.asc()))
-            
-            return [
-                MessageResponse(
-                    from_user=msg.from_user or "",
-                    text=msg.text or "",
-                    type=msg.type or "text",
-                    image_b64=msg.image_b64 or ""
-                )
-                for msg in messages
-            ]
+            query, reverse = ChatService._message_query(session_id, after_id, before_id, limit, exclude_from_user)
+            with message_db.route(session_id):
+                rows = [ChatService._row_to_dict(row) for row in query.tuples()]
+            if reverse:
+                rows.reverse()
+            return rows
         except Exception as e:
             logger.error(f"获取消息失败: {e}")
             return []
     
     @staticmethod
-    def send_message(message: MessageRequest, session_id: str = 'default') -> bool:
-        """发送消息"""
+    @timed_query
+    def get_last_message_id(session_id: str = 'default') -> int:
+        """获取会话最新一条消息的ID，没有消息时返回 0"""
         try:
-            ChatMessage.create(
-                session_id=session_id,
-                from_user=message.from_user,
-                text=message.text or "",
-                type=message.type or "text",
-                image_b64=message.image_b64 or ""
-            )
+            with message_db.route(session_id):
+                return (ChatMessage
+                        .select(fn.MAX(ChatMessage.id))
+                        .where(ChatMessage.session_id == session_id)
+                        .scalar()) or 0
+        except Exception as e:
+            logger.error(f"获取最新消息ID失败: {e}")
+            return 0
+    
+    @staticmethod
+    @timed_query
+    def get_max_message_id() -> Optional[int]:
+        """获取当前消息库（分片）中最大的消息ID，没有消息时返回 0，查询失败时返回 None"""
+        try:
+            return ChatService._max_message_id()
+        except Exception as e:
+            logger.error(f"获取最大消息ID失败: {e}")
+            return None
+    
+    @staticmethod
+    def _max_message_id() -> int:
+        return ChatMessage.select(fn.MAX(ChatMessage.id)).scalar() or 0
+    
+    @staticmethod
+    @timed_query
+    def get_messages_since(after_id: int, limit: int) -> List[MessageResponse]:
+        """获取当前消息库（分片）中ID大于 after_id 的消息（按ID升序）"""
+        try:
+            query = (ChatMessage
+                     .select(*ChatService._MESSAGE_COLUMNS)
+                     .where(ChatMessage.id > after_id)
+                     .order_by(ChatMessage.id.asc())
+                     .limit(limit))
+            return [MessageResponse(**ChatService._row_to_dict(row)) for row in query.tuples()]
+        except Exception as e:
+            logger.error(f"获取新消息失败: {e}")
+            return []
+    
+    @staticmethod
+    @timed_query
+    def get_feed_head() -> Optional[List[int]]:
+        """各消息分片（未分片时只有主库）当前最大的消息ID，作为 /messages/wait 的初始游标；查询失败时返回 None"""
+        try:
+            return [ChatService._max_message_id() for _ in message_db.each_shard()]
+        except Exception as e:
+            logger.error(f"获取消息游标失败: {e}")
+            return None
+    
+    @staticmethod
+    @timed_query
+    def get_feed(cursors: List[int], limit: int, exclude_from_user: Optional[str] = None) -> Dict[str, Any]:
+        """
+        获取所有会话中游标之后的新消息（/messages/wait 使用）
+
+        cursors 为各消息分片已读取的最大消息ID，每个分片最多返回 limit 条（按ID升序，
+        同一会话的消息一定在同一分片中）。返回 {"messages", "cursors", "has_more", "reset"}；
+        未被截断时游标越过被排除的消息。某个分片的游标大于其中最大的消息ID时（数据被
+        清空后ID重新分配），该分片从头读取并把 reset 置为 True。查询失败时不返回消息，游标不变。
+        """
+        try:
+            messages: List[Dict[str, Any]] = []
+            next_cursors: List[int] = []
+            has_more = reset = False
+            for index, _ in enumerate(message_db.each_shard()):
+                after_id = cursors[index] if index < len(cursors) else 0
+                # 在查询之前读取：不超过该ID的未排除消息都会出现在结果中
+                upper_id = ChatService._max_message_id()
+                if after_id > upper_id:
+                    after_id, reset = 0, True
+                query = (ChatMessage
+                         .select(*ChatService._MESSAGE_COLUMNS)
+                         .where(ChatMessage.id > after_id))
+                if exclude_from_user is not None:
+                    query = query.where(ChatMessage.from_user != exclude_from_user)
+                rows = [ChatService._row_to_dict(row)
+                        for row in query.order_by(ChatMessage.id.asc()).limit(limit).tuples()]
+                if len(rows) >= limit:
+                    has_more = True
+                    next_cursors.append(rows[-1]['id'])
+                else:
+                    next_cursors.append(max(rows[-1]['id'] if rows else after_id, upper_id))
+                messages.extend(rows)
+            return {"messages": messages, "cursors": next_cursors, "has_more": has_more, "reset": reset}
+        except Exception as e:
+            logger.error(f"获取新消息失败: {e}")
+            return {"messages": [], "cursors": cursors, "has_more": False, "reset": False}
+    
+    @staticmethod
+    def iter_messages_json(session_id: str, after_id: int, upper_id: int,
+                           chunk_size: int = 500, exclude_from_user: Optional[str] = None) -> Iterator[bytes]:
+        """
+        以 JSON 数组分块输出 (after_id, upper_id] 范围内的消息
+
+        按ID分页查询，每次迭代只执行一次查询并只持有一个分块，内存占用
+        与历史长度无关；每次查询独立完成，迭代可以跨线程进行。
+        """
+        yield b'['
+        cursor = after_id
+        first = True
+        while cursor < upper_id:
+            rows = ChatService._fetch_chunk(session_id, cursor, upper_id, chunk_size, exclude_from_user)
+            if not rows:
+                break
+            # 去掉数组两端的方括号后拼接
+            chunk = dumps(rows)[1:-1]
+            yield chunk if first else b',' + chunk
+            first = False
+            cursor = rows[-1]['id']
+            if len(rows) < chunk_size:
+                break
+        yield b']'
+    
+    @staticmethod
+    @timed_query
+    def _fetch_chunk(session_id: str, after_id: int, upper_id: int, chunk_size: int,
+                     exclude_from_user: Optional[str] = None) -> List[Dict[str, Any]]:
+        """查询 (after_id, upper_id] 范围内最早的 chunk_size 条消息"""
+        query, _ = ChatService._message_query(session_id, after_id=after_id, limit=chunk_size,
+                                              exclude_from_user=exclude_from_user)
+        with message_db.route(session_id):
+            return [ChatService._row_to_dict(row) for row in query.where(ChatMessage.id <= upper_id).tuples()]
+    
+    @staticmethod
+    def _build_row(message: MessageRequest, session_id: str,
+                   image: Optional[Tuple[str, str, str]] = None) -> Dict[str, Any]:
+        """
+        构造待写入的消息记录
+
+        image 为 prepare_message_image 已准备好的 (image_hash, thumb_hash, display_hash)；
+        未提供时在此存入 blob 并生成缩略图与展示图。
+        """
+        image_b64 = message.image_b64 or ""
+        message_payload_bytes.observe(len((message.text or "").encode('utf-8')) + len(image_b64))
+        if image is not None:
+            image_hash, thumb_hash, display_hash = image
+        else:
+            image_hash = BlobService.store_base64(image_b64) if image_b64 else None
+            # 生成缩略图与展示图，列表中引用缩略图，原图按需加载
+            thumb_hash, display_hash = BlobService.ensure_derivatives(image_hash) if image_hash else ("", "")
+        return dict(
+            session_id=session_id,
+            from_user=message.from_user,
+            text=message.text or "",
+            type=message.type or "text",
+            # 图片存入 blob 后消息只保留哈希；无法解码的数据按原样保存
+            image_b64="" if image_hash else image_b64,
+            image_hash=image_hash or "",
+            thumb_hash=thumb_hash,
+            display_hash=display_hash,
+            created_at=datetime.now()
+        )
+    
+    @staticmethod
+    @timed_query
+    def send_message(message: MessageRequest, session_id: str = 'default',
+                     image: Optional[Tuple[str, str, str]] = None) -> bool:
+        """发送消息，image 见 _build_row"""
+        try:
+            row = ChatService._build_row(message, session_id, image)
+            # 经写入队列与同时到达的消息合并提交，提交完成后返回
+            message_id = message_writer.submit([row])[0].result()
+            msg = ChatMessage(id=message_id, **row)
+            
+            # 推送给该会话的实时订阅者
+            message_broker.publish(session_id, [ChatService._to_response(msg)])
+            messages_ingested.inc('single', 'success')
             
             content_info = message.text if message.text else '[图片]'
             logger.info(f"[聊天服务] 消息保存成功: {message.from_user}: {content_info} [session_id={session_id}]")
@@ -54,30 +323,570 @@ class ChatService:
             
         except Exception as e:
             logger.error(f"发送消息失败: {e}")
+            messages_ingested.inc('single', 'failed')
             return False
+    
+    @staticmethod
+    @timed_query
+    def send_image(image_hash: str, mime_type: str, size: int, from_user: str = 'web',
+                   session_id: str = 'default', derivatives: Optional[Tuple[str, str]] = None) -> Optional[MessageResponse]:
+        """
+        发送已写入 blob 存储的上传图片，返回保存后的消息，失败返回 None
+
+        derivatives 为 prepare_derivatives 已生成的 (thumb_hash, display_hash)，未提供时在此生成。
+        """
+        try:
+            message_payload_bytes.observe(size)
+            BlobService.register(image_hash, mime_type, size)
+            thumb_hash, display_hash = derivatives or BlobService.ensure_derivatives(image_hash)
+            row = dict(
+                session_id=session_id,
+                from_user=from_user,
+                text="",
+                type="image",
+                image_b64="",
+                image_hash=image_hash,
+                thumb_hash=thumb_hash,
+                display_hash=display_hash,
+                created_at=datetime.now()
+            )
+            message_id = message_writer.submit([row])[0].result()
+            response = ChatService._to_response(ChatMessage(id=message_id, **row))
+            
+            message_broker.publish(session_id, [response])
+            messages_ingested.inc('upload', 'success')
+            logger.info(f"[聊天服务] 图片上传成功: {from_user}: [图片 {size} 字节] [session_id={session_id}]")
+            return response
+            
+        except Exception as e:
+            logger.error(f"保存上传图片失败: {e}")
+            messages_ingested.inc('upload', 'failed')
+            return None
+    
+    @staticmethod
+    @timed_query
+    def send_messages(messages: List[MessageRequest], session_id: str = 'default',
+                      images: Optional[List[Optional[Tuple[str, str, str]]]] = None) -> List[Dict[str, Any]]:
+        """
+        批量发送消息，所有消息在同一个事务中写入
+
+        每条消息可单独指定 session_id，未指定时使用参数 session_id；images 与 messages
+        一一对应，见 _build_row。返回与输入一一对应的结果: {"index", "success", "id", "message"}
+        """
+        results: List[Dict[str, Any]] = [
+            {"index": index, "success": False, "id": None, "message": None}
+            for index in range(len(messages))
+        ]
+        pending = []
+        for index, message in enumerate(messages):
+            try:
+                image = images[index] if images is not None else None
+                pending.append((index, ChatService._build_row(message, message.session_id or session_id, image)))
+            except Exception as e:
+                results[index]["message"] = f"消息处理失败: {e}"
+        
+        futures = message_writer.submit([row for _, row in pending])
+        published: Dict[str, List[MessageResponse]] = {}
+        for (index, row), future in zip(pending, futures):
+            try:
+                msg = ChatMessage(id=future.result(), **row)
+            except Exception as e:
+                logger.error(f"批量发送消息失败 [index={index}]: {e}")
+                results[index]["message"] = f"消息保存失败: {e}"
+                continue
+            results[index].update(success=True, id=msg.id, message="消息发送成功")
+            published.setdefault(msg.session_id, []).append(ChatService._to_response(msg))
+        
+        for target_session, responses in published.items():
+            message_broker.publish(target_session, responses)
+        
+        succeeded = sum(1 for result in results if result["success"])
+        message_batch_size.observe(len(messages))
+        messages_ingested.inc('batch', 'success', amount=succeeded)
+        if succeeded < len(messages):
+            messages_ingested.inc('batch', 'failed', amount=len(messages) - succeeded)
+        logger.info(f"[聊天服务] 批量保存消息: {succeeded}/{len(messages)} 条成功")
+        return results
+
+
+
+async def prepare_derivatives(blob_hash: str, mime_type: Optional[str] = None, size: int = 0) -> Tuple[str, str]:
+    """
+    生成图片的缩略图与展示图，返回 (thumb_hash, display_hash)
+
+    只有查询和保存登记信息时占用数据库线程，读取原图和等待图片处理进程池
+    都在数据库线程池之外。mime_type 见 BlobService.get_derivatives。
+    """
+    derivatives = await run_in_db(BlobService.get_derivatives, blob_hash, mime_type, size)
+    if derivatives is not None:
+        return derivatives
+    try:
+        data = await asyncio.to_thread(blob_store.read, blob_hash)
+        result = await image_pipeline.process_async(data)
+    except Exception as e:
+        logger.error(f"生成图片缩略图失败: {e}")
+        return "", ""
+    return await run_in_db(BlobService.save_derivatives, blob_hash, result)
+
+
+async def prepare_message_image(message: MessageRequest) -> Optional[Tuple[str, str, str]]:
+    """
+    把消息中的 Base64 图片存入 blob 并生成衍生版本，返回 (image_hash, thumb_hash, display_hash)
+
+    没有图片或处理失败时返回 None（由 _build_row 按原方式处理）；不是有效 Base64 时
+    image_hash 为空，消息按原样保存图片数据。
+    """
+    if not message.image_b64:
+        return None
+    try:
+        image_hash = await run_in_db(BlobService.store_base64, message.image_b64)
+    except Exception as e:
+        logger.error(f"保存消息图片失败: {e}")
+        return None
+    if not image_hash:
+        return "", "", ""
+    return (image_hash, *await prepare_derivatives(image_hash))
+
+
+class SearchService:
+    """消息全文搜索服务"""
+    
+    # 片段前后保留的词元数（trigram 分词下约等于字符数）
+    SNIPPET_TOKENS = 24
+    
+    @staticmethod
+    @timed_query
+    def search(query: str, session_id: Optional[str] = None,
+               limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        """按相关度搜索消息文本，可限定会话"""
+        query = query.strip()
+        if not query:
+            return []
+        try:
+            if session_id is not None:
+                with message_db.route(session_id):
+                    hits = SearchService._search_shard(query, session_id, limit, offset)
+            elif not message_db.sharded:
+                hits = SearchService._search_shard(query, None, limit, offset)
+            else:
+                # 跨分片搜索：每个分片取前 offset + limit 条，合并后再分页。
+                # 全文索引结果按相关度合并，LIKE 结果按时间倒序合并
+                hits = []
+                for _ in message_db.each_shard():
+                    hits.extend(SearchService._search_shard(query, None, offset + limit, 0))
+                hits.sort(key=lambda hit: hit["created_at"] or "", reverse=True)
+                hits.sort(key=lambda hit: hit.get("_rank", 0))
+                hits = hits[offset:offset + limit]
+            for hit in hits:
+                hit.pop("_rank", None)
+            return hits
+        except Exception as e:
+            logger.error(f"搜索消息失败: {e}")
+            return []
+    
+    @staticmethod
+    def _search_shard(query: str, session_id: Optional[str], limit: int, offset: int) -> List[Dict[str, Any]]:
+        # trigram 分词无法匹配不足三个字符的词，此时退化为 LIKE
+        if message_db.table_exists(SEARCH_INDEX_TABLE) and min(len(term) for term in query.split()) >= 3:
+            return SearchService._search_index(query, session_id, limit, offset)
+        return SearchService._search_like(query, session_id, limit, offset)
+    
+    @staticmethod
+    def _search_index(query: str, session_id: Optional[str], limit: int, offset: int) -> List[Dict[str, Any]]:
+        # 每个词作为短语匹配，避免用户输入被解析为 FTS5 查询语法
+        match = ' '.join('"' + term.replace('"', '""') + '"' for term in query.split())
+        sql = (
+            f"SELECT m.id, m.session_id, m.from_user, m.type, m.text, m.created_at, "
+            f"snippet({SEARCH_INDEX_TABLE}, 0, '<mark>', '</mark>', '…', {SearchService.SNIPPET_TOKENS}), rank "
+            f"FROM {SEARCH_INDEX_TABLE} JOIN chat_messages AS m ON m.id = {SEARCH_INDEX_TABLE}.rowid "
+            f"WHERE {SEARCH_INDEX_TABLE} MATCH ?"
+        )
+        params: List[Any] = [match]
+        if session_id is not None:
+            sql += " AND m.session_id = ?"
+            params.append(session_id)
+        sql += " ORDER BY rank LIMIT ? OFFSET ?"
+        params += [limit, offset]
+        return [
+            {**SearchService._to_hit(row[:-1]), "_rank": row[-1]}
+            for row in message_db.execute_sql(sql, params).fetchall()
+        ]
+    
+    @staticmethod
+    def _search_like(query: str, session_id: Optional[str], limit: int, offset: int) -> List[Dict[str, Any]]:
+        condition = ChatMessage.text.contains(query)
+        if session_id is not None:
+            condition &= ChatMessage.session_id == session_id
+        rows = (ChatMessage
+                .select(ChatMessage.id, ChatMessage.session_id, ChatMessage.from_user,
+                        ChatMessage.type, ChatMessage.text, ChatMessage.created_at)
+                .where(condition)
+                .order_by(ChatMessage.id.desc())
+                .limit(limit)
+                .offset(offset)
+                .tuples())
+        hits = []
+        for row in rows:
+            text = row[4]
+            position = text.find(query)
+            start = max(position - SearchService.SNIPPET_TOKENS, 0)
+            end = position + len(query)
+            snippet = (
+                ('…' if start > 0 else '') + text[start:position]
+                + f"<mark>{text[position:end]}</mark>"
+                + text[end:end + SearchService.SNIPPET_TOKENS]
+                + ('…' if end + SearchService.SNIPPET_TOKENS < len(text) else '')
+            ) if position >= 0 else text[:SearchService.SNIPPET_TOKENS * 2]
+            hits.append(SearchService._to_hit((*row, snippet)))
+        return hits
+    
+    @staticmethod
+    def _to_hit(row) -> Dict[str, Any]:
+        msg_id, session_id, from_user, msg_type, text, created_at, snippet = row
+        return {
+            "id": msg_id,
+            "session_id": session_id,
+            "from_user": from_user,
+            "type": msg_type,
+            "text": text,
+            "snippet": snippet,
+            "created_at": str(created_at) if created_at is not None else None
+        }
+
+
+class SessionService:
+    """会话列表服务，读取由触发器维护的 chat_sessions"""
+    
+    # 排序方式对应的排序字段（分片存储时各分片的消息ID不可比较，按时间排序）
+    SORT_ORDERS = {
+        'recent': (ChatSession.last_message_at.desc(),),
+        'count': (ChatSession.message_count.desc(), ChatSession.last_message_at.desc()),
+        'name': (ChatSession.session_id,),
+    }
+    
+    @staticmethod
+    @timed_query
+    def list_sessions(sort: str = 'recent', limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+        """分页列出会话，返回 {"sessions", "total"}"""
+        try:
+            if not message_db.sharded:
+                return {
+                    "sessions": SessionService._query(sort, limit, offset),
+                    "total": ChatSession.select().count()
+                }
+            # 每个分片取前 offset + limit 个会话，合并后再分页
+            sessions, total = [], 0
+            for _ in message_db.each_shard():
+                sessions.extend(SessionService._query(sort, offset + limit, 0))
+                total += ChatSession.select().count()
+            if sort == 'name':
+                sessions.sort(key=lambda item: item["session_id"])
+            else:
+                sessions.sort(key=lambda item: item["last_message_at"] or "", reverse=True)
+                if sort == 'count':
+                    sessions.sort(key=lambda item: item["message_count"], reverse=True)
+            return {"sessions": sessions[offset:offset + limit], "total": total}
+        except Exception as e:
+            logger.error(f"获取会话列表失败: {e}")
+            return {"sessions": [], "total": 0}
+
+
+    @staticmethod
+    def _query(sort: str, limit: int, offset: int) -> List[Dict[str, Any]]:
+        rows = (ChatSession
+                .select(ChatSession.session_id, ChatSession.message_count, ChatSession.last_message_id,
+                        ChatSession.last_message_at, ChatSession.last_preview)
+                .order_by(*SessionService.SORT_ORDERS[sort])
+                .limit(limit)
+                .offset(offset)
+                .tuples())
+        return [
+            {
+                "session_id": session_id,
+                "message_count": message_count,
+                "last_message_id": last_message_id,
+                "last_message_at": str(last_message_at) if last_message_at is not None else None,
+                "last_preview": last_preview or "",
+            }
+            for session_id, message_count, last_message_id, last_message_at, last_preview in rows
+        ]
+
+
+class BlobService:
+    """图片等二进制内容服务"""
+    
+    # app_meta 中记录补充缩略图任务租约到期时间（Unix 时间戳）的键
+    _BACKFILL_LEASE = 'derivatives_backfill_lease'
+    _BACKFILL_LEASE_SECONDS = 60
+    
+    @staticmethod
+    @timed_query
+    def store_bytes(data: bytes) -> str:
+        """存储二进制内容，返回其哈希"""
+        blob_hash = blob_store.put_bytes(data)
+        BlobService.register(blob_hash, sniff_mime_type(data[:16]), len(data))
+        return blob_hash
+    
+    @staticmethod
+    def register(blob_hash: str, mime_type: str, size: int) -> None:
+        """登记已写入存储的内容，已登记时忽略"""
+        ChatBlob.insert(
+            hash=blob_hash,
+            mime_type=mime_type,
+            size=size
+        ).on_conflict_ignore().execute()
+    
+    @staticmethod
+    def discard_upload(blob_hash: str, mtime_ns: int, mime_type: str, size: int) -> None:
+        """
+        删除发送失败、由本次上传新建的图片
+
+        仍被消息引用，或期间被其他上传、消息再次写入（见 BlobStore.claim）的内容保留。
+        衍生版本可能与其他图片共用，不在这里删除。
+        """
+        try:
+            if BlobService._is_referenced(blob_hash) or not blob_store.release(blob_hash, mtime_ns):
+                return
+            ChatBlob.delete().where(ChatBlob.hash == blob_hash).execute()
+            # 删除期间相同内容被重新写入时，恢复登记
+            if blob_store.exists(blob_hash):
+                BlobService.register(blob_hash, mime_type, size)
+        except Exception as e:
+            logger.error(f"清理上传图片失败: {e}")
+    
+    @staticmethod
+    def _is_referenced(blob_hash: str) -> bool:
+        """内容是否被消息（任一分片）或其他图片的衍生版本引用"""
+        if ChatBlob.select().where((ChatBlob.thumb_hash == blob_hash) | (ChatBlob.display_hash == blob_hash)).exists():
+            return True
+        for _ in message_db.each_shard():
+            if ChatMessage.select().where(
+                (ChatMessage.image_hash == blob_hash) |
+                (ChatMessage.thumb_hash == blob_hash) |
+                (ChatMessage.display_hash == blob_hash)
+            ).exists():
+                return True
+        return False
+    
+    @staticmethod
+    def store_base64(data: str) -> Optional[str]:
+        """解码 Base64（可带 data URL 前缀）并存储，解码失败返回 None"""
+        if data.startswith('data:') and ',' in data:
+            data = data.split(',', 1)[1]
+        try:
+            raw = base64.b64decode(data, validate=True)
+        except (binascii.Error, ValueError) as e:
+            logger.warning(f"图片Base64解码失败，按原样保存: {e}")
+            return None
+        if not raw:
+            return None
+        return BlobService.store_bytes(raw)
+    
+    @staticmethod
+    def ensure_derivatives(blob_hash: str) -> Tuple[str, str]:
+        """
+        为图片生成缩略图与展示图（已生成过时直接返回），返回 (thumb_hash, display_hash)
+
+        在当前线程等待图片处理进程池；服务端请求使用 prepare_derivatives，
+        不在等待期间占用数据库线程。未安装 Pillow 或不是有效图片时返回空字符串。
+        """
+        derivatives = BlobService.get_derivatives(blob_hash)
+        if derivatives is not None:
+            return derivatives
+        try:
+            result = image_pipeline.process(blob_store.read(blob_hash))
+        except Exception as e:
+            logger.error(f"生成图片缩略图失败: {e}")
+            return "", ""
+        return BlobService.save_derivatives(blob_hash, result)
+    
+    @staticmethod
+    @timed_query
+    def get_derivatives(blob_hash: str, mime_type: Optional[str] = None, size: int = 0) -> Optional[Tuple[str, str]]:
+        """
+        已生成（或不能生成）衍生版本时返回 (thumb_hash, display_hash)，需要生成时返回 None
+
+        指定 mime_type 时先登记内容（刚上传、尚未登记的图片）。
+        """
+        try:
+            if mime_type is not None:
+                BlobService.register(blob_hash, mime_type, size)
+            blob = ChatBlob.get_or_none(ChatBlob.hash == blob_hash)
+            if blob is None or blob.derivatives_status != DERIVATIVES_PENDING:
+                return (blob.thumb_hash, blob.display_hash) if blob else ("", "")
+            if not image_pipeline.enabled or not blob.mime_type.startswith('image/'):
+                return "", ""
+            return None
+        except Exception as e:
+            logger.error(f"获取图片缩略图失败: {e}")
+            return "", ""
+    
+    @staticmethod
+    @timed_query
+    def save_derivatives(blob_hash: str, result: Dict[str, Any]) -> Tuple[str, str]:
+        """保存图片处理进程池生成的衍生版本，返回 (thumb_hash, display_hash)"""
+        try:
+            if not result['valid']:
+                logger.warning(f"图片解码失败，不生成缩略图 [{blob_hash[:12]}]: {result['error']}")
+                ChatBlob.update(derivatives_status=DERIVATIVES_INVALID).where(ChatBlob.hash == blob_hash).execute()
+                return "", ""
+            
+            thumb_hash = BlobService.store_bytes(result['thumb']) if result['thumb'] else ""
+            display_hash = BlobService.store_bytes(result['display']) if result['display'] else ""
+            (ChatBlob
+             .update(width=result['width'], height=result['height'], thumb_hash=thumb_hash,
+                     display_hash=display_hash, derivatives_status=DERIVATIVES_READY)
+             .where(ChatBlob.hash == blob_hash)
+             .execute())
+            return thumb_hash, display_hash
+        except Exception as e:
+            logger.error(f"保存图片缩略图失败: {e}")
+            return "", ""
+    
+    @staticmethod
+    def claim_backfill(renew: bool = False) -> bool:
+        """抢占补充缩略图任务的执行权（renew 时由持有者续期），多进程部署时只由一个进程执行"""
+        try:
+            now = int(time.time())
+            lease_until = now + BlobService._BACKFILL_LEASE_SECONDS
+            if renew:
+                (AppMeta
+                 .update(value=lease_until)
+                 .where(AppMeta.key == BlobService._BACKFILL_LEASE)
+                 .execute())
+                return True
+            return AppMeta.claim(BlobService._BACKFILL_LEASE, now, lease_until)
+        except Exception as e:
+            logger.error(f"获取缩略图补充任务执行权失败: {e}")
+            return False
+    
+    @staticmethod
+    def backfill_batch(after_id: int = 0, batch_size: int = 50, shard: int = 0) -> Tuple[int, List[str]]:
+        """
+        查找一批需要补充缩略图的图片消息（分片存储时查找指定分片）
+
+        返回 (本批最后一条消息ID, 去重后的图片哈希)，没有更多消息时ID为 0。
+        """
+        with message_db.use(message_db.shards[shard]):
+            rows = list(ChatMessage
+                        .select(ChatMessage.id, ChatMessage.image_hash)
+                        .where((ChatMessage.id > after_id)
+                               & (ChatMessage.image_hash != '')
+                               & (ChatMessage.thumb_hash == ''))
+                        .order_by(ChatMessage.id)
+                        .limit(batch_size)
+                        .tuples())
+        if not rows:
+            return 0, []
+        return rows[-1][0], list(dict.fromkeys(image_hash for _, image_hash in rows))
+    
+    @staticmethod
+    def apply_derivatives(image_hash: str, thumb_hash: str, display_hash: str, shard: int = 0) -> int:
+        """为引用该图片、还没有缩略图的消息填入衍生版本，返回更新的消息数"""
+        with message_db.use(message_db.shards[shard]):
+            return (ChatMessage
+                    .update(thumb_hash=thumb_hash, display_hash=display_hash)
+                    .where((ChatMessage.image_hash == image_hash) & (ChatMessage.thumb_hash == ''))
+                    .execute())
+    
+    @staticmethod
+    @timed_query
+    def get_blob(blob_hash: str) -> Optional[ChatBlob]:
+        """获取内容元数据，内容文件缺失时返回 None"""
+        try:
+            if not blob_store.is_valid_hash(blob_hash) or not blob_store.exists(blob_hash):
+                return None
+            return ChatBlob.get_or_none(ChatBlob.hash == blob_hash)
+        except Exception as e:
+            logger.error(f"获取图片数据失败: {e}")
+            return None
+    
+    @staticmethod
+    @timed_query
+    def migrate_legacy_images(batch_size: int = 100) -> int:
+        """将旧消息中内联的 Base64 图片迁移到 blob 存储（只执行一次）"""
+        migrated = 0
+        try:
+            for _ in message_db.each_shard():
+                migrated += BlobService._migrate_legacy_images(batch_size)
+            if migrated:
+                logger.info(f"已迁移 {migrated} 条旧图片消息到 blob 存储")
+        except Exception as e:
+            logger.error(f"迁移旧图片消息失败: {e}")
+        return migrated
+    
+    @staticmethod
+    def _migrate_legacy_images(batch_size: int) -> int:
+        """迁移当前消息库（分片）中的旧图片，完成后记录在该库的 user_version 中"""
+        migrated = 0
+        last_id = 0
+        if message_db.pragma('user_version') >= LEGACY_IMAGES_MIGRATED_VERSION:
+            return 0
+        while True:
+            rows = list(ChatMessage
+                        .select(ChatMessage.id, ChatMessage.image_b64)
+                        .where((ChatMessage.id > last_id) & (ChatMessage.image_b64 != ''))
+                        .order_by(ChatMessage.id)
+                        .limit(batch_size))
+            if not rows:
+                break
+            last_id = rows[-1].id
+            with message_db.atomic():
+                for row in rows:
+                    image_hash = BlobService.store_base64(row.image_b64)
+                    if image_hash:
+                        (ChatMessage
+                         .update(image_hash=image_hash, image_b64='')
+                         .where(ChatMessage.id == row.id)
+                         .execute())
+                        migrated += 1
+        message_db.pragma('user_version', LEGACY_IMAGES_MIGRATED_VERSION)
+        return migrated
 
 
 class ConfigService:
-    """配置服务"""
+    """配置服务（读取走进程内缓存）"""
+    
+    @staticmethod
+    def warm_cache() -> None:
+        """启动时把常用配置加载到缓存"""
+        ConfigService.get_background()
+        ConfigService.get_sprite()
+        ConfigService.get_avatar_config()
+        ThemeService.get_theme()
+    
+    @staticmethod
+    def get_cache_stats() -> Dict[str, Any]:
+        """获取配置缓存命中统计"""
+        return config_cache.stats()
     
     @staticmethod
     def get_background() -> str:
         """获取背景配置"""
         try:
-            config = BackgroundConfig.get_or_none(BackgroundConfig.key == 'background_url')
-            return config.value if config else ""
+            return config_cache.get('background', ConfigService._load_background)
         except Exception as e:
             logger.error(f"获取背景配置失败: {e}")
             return ""
     
     @staticmethod
+    @timed_query
+    def _load_background() -> str:
+        config = BackgroundConfig.get_or_none(BackgroundConfig.key == 'background_url')
+        return config.value if config else ""
+    
+    @staticmethod
+    @timed_query
     def set_background(url: str) -> bool:
         """设置背景配置"""
         try:
-            BackgroundConfig.insert(
-                key='background_url', 
-                value=url
-            ).on_conflict_replace().execute()
+            with db.atomic():
+                BackgroundConfig.insert(
+                    key='background_url', 
+                    value=url
+                ).on_conflict_replace().execute()
+                AppMeta.bump(AppMeta.CONFIG_REVISION)
+            config_cache.set('background', url)
             return True
         except Exception as e:
             logger.error(f"设置背景配置失败: {e}")
@@ -87,20 +896,29 @@ class ConfigService:
     def get_sprite() -> str:
         """获取立绘配置"""
         try:
-            config = SpriteConfig.get_or_none(SpriteConfig.key == 'sprite_url')
-            return config.value if config else ""
+            return config_cache.get('sprite', ConfigService._load_sprite)
         except Exception as e:
             logger.error(f"获取立绘配置失败: {e}")
             return ""
     
     @staticmethod
+    @timed_query
+    def _load_sprite() -> str:
+        config = SpriteConfig.get_or_none(SpriteConfig.key == 'sprite_url')
+        return config.value if config else ""
+    
+    @staticmethod
+    @timed_query
     def set_sprite(url: str) -> bool:
         """设置立绘配置"""
         try:
-            SpriteConfig.insert(
-                key='sprite_url', 
-                value=url
-            ).on_conflict_replace().execute()
+            with db.atomic():
+                SpriteConfig.insert(
+                    key='sprite_url', 
+                    value=url
+                ).on_conflict_replace().execute()
+                AppMeta.bump(AppMeta.CONFIG_REVISION)
+            config_cache.set('sprite', url)
             return True
         except Exception as e:
             logger.error(f"设置立绘配置失败: {e}")
@@ -110,19 +928,9 @@ class ConfigService:
     def get_avatar_config() -> Dict[str, Dict[str, str]]:
         """获取头像配置"""
         try:
-            user_config = AvatarConfig.get_or_none(AvatarConfig.key == 'user')
-            bot_config = AvatarConfig.get_or_none(AvatarConfig.key == 'bot')
-            
-            return {
-                "user": {
-                    "name": user_config.name if user_config else '用户',
-                    "avatar": user_config.avatar if user_config else ''
-                },
-                "bot": {
-                    "name": bot_config.name if bot_config else '麦麦',
-                    "avatar": bot_config.avatar if bot_config else ''
-                }
-            }
+            config = config_cache.get('avatar_config', ConfigService._load_avatar_config)
+            # 返回副本，避免调用方修改缓存内容
+            return {role: dict(values) for role, values in config.items()}
         except Exception as e:
             logger.error(f"获取头像配置失败: {e}")
             return {
@@ -131,23 +939,38 @@ class ConfigService:
             }
     
     @staticmethod
+    @timed_query
+    def _load_avatar_config() -> Dict[str, Dict[str, str]]:
+        user_config = AvatarConfig.get_or_none(AvatarConfig.key == 'user')
+        bot_config = AvatarConfig.get_or_none(AvatarConfig.key == 'bot')
+        
+        return {
+            "user": {
+                "name": user_config.name if user_config else '用户',
+                "avatar": user_config.avatar if user_config else ''
+            },
+            "bot": {
+                "name": bot_config.name if bot_config else '麦麦',
+                "avatar": bot_config.avatar if bot_config else ''
+            }
+        }
+    
+    @staticmethod
+    @timed_query
     def set_avatar_config(user_config: Dict[str, str], bot_config: Dict[str, str]) -> bool:
         """设置头像配置"""
         try:
-            # 保存用户配置
-            AvatarConfig.insert(
-                key='user',
-                name=user_config.get('name', '用户'),
-                avatar=user_config.get('avatar', '')
-            ).on_conflict_replace().execute()
+            user = {"name": user_config.get('name', '用户'), "avatar": user_config.get('avatar', '')}
+            bot = {"name": bot_config.get('name', '麦麦'), "avatar": bot_config.get('avatar', '')}
             
-            # 保存机器人配置
-            AvatarConfig.insert(
-                key='bot',
-                name=bot_config.get('name', '麦麦'),
-                avatar=bot_config.get('avatar', '')
-            ).on_conflict_replace().execute()
+            with db.atomic():
+                # 保存用户配置
+                AvatarConfig.insert(key='user', **user).on_conflict_replace().execute()
+                # 保存机器人配置
+                AvatarConfig.insert(key='bot', **bot).on_conflict_replace().execute()
+                AppMeta.bump(AppMeta.CONFIG_REVISION)
             
+            config_cache.set('avatar_config', {"user": user, "bot": bot})
             return True
         except Exception as e:
             logger.error(f"设置头像配置失败: {e}")
@@ -161,20 +984,29 @@ class ThemeService:
     def get_theme() -> str:
         """获取主题配置"""
         try:
-            config = ThemeConfig.get_or_none(ThemeConfig.key == 'theme')
-            return config.value if config else 'auto'
+            return config_cache.get('theme', ThemeService._load_theme)
         except Exception as e:
             logger.error(f"获取主题配置失败: {e}")
             return 'auto'
     
     @staticmethod
+    @timed_query
+    def _load_theme() -> str:
+        config = ThemeConfig.get_or_none(ThemeConfig.key == 'theme')
+        return config.value if config else 'auto'
+    
+    @staticmethod
+    @timed_query
     def set_theme(theme: str) -> bool:
         """设置主题配置"""
         try:
-            ThemeConfig.insert(
-                key='theme',
-                value=theme
-            ).on_conflict_replace().execute()
+            with db.atomic():
+                ThemeConfig.insert(
+                    key='theme',
+                    value=theme
+                ).on_conflict_replace().execute()
+                AppMeta.bump(AppMeta.CONFIG_REVISION)
+            config_cache.set('theme', theme)
             logger.info(f"主题设置成功: {theme}")
             return True
         except Exception as e:
@@ -186,6 +1018,7 @@ class ApiKeyService:
     """API密钥服务"""
     
     @staticmethod
+    @timed_query
     def get_api_key(key: str) -> str:
         """获取API密钥"""
         try:
@@ -196,6 +1029,7 @@ class ApiKeyService:
             return ''
     
     @staticmethod
+    @timed_query
     def set_api_key(key: str, value: str) -> bool:
         """设置API密钥"""
         try:
@@ -210,6 +1044,7 @@ class ApiKeyService:
             return False
     
     @staticmethod
+    @timed_query
     def get_all_api_keys() -> List[Dict[str, str]]:
         """获取所有API密钥"""
         try:
@@ -224,16 +1059,26 @@ class DatabaseService:
     """数据库服务"""
     
     @staticmethod
+    @timed_query
     def clear_data() -> bool:
         """清空数据"""
         try:
             # 清空所有表的数据，但保留表结构
-            ChatMessage.delete().execute()
+            for _ in message_db.each_shard():
+                ChatMessage.delete().execute()
+            ChatBlob.delete().execute()
+            blob_store.clear()
             BackgroundConfig.delete().execute()
             SpriteConfig.delete().execute()
             AvatarConfig.delete().execute()
             ThemeConfig.delete().execute()
             ApiKeyConfig.delete().execute()
+            # 通知其他进程：配置已清空，消息ID将重新分配
+            with db.atomic():
+                AppMeta.bump(AppMeta.CONFIG_REVISION)
+                AppMeta.bump(AppMeta.MESSAGES_EPOCH)
+            config_cache.invalidate()
+            message_broker.invalidate()
             
             logger.info("数据清空成功")
             return True
@@ -242,23 +1087,52 @@ class DatabaseService:
             return False
     
     @staticmethod
+    @timed_query
     def clear_database() -> bool:
         """删除数据库文件"""
+        from backend.config import config
+        if config.multi_process or config.sharded:
+            # 其他工作进程仍持有数据库文件（或消息分散在多个分片文件中），
+            # 不删除文件，改为清空数据并回收空间
+            logger.warning("多进程或分片模式下不删除数据库文件，改为清空所有数据")
+            if not DatabaseService.clear_data():
+                return False
+            try:
+                db.execute_sql('VACUUM')
+                if config.sharded:
+                    for _ in message_db.each_shard():
+                        message_db.execute_sql('VACUUM')
+            except Exception as e:
+                logger.warning(f"回收数据库空间失败: {e}")
+            return True
+        
         try:
             import os
-            from backend.config import config
             
-            # 关闭数据库连接
+            # 写线程持有独立连接，先停止，重建数据库后再启动
+            writer_running = message_writer.running
+            message_writer.stop()
+            
+            # 关闭数据库连接（包括连接池中的空闲连接）
             db.close()
+            db.close_all()
             
-            # 删除数据库文件
+            # 删除数据库文件及 WAL 日志
             if os.path.exists(config.database_url):
                 os.remove(config.database_url)
                 logger.info(f"数据库文件删除成功: {config.database_url}")
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(config.database_url + suffix):
+                    os.remove(config.database_url + suffix)
+            blob_store.clear()
             
             # 重新初始化数据库
             from backend.models import initialize_database
             initialize_database()
+            config_cache.invalidate()
+            message_broker.invalidate()
+            if writer_running:
+                message_writer.start()
             
             logger.info("数据库重新初始化成功")
             return True
@@ -0,0 +1,173 @@
+"""
+消息分片
+
+所有会话共用一个 chat.db 时，所有写入竞争同一把 SQLite 写锁。开启分片
+（config.db_shards > 1）后，chat_messages 及其全文索引、会话索引按
+session_id 的哈希分散到多个数据库文件，每个分片有独立的连接池、写锁和
+写线程；配置、图片元数据等其他表仍在主库。
+
+ChatMessage / ChatSession 绑定的是 MessageDatabase：它把查询转发给当前
+线程选定的分片（线程局部变量），未分片时始终是主库。按会话访问消息时用
+route(session_id) 选定分片，跨会话的操作用 each_shard() 依次进入每个分片。
+
+拆分已有的 chat.db（先在配置中设置 db_shards）:
+    python -m backend.sharding split
+"""
+import argparse
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from peewee import Database, DatabaseProxy
+
+
+def shard_index(session_id: str, shard_count: int) -> int:
+    """会话所在的分片序号（CRC32 取模，跨进程、跨版本稳定）"""
+    if shard_count <= 1:
+        return 0
+    return zlib.crc32(session_id.encode('utf-8')) % shard_count
+
+
+class MessageDatabase(DatabaseProxy):
+    """按线程路由到消息分片的数据库代理"""
+
+    __slots__ = ('obj', '_callbacks', '_Model', '_local', 'shards')
+
+    def __init__(self, default: Database):
+        super().__init__()
+        self.initialize(default)
+        self._local = threading.local()
+        self.shards: List[Database] = [default]
+
+    def configure(self, shards: List[Database]) -> None:
+        """设置分片数据库，传入空列表时恢复为只使用主库"""
+        self.shards = list(shards) or [self.obj]
+
+    @property
+    def sharded(self) -> bool:
+        """是否启用了分片"""
+        return len(self.shards) > 1
+
+    @property
+    def current(self) -> Database:
+        """当前线程选定的数据库，未选定时为主库"""
+        return getattr(self._local, 'database', None) or self.obj
+
+    def __getattr__(self, attr):
+        return getattr(self.current, attr)
+
+    def __enter__(self):
+        return self.current.__enter__()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return self.current.__exit__(exc_type, exc_val, exc_tb)
+
+    def database_for(self, session_id: str) -> Database:
+        """会话所在的分片"""
+        return self.shards[shard_index(session_id, len(self.shards))]
+
+    @contextmanager
+    def use(self, database: Database) -> Iterator[Database]:
+        """在当前线程中选定数据库，退出时恢复"""
+        previous = getattr(self._local, 'database', None)
+        self._local.database = database
+        try:
+            yield database
+        finally:
+            self._local.database = previous
+
+    def route(self, session_id: str):
+        """选定会话所在的分片"""
+        return self.use(self.database_for(session_id))
+
+    def each_shard(self) -> Iterator[Database]:
+        """依次选定每个分片"""
+        for database in self.shards:
+            with self.use(database):
+                yield database
+
+    def close_shards(self) -> None:
+        """把当前线程打开的分片连接归还连接池"""
+        for database in self.shards:
+            if database is not self.obj and not database.is_closed():
+                database.close()
+
+    def close_all_shards(self) -> None:
+        """关闭所有分片的全部连接"""
+        for database in self.shards:
+            if database is not self.obj:
+                database.close_all()
+
+
+def split_database(batch_size: int = 5000) -> List[int]:
+    """
+    把主库 chat_messages 中的消息按会话拆分到各分片，返回每个分片写入的条数
+
+    保留原消息ID（客户端的游标仍然有效），全文索引与会话索引由分片上的
+    触发器生成。全部分片写入成功后才删除主库中的消息；分片中已有消息时拒绝执行。
+    """
+    from backend.config import config
+    from backend.models import db, message_db, initialize_database
+
+    if not message_db.sharded:
+        raise RuntimeError("请先在 server_config.json 中设置 db_shards（大于 1）")
+    initialize_database()
+
+    shard_count = len(message_db.shards)
+    columns = [row[1] for row in sqlite3.connect(config.database_url).execute('PRAGMA table_info(chat_messages)')]
+    if not columns:
+        raise RuntimeError("主库中没有 chat_messages 表")
+
+    counts = []
+    for index, database in enumerate(message_db.shards):
+        conn = sqlite3.connect(database.database)
+        try:
+            if conn.execute('SELECT 1 FROM chat_messages LIMIT 1').fetchone():
+                raise RuntimeError(f"分片 {database.database} 中已有消息，不能重复拆分")
+            conn.create_function('shard_index', 1, lambda session_id: shard_index(session_id, shard_count),
+                                 deterministic=True)
+            conn.execute('ATTACH DATABASE ? AS source', (config.database_url,))
+            column_list = ', '.join(f'"{name}"' for name in columns)
+            copied, last_id = 0, 0
+            while True:
+                with conn:
+                    cursor = conn.execute(
+                        f'INSERT INTO chat_messages ({column_list}) '
+                        f'SELECT {column_list} FROM source.chat_messages '
+                        f'WHERE id > ? AND id <= ? AND shard_index(session_id) = ?',
+                        (last_id, last_id + batch_size, index)
+                    )
+                copied += cursor.rowcount
+                last_id += batch_size
+                if not conn.execute('SELECT 1 FROM source.chat_messages WHERE id > ? LIMIT 1',
+                                    (last_id,)).fetchone():
+                    break
+            conn.execute('DETACH DATABASE source')
+            counts.append(copied)
+            print(f"分片 {index}: {copied} 条消息 -> {database.database}")
+        finally:
+            conn.close()
+
+    with db.connection_context():
+        total = db.execute_sql('SELECT COUNT(*) FROM chat_messages').fetchone()[0]
+        if total != sum(counts):
+            raise RuntimeError(f"拆分后的消息数 {sum(counts)} 与主库 {total} 不一致，主库未改动")
+        db.execute_sql('DELETE FROM chat_messages')
+        db.execute_sql('VACUUM')
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='消息分片工具')
+    parser.add_argument('command', choices=['split'], help='split: 把主库中的消息拆分到各分片')
+    parser.add_argument('--batch-size', type=int, default=5000, help='每个事务复制的消息ID范围')
+    args = parser.parse_args()
+    if args.command == 'split':
+        counts = split_database(args.batch_size)
+        print(f"完成，共 {sum(counts)} 条消息")
+
+
+if __name__ == '__main__':
+    main()
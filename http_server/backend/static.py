@@ -0,0 +1,119 @@
+"""
+前端构建产物（dist）静态文件服务
+
+- Vite 构建的 assets/ 下文件名带内容哈希，返回 Cache-Control: immutable
+- index.html 等入口文件每次都需要重新验证（no-cache）
+- 请求接受 br / gzip 且存在 .br / .gz 预压缩文件时直接返回压缩文件
+"""
+import gzip
+import mimetypes
+import os
+from typing import Tuple
+
+from loguru import logger
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# 按优先级排列的预压缩编码与文件后缀
+PRECOMPRESSED_ENCODINGS: Tuple[Tuple[str, str], ...] = (('br', '.br'), ('gzip', '.gz'))
+
+# 值得压缩的文本类文件
+COMPRESSIBLE_EXTENSIONS = ('.html', '.js', '.mjs', '.css', '.json', '.svg', '.txt', '.map', '.xml', '.wasm')
+
+# 带内容哈希的构建产物目录（相对 dist）
+IMMUTABLE_PREFIX = 'assets'
+
+
+def _accepts(accept_encoding: str, encoding: str) -> bool:
+    """Accept-Encoding 是否接受指定编码（忽略 q=0 的情况）"""
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        if name.strip().lower() == encoding:
+            return params.replace(' ', '') not in ('q=0', 'q=0.0')
+    return False
+
+
+class FrontendStaticFiles(StaticFiles):
+    """支持预压缩文件与长期缓存的静态文件服务"""
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope,
+                      status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = os.fspath(full_path)
+        relative_path = os.path.relpath(full_path, self.directory).replace(os.sep, '/')
+
+        if relative_path.startswith(IMMUTABLE_PREFIX + '/'):
+            cache_control = 'public, max-age=31536000, immutable'
+        else:
+            cache_control = 'no-cache'
+        headers = {'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+
+        response = None
+        accept_encoding = request_headers.get('accept-encoding', '')
+        for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+            compressed_path = full_path + suffix
+            if _accepts(accept_encoding, encoding) and os.path.isfile(compressed_path):
+                # media_type 按原文件推断，否则会被当作 .br / .gz 下载
+                response = FileResponse(
+                    compressed_path,
+                    status_code=status_code,
+                    headers={**headers, 'Content-Encoding': encoding},
+                    media_type=mimetypes.guess_type(full_path)[0] or 'text/plain',
+                    stat_result=os.stat(compressed_path),
+                )
+                break
+        if response is None:
+            response = FileResponse(full_path, status_code=status_code, headers=headers, stat_result=stat_result)
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def precompress_directory(directory: str) -> int:
+    """
+    为目录中的文本文件生成 .gz（安装了 brotli 时还有 .br）预压缩文件
+
+    已存在且不早于源文件的压缩文件会跳过，返回新生成的文件数。
+    """
+    created = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            targets = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                targets.append(('.br', lambda data: brotli.compress(data, quality=11)))
+            source_mtime = os.path.getmtime(path)
+            data = None
+            for suffix, compress in targets:
+                target = path + suffix
+                if os.path.exists(target) and os.path.getmtime(target) >= source_mtime:
+                    continue
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                compressed = compress(data)
+                if len(compressed) >= len(data):
+                    # 压缩无收益，同时删除旧构建遗留的压缩文件
+                    if os.path.exists(target):
+                        os.remove(target)
+                    continue
+                # 多个工作进程可能同时生成，先写临时文件再替换
+                tmp_path = f"{target}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(compressed)
+                os.replace(tmp_path, target)
+                created += 1
+    if created:
+        logger.info(f"已生成 {created} 个预压缩静态文件")
+    return created
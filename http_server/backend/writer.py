@@ -0,0 +1,189 @@
+"""
+消息写入队列（组提交）
+
+短时间内到达的多条消息合并到同一个事务中写入，一次提交只产生一次 fsync。
+每条消息仍然拥有独立的 Future，在所在事务提交后返回各自的消息ID。
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from backend.config import config
+from backend.metrics import write_batch_rows
+from backend.models import ChatMessage, message_db
+from backend.sharding import shard_index
+
+
+_STOP = object()
+
+
+class MessageWriter:
+    """后台写线程，按批次提交消息"""
+
+    def __init__(self, model, max_batch_size: int, max_delay: float, database=None, name: str = 'message-writer'):
+        self.model = model
+        # 写入的目标数据库（消息分片），默认为主库
+        self.database = database or message_db.obj
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.name = name
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def queue_depth(self) -> int:
+        """等待写入的消息组数"""
+        return self._queue.qsize()
+
+    @property
+    def running(self) -> bool:
+        """写线程是否在运行"""
+        return self._thread is not None
+
+    def start(self) -> None:
+        """启动写线程"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        logger.info(f"消息写入队列已启动: 批大小上限 {self.max_batch_size}, 等待 {self.max_delay * 1000:.1f}ms")
+
+    def stop(self) -> None:
+        """写完队列中剩余的消息后停止"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        logger.info("消息写入队列已停止")
+
+    def submit(self, rows: List[Dict]) -> List[Future]:
+        """
+        提交一组消息，同一组消息总是在同一个事务中写入
+
+        返回与 rows 一一对应的 Future，结果为消息ID。写线程未启动时
+        （如脚本中直接调用服务）在当前线程同步写入。
+        """
+        futures = [Future() for _ in rows]
+        if not rows:
+            return futures
+        if self._thread is None:
+            self._write([(rows, futures)])
+        else:
+            self._queue.put((rows, futures))
+        return futures
+
+    def _run(self) -> None:
+        self.database.connect(reuse_if_open=True)
+        try:
+            stopping = False
+            while not stopping:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                batch = [item]
+                count = len(item[0])
+                deadline = time.monotonic() + self.max_delay
+                # 在等待窗口内继续收集，直到达到批大小上限
+                while count < self.max_batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                    count += len(item[0])
+                self._write(batch)
+        finally:
+            self.database.close()
+
+    def _write(self, batch: List[Tuple[List[Dict], List[Future]]]) -> None:
+        """在一个事务中写入整批消息，单条失败只回滚该条的保存点"""
+        results = []
+        try:
+            with message_db.use(self.database), self.database.atomic():
+                for rows, futures in batch:
+                    for row, future in zip(rows, futures):
+                        try:
+                            with self.database.atomic():
+                                results.append((future, self.model.insert(**row).execute(), None))
+                        except Exception as e:
+                            results.append((future, None, e))
+        except Exception as e:
+            logger.error(f"批量写入消息失败: {e}")
+            for _, futures in batch:
+                for future in futures:
+                    future.set_exception(e)
+            return
+
+        write_batch_rows.observe(len(results))
+        for future, message_id, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(message_id)
+
+
+class ShardedMessageWriter:
+    """
+    分片存储时的写入队列：每个分片一个写线程，按会话把消息分发到所在分片
+
+    不同分片的提交互不等待。一次 submit 的消息跨越多个分片时，各分片分别提交。
+    """
+
+    def __init__(self, writers: List[MessageWriter]):
+        self.writers = writers
+
+    @property
+    def queue_depth(self) -> int:
+        """等待写入的消息组数"""
+        return sum(writer.queue_depth for writer in self.writers)
+
+    @property
+    def running(self) -> bool:
+        """写线程是否在运行"""
+        return any(writer.running for writer in self.writers)
+
+    def start(self) -> None:
+        """启动所有分片的写线程"""
+        for writer in self.writers:
+            writer.start()
+
+    def stop(self) -> None:
+        """写完各分片队列中剩余的消息后停止"""
+        for writer in self.writers:
+            writer.stop()
+
+    def submit(self, rows: List[Dict]) -> List[Future]:
+        """按 session_id 分组提交到各分片，返回与 rows 一一对应的 Future"""
+        groups: Dict[int, List[int]] = {}
+        for position, row in enumerate(rows):
+            groups.setdefault(shard_index(row['session_id'], len(self.writers)), []).append(position)
+        futures: List[Optional[Future]] = [None] * len(rows)
+        for index, positions in groups.items():
+            for position, future in zip(positions, self.writers[index].submit([rows[p] for p in positions])):
+                futures[position] = future
+        return futures
+
+
+def _create_message_writer():
+    options = dict(max_batch_size=config.write_batch_max_size, max_delay=config.write_batch_max_delay_ms / 1000)
+    if not message_db.sharded:
+        return MessageWriter(ChatMessage, **options)
+    return ShardedMessageWriter([
+        MessageWriter(ChatMessage, database=database, name=f'message-writer-{index}', **options)
+        for index, database in enumerate(message_db.shards)
+    ])
+
+
+# 全局消息写入队列
+message_writer = _create_message_writer()
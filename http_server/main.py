@@ -1,25 +1,71 @@
 #!/usr/bin/env python3
 """
 MaiMbot WebUI Adapter - 启动脚本
+
+开发模式（默认）：单进程、自动重载，并启动前端开发服务器。
+生产模式：多个工作进程、不重载，各进程通过数据库感知彼此写入的消息。
+
+用法:
+    python main.py                       # 开发模式
+    python main.py --prod                # 生产模式，工作进程数默认为 CPU 核数
+    python main.py --prod --workers 4
 """
+import argparse
 import sys
 import os
 
 # 添加当前目录到 Python 路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from backend.app import app, config
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="MaiMbot WebUI Adapter")
+    parser.add_argument('--prod', action='store_true', help='以生产模式启动（等同于 MAIMBOT_ENV=production）')
+    parser.add_argument('--workers', type=int, default=None, help='生产模式的工作进程数，0 表示使用 CPU 核数')
+    return parser.parse_args()
+
 
 if __name__ == "__main__":
+    args = parse_args()
+    # 通过环境变量传递，工作进程导入配置时读取到相同的设置
+    if args.prod:
+        os.environ['MAIMBOT_ENV'] = 'production'
+    if args.workers is not None:
+        os.environ['MAIMBOT_WORKERS'] = str(args.workers)
+
     import uvicorn
+    from backend.app import config, prepare_database
+    from backend.models import db, message_db
+
     print(f"🌟 启动 MaiMbot WebUI Adapter")
     print(f"🌐 服务器地址: http://{config.host}:{config.port}")
     print(f"📁 数据库路径: {config.database_url}")
-    
-    uvicorn.run(
-        "backend.app:app",
-        host=config.host,
-        port=config.port,
-        reload=True,
-        log_level="info"
-    )
+
+    if config.multi_process:
+        # 建表、补列和迁移只在这里执行一次，避免各工作进程同时修改表结构
+        prepare_database()
+        db.close_all()
+        message_db.close_all_shards()
+        os.environ['MAIMBOT_DB_PREPARED'] = '1'
+
+    if config.is_production:
+        print(f"🚀 生产模式: {config.worker_count} 个工作进程")
+        uvicorn.run(
+            "backend.app:app",
+            host=config.host,
+            port=config.port,
+            workers=config.worker_count,
+            reload=False,
+            timeout_keep_alive=config.keep_alive_timeout,
+            backlog=config.backlog,
+            access_log=False,
+            log_level="info"
+        )
+    else:
+        uvicorn.run(
+            "backend.app:app",
+            host=config.host,
+            port=config.port,
+            reload=True,
+            log_level="info"
+        )
@@ -8,11 +8,25 @@ import SessionSelector from './components/SessionSelector'
 import SettingsPanel from './components/SettingsPanel'
 import './App.css'
 
+// 打开会话时加载的最近消息数，以及每次向前翻页的条数
+const PAGE_SIZE = 50
+
+// 服务端回显的本端消息是否对应某条待确认消息：文本按内容匹配，图片按发送顺序匹配
+const matchesPending = (pending, msg) =>
+  msg.image ? Boolean(pending.image) : !pending.image && pending.text === msg.text
+
+// 待确认的图片消息使用本地预览地址，被替换或移除时释放
+const releasePreview = (msg) => {
+  if (msg.pending && msg.image) URL.revokeObjectURL(msg.image)
+}
+
 function App() {
   // 状态管理
   const [background, setBackground] = useState('')
   const [sprite, setSprite] = useState('')
   const [messages, setMessages] = useState([])
+  // 更早一页消息的 before_id 游标，没有更早的消息时为 null
+  const [olderCursor, setOlderCursor] = useState(null)
   const [apiBase, setApiBase] = useState('')
   const [sessionId, setSessionId] = useState('default')
   const [showAvatarModal, setShowAvatarModal] = useState(false)
@@ -73,54 +87,149 @@ function App() {
     loadConfigurations()
   }, [apiBase, sessionId])
 
-  // 定期拉取消息
+  const formatMessage = useCallback((msg) => {
+    const isFromWeb = msg.from_user === 'web'
+    
+    // 处理图片消息，列表中显示缩略图，点击预览时再加载展示图
+    if (msg.type === 'image' || msg.image_url || msg.image_b64) {
+      const imageData = msg.image_b64 || msg.text
+      if (msg.image_url) {
+        return {
+          id: msg.id,
+          from: isFromWeb ? 'me' : 'other',
+          text: '',
+          image: `${apiBase}${msg.thumb_url || msg.image_url}`,
+          fullImage: `${apiBase}${msg.display_url || msg.image_url}`
+        }
+      }
+      return {
+        id: msg.id,
+        from: isFromWeb ? 'me' : 'other',
+        text: '',
+        image: imageData ? `data:image/png;base64,${imageData}` : undefined
+      }
+    }
+    
+    // 处理文本消息
+    return {
+      id: msg.id,
+      from: isFromWeb ? 'me' : 'other',
+      text: msg.text || ''
+    }
+  }, [apiBase])
+
+  // 先分页加载最近的消息，再通过 WebSocket 接收之后的消息推送
   useEffect(() => {
     if (!apiBase) return
 
-    const fetchMessages = async () => {
+    // 当前会话已收到的最后一条消息ID，最近一页加载完成前为 null
+    let cursor = null
+    let cancelled = false
+    let socket = null
+    let heartbeat = null
+    let reconnectTimer = null
+    let retryDelay = 1000
+
+    // 只加载最近的 PAGE_SIZE 条，更早的消息由用户按需向前翻页
+    const loadLatestPage = async () => {
       try {
-        const response = await fetch(`${apiBase}/messages?session_id=${sessionId}`)
-        const data = await response.json()
-        
-        const formattedMessages = data.map(msg => {
-          const isFromWeb = msg.from_user === 'web'
-          
-          // 处理图片消息
-          if (msg.type === 'image' || msg.image_b64) {
-            const imageData = msg.image_b64 || msg.text
-            return {
-              from: isFromWeb ? 'me' : 'other',
-              text: '',
-              image: imageData ? `data:image/png;base64,${imageData}` : undefined
-            }
-          }
-          
-          // 处理文本消息
-          return {
-            from: isFromWeb ? 'me' : 'other',
-            text: msg.text || ''
-          }
-        })
-        
-        setMessages(formattedMessages)
+        const res = await fetch(`${apiBase}/messages?session_id=${encodeURIComponent(sessionId)}&limit=${PAGE_SIZE}`)
+        if (!res.ok) return
+        const data = await res.json()
+        if (cancelled) return
+        cursor = Number(res.headers.get('X-Next-Cursor')) || (data.length ? data[data.length - 1].id : 0)
+        setOlderCursor(res.headers.get('X-Prev-Cursor'))
+        setMessages(prev => [...data.map(formatMessage), ...prev.filter(m => m.pending)])
       } catch (error) {
-        console.error('Failed to fetch messages:', error)
+        console.error('Failed to load messages:', error)
       }
     }
 
-    // 立即获取一次，然后每2秒获取一次
-    fetchMessages()
-    const interval = setInterval(fetchMessages, 2000)
+    const appendMessages = (data) => {
+      if (!data.length) return
+      cursor = data[data.length - 1].id
+      // 本端消息的回显只替换与之对应的待确认消息，其余待确认消息保留在末尾
+      const formattedMessages = data.map(formatMessage)
+      setMessages(prev => {
+        const pending = prev.filter(m => m.pending)
+        for (const msg of formattedMessages) {
+          if (msg.from !== 'me') continue
+          const index = pending.findIndex(m => matchesPending(m, msg))
+          if (index !== -1) releasePreview(pending.splice(index, 1)[0])
+        }
+        return [...prev.filter(m => !m.pending), ...formattedMessages, ...pending]
+      })
+    }
+
+    // 断线后按退避间隔重连，重连时携带游标补发期间的消息
+    const connect = async () => {
+      if (cancelled) return
+      if (cursor === null) {
+        await loadLatestPage()
+        if (cancelled) return
+      }
+      const wsBase = apiBase.replace(/^http/, 'ws')
+      // 最近一页加载失败时不携带游标，服务端只推送新消息
+      const query = cursor === null ? '' : `?after_id=${cursor}`
+      socket = new WebSocket(`${wsBase}/ws/sessions/${encodeURIComponent(sessionId)}${query}`)
+
+      socket.onopen = () => {
+        retryDelay = 1000
+        heartbeat = setInterval(() => {
+          if (socket.readyState === WebSocket.OPEN) socket.send('ping')
+        }, 25000)
+      }
+
+      socket.onmessage = (event) => {
+        if (event.data === 'pong') return
+        try {
+          const frame = JSON.parse(event.data)
+          if (frame.type === 'messages' && Array.isArray(frame.messages)) {
+            appendMessages(frame.messages)
+          }
+        } catch (error) {
+          console.error('Failed to parse message frame:', error)
+        }
+      }
+
+      socket.onclose = () => {
+        clearInterval(heartbeat)
+        if (cancelled) return
+        reconnectTimer = setTimeout(connect, retryDelay)
+        retryDelay = Math.min(retryDelay * 2, 10000)
+      }
+    }
+
+    connect()
     
-    return () => clearInterval(interval)
-  }, [apiBase, sessionId])
+    return () => {
+      cancelled = true
+      clearTimeout(reconnectTimer)
+      clearInterval(heartbeat)
+      if (socket) socket.close()
+    }
+  }, [apiBase, sessionId, formatMessage])
+
+  // 向前加载更早的一页消息
+  const handleLoadOlder = useCallback(async () => {
+    if (!apiBase || !olderCursor) return
+    try {
+      const res = await fetch(`${apiBase}/messages?session_id=${encodeURIComponent(sessionId)}&before_id=${olderCursor}&limit=${PAGE_SIZE}`)
+      if (!res.ok) return
+      const data = await res.json()
+      setOlderCursor(res.headers.get('X-Prev-Cursor'))
+      setMessages(prev => [...data.map(formatMessage), ...prev])
+    } catch (error) {
+      console.error('Failed to load older messages:', error)
+    }
+  }, [apiBase, sessionId, olderCursor, formatMessage])
 
   // 发送文本消息
   const handleSendMessage = useCallback(async (text) => {
     if (!text.trim() || !apiBase) return
 
     // 立即更新UI
-    setMessages(prev => [...prev, { from: 'me', text }])
+    setMessages(prev => [...prev, { from: 'me', text, pending: true }])
 
     try {
       await fetch(`${apiBase}/send_message?session_id=${sessionId}`, {
@@ -138,30 +247,40 @@ function App() {
     }
   }, [apiBase, sessionId])
 
-  // 发送图片消息
-  const handleSendImage = useCallback(async (base64) => {
+  // 发送图片消息，直接上传文件原始内容
+  const handleSendImage = useCallback(async (file) => {
     if (!apiBase) return
 
     // 立即更新UI
+    const preview = URL.createObjectURL(file)
+    const removePreview = () => {
+      setMessages(prev => prev.filter(m => m.image !== preview))
+      URL.revokeObjectURL(preview)
+    }
     setMessages(prev => [...prev, { 
       from: 'me', 
       text: '', 
-      image: `data:image/png;base64,${base64}` 
+      image: preview,
+      pending: true
     }])
 
     try {
-      await fetch(`${apiBase}/send_message?session_id=${sessionId}`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ 
-          from_user: 'web', 
-          type: 'image', 
-          image_b64: base64, 
-          text: '' 
-        })
-      })
+      const res = await fetch(
+        `${apiBase}/messages/image?session_id=${encodeURIComponent(sessionId)}&from_user=web`,
+        {
+          method: 'POST',
+          headers: { 'Content-Type': file.type || 'application/octet-stream' },
+          body: file
+        }
+      )
+      if (!res.ok) {
+        removePreview()
+        const error = await res.json().catch(() => ({}))
+        alert(error.detail || '图片发送失败')
+      }
     } catch (error) {
       console.error('Failed to send image:', error)
+      removePreview()
     }
   }, [apiBase, sessionId])
 
@@ -225,13 +344,19 @@ function App() {
   // 切换会话
   const handleSwitchSession = useCallback((id) => {
     setSessionId(id)
-    setMessages([]) // 清空消息，等待新会话消息加载
+    // 清空消息，等待新会话消息加载
+    setMessages(prev => {
+      prev.forEach(releasePreview)
+      return []
+    })
+    setOlderCursor(null)
   }, [])
 
   return (
     <div className="app-root">
       {/* 会话选择器 */}
       <SessionSelector
+        apiBase={apiBase}
         currentSession={sessionId}
         onSessionChange={handleSwitchSession}
       />
@@ -244,6 +369,8 @@ function App() {
         <div className="left-panel">
           <ChatPanel 
             messages={messages}
+            hasOlder={olderCursor !== null}
+            onLoadOlder={handleLoadOlder}
             onSend={handleSendMessage}
             onSendImage={handleSendImage}
             avatarConfig={avatarConfig}
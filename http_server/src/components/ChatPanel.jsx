@@ -1,15 +1,16 @@
 import React, { useState, useRef, useEffect } from 'react'
 
-const ChatPanel = ({ messages, onSend, onSendImage, avatarConfig }) => {
+const ChatPanel = ({ messages, hasOlder, onLoadOlder, onSend, onSendImage, avatarConfig }) => {
   const [input, setInput] = useState('')
   const [imgPreview, setImgPreview] = useState(null)
   const messagesEndRef = useRef(null)
   const fileInputRef = useRef(null)
 
-  // 自动滚动到底部
+  // 有新消息时自动滚动到底部（向前加载更早的消息时不滚动）
+  const lastMessage = messages[messages.length - 1]
   useEffect(() => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' })
-  }, [messages])
+  }, [lastMessage])
 
   // 发送消息
   const handleSend = () => {
@@ -38,18 +39,13 @@ const ChatPanel = ({ messages, onSend, onSendImage, avatarConfig }) => {
       return
     }
 
-    // 检查文件大小 (5MB限制)
-    if (file.size > 5 * 1024 * 1024) {
-      alert('图片文件不能超过5MB')
+    // 检查文件大小 (20MB限制，与后端上传上限一致)
+    if (file.size > 20 * 1024 * 1024) {
+      alert('图片文件不能超过20MB')
       return
     }
 
-    const reader = new FileReader()
-    reader.onload = (evt) => {
-      const base64 = evt.target.result.split(',')[1]
-      if (onSendImage) onSendImage(base64)
-    }
-    reader.readAsDataURL(file)
+    if (onSendImage) onSendImage(file)
     e.target.value = '' // 清空文件输入
   }
 
@@ -73,6 +69,11 @@ const ChatPanel = ({ messages, onSend, onSendImage, avatarConfig }) => {
     <div className="chat-panel">
       {/* 消息列表 */}
       <div className="chat-messages">
+        {hasOlder && (
+          <button className="load-older-btn" onClick={onLoadOlder}>
+            加载更早的消息
+          </button>
+        )}
         {messages.map((msg, idx) => {
           const isMe = msg.from === 'me'
           const role = isMe ? 'user' : 'bot'
@@ -80,7 +81,7 @@ const ChatPanel = ({ messages, onSend, onSendImage, avatarConfig }) => {
           const avatar = avatarConfig?.[role]?.avatar
 
           return (
-            <div key={idx} className={`message-wrapper ${isMe ? 'me' : 'other'}`}>
+            <div key={msg.id ?? `pending-${idx}`} className={`message-wrapper ${isMe ? 'me' : 'other'}`}>
               {/* 头像 */}
               {!isMe && (
                 <div className="message-avatar">
@@ -108,7 +109,8 @@ const ChatPanel = ({ messages, onSend, onSendImage, avatarConfig }) => {
                       src={msg.image}
                       alt="图片消息"
                       className="message-image"
-                      onClick={() => handleImgClick(msg.image)}
+                      loading="lazy"
+                      onClick={() => handleImgClick(msg.fullImage || msg.image)}
                     />
                   )}
                 </div>
@@ -1,12 +1,48 @@
-import React, { useState } from 'react'
+import React, { useState, useEffect, useCallback } from 'react'
 
-const SessionSelector = ({ currentSession, onSessionChange }) => {
+const PAGE_SIZE = 50
+
+const SessionSelector = ({ apiBase, currentSession, onSessionChange }) => {
   const [isExpanded, setIsExpanded] = useState(false)
-  const [sessions, setSessions] = useState([
-    { id: 'default', name: '默认会话' },
-    { id: 'user2', name: '会话2' },
-    { id: 'user3', name: '会话3' }
-  ])
+  // 服务端已有消息的会话
+  const [serverSessions, setServerSessions] = useState([])
+  const [nextOffset, setNextOffset] = useState(null)
+  // 本地新建、尚未发送消息的会话
+  const [localSessions, setLocalSessions] = useState([{ id: 'default', name: '默认会话' }])
+  const [hiddenIds, setHiddenIds] = useState([])
+
+  // 从 /sessions 分页加载会话列表（按最近活跃排序）
+  const loadSessions = useCallback(async (offset = 0) => {
+    if (!apiBase) return
+    try {
+      const res = await fetch(`${apiBase}/sessions?sort=recent&limit=${PAGE_SIZE}&offset=${offset}`)
+      if (!res.ok) return
+      const data = await res.json()
+      const page = data.sessions.map(s => ({
+        id: s.session_id,
+        name: s.session_id === 'default' ? '默认会话' : s.session_id,
+        preview: s.last_preview,
+        count: s.message_count
+      }))
+      setServerSessions(prev => (offset === 0 ? page : [...prev, ...page]))
+      setNextOffset(data.next_offset)
+    } catch (error) {
+      console.error('Failed to load sessions:', error)
+    }
+  }, [apiBase])
+
+  useEffect(() => {
+    if (isExpanded) loadSessions(0)
+  }, [isExpanded, loadSessions])
+
+  const serverIds = new Set(serverSessions.map(s => s.id))
+  const sessions = [
+    ...localSessions.filter(s => !serverIds.has(s.id)),
+    ...serverSessions
+  ].filter(s => !hiddenIds.includes(s.id))
+  if (!sessions.some(s => s.id === currentSession)) {
+    sessions.unshift({ id: currentSession, name: currentSession })
+  }
 
   const currentSessionName = sessions.find(s => s.id === currentSession)?.name || '未知会话'
 
@@ -15,16 +51,18 @@ const SessionSelector = ({ currentSession, onSessionChange }) => {
     const newSessionName = `会话 ${sessions.length + 1}`
     const newSession = { id: newSessionId, name: newSessionName }
     
-    setSessions(prev => [...prev, newSession])
+    setLocalSessions(prev => [...prev, newSession])
     onSessionChange(newSessionId)
     setIsExpanded(false)
   }
 
+  // 仅从列表中隐藏，不删除服务端的消息
   const handleDeleteSession = (sessionId, e) => {
     e.stopPropagation()
     if (sessions.length <= 1) return // 至少保留一个会话
     
-    setSessions(prev => prev.filter(s => s.id !== sessionId))
+    setHiddenIds(prev => [...prev, sessionId])
+    setLocalSessions(prev => prev.filter(s => s.id !== sessionId))
     
     // 如果删除的是当前会话，切换到第一个会话
     if (sessionId === currentSession) {
@@ -70,8 +108,12 @@ const SessionSelector = ({ currentSession, onSessionChange }) => {
                     onSessionChange(session.id)
                     setIsExpanded(false)
                   }}
+                  title={session.preview || ''}
                 >
                   <span className="session-item-name">{session.name}</span>
+                  {session.count > 0 && (
+                    <span className="session-item-count">{session.count}</span>
+                  )}
                 </button>
                 {sessions.length > 1 && (
                   <button
@@ -84,6 +126,11 @@ const SessionSelector = ({ currentSession, onSessionChange }) => {
                 )}
               </div>
             ))}
+            {nextOffset !== null && (
+              <button className="session-item" onClick={() => loadSessions(nextOffset)}>
+                <span className="session-item-name">加载更多…</span>
+              </button>
+            )}
           </div>
         </div>
       )}
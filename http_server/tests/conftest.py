@@ -0,0 +1,117 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 测试数据写入临时目录，不影响 backend/chat.db
+os.environ.setdefault('MAIMBOT_DATA_DIR', tempfile.mkdtemp(prefix='maimbot-test-'))
+# 限流单独测试，其他测试连续发送消息时不受影响
+os.environ.setdefault('MAIMBOT_RATE_LIMIT', '0')
+HTTP_SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADAPTER_DIR = os.path.join(os.path.dirname(HTTP_SERVER_DIR), 'adapter')
+sys.path.insert(0, HTTP_SERVER_DIR)
+
+
+@pytest.fixture(scope='session')
+def database():
+    """在临时数据目录中建表"""
+    from backend.models import initialize_database
+    initialize_database()
+
+
+@pytest.fixture
+def client(database):
+    """不执行 lifespan（不启动前端开发服务器），数据库线程池在首次查询时启动，写入队列同步写入"""
+    from fastapi.testclient import TestClient
+    from backend.app import app
+    return TestClient(app)
+
+
+@pytest.fixture
+def fresh_database(tmp_path, monkeypatch, database):
+    """改用临时目录中新建的 chat.db（需要清空消息或依赖全局消息ID的测试使用）"""
+    from backend.config import config
+    from backend.models import db, initialize_database
+
+    def reopen(path: str) -> None:
+        if not db.is_closed():
+            db.close()
+        db.close_all()
+        db.init(path)
+
+    original = config.db_path
+    monkeypatch.setattr(config, 'db_path', str(tmp_path / 'chat.db'))
+    reopen(config.db_path)
+    initialize_database()
+    yield config.db_path
+    reopen(original)
+
+
+@pytest.fixture
+def sharded(fresh_database, monkeypatch):
+    """把消息分散到临时目录中的两个分片，写入队列在调用线程中同步写入各分片"""
+    from backend import services
+    from backend.config import config
+    from backend.models import ChatMessage, message_db, initialize_database, _create_database
+    from backend.writer import MessageWriter, ShardedMessageWriter
+
+    shards = [_create_database(config.shard_path(index)) for index in range(2)]
+    monkeypatch.setattr(config, 'db_shards', len(shards))
+    monkeypatch.setattr(services, 'message_writer', ShardedMessageWriter([
+        MessageWriter(ChatMessage, max_batch_size=1, max_delay=0, database=shard) for shard in shards
+    ]))
+    message_db.configure(shards)
+    initialize_database()
+    yield shards
+    message_db.configure([])
+    for shard in shards:
+        shard.close_all()
+
+
+ADAPTER_CONFIG = """
+[adapter]
+platform_id = "test_adapter"
+poll_interval = 0.05
+feed = "poll"
+wait_timeout = 0.2
+
+[connection]
+ws_url = "ws://127.0.0.1:1/ws"
+http_backend_url = "http://testserver"
+
+[database]
+db_path = "{db_path}"
+"""
+
+
+@pytest.fixture(scope='session')
+def adapter(tmp_path_factory):
+    """导入适配器模块（需要 maim_message），配置文件与数据库在临时目录中"""
+    pytest.importorskip('maim_message')
+    data_dir = tmp_path_factory.mktemp('adapter')
+    config_path = data_dir / 'config.toml'
+    config_path.write_text(ADAPTER_CONFIG.format(db_path=(data_dir / 'adapter.db').as_posix()), encoding='utf-8')
+    os.environ['MAIMBOT_ADAPTER_CONFIG'] = str(config_path)
+    sys.path.insert(0, ADAPTER_DIR)
+    try:
+        import maimai_http_adapter
+    finally:
+        sys.path.remove(ADAPTER_DIR)
+        del os.environ['MAIMBOT_ADAPTER_CONFIG']
+    yield maimai_http_adapter
+    maimai_http_adapter.db_manager.close()
+
+
+@pytest.fixture
+def adapter_backend(adapter, database):
+    """适配器的共享 HTTP 客户端直接调用后端应用，不经过网络"""
+    import asyncio
+    import httpx
+    from backend.app import app
+
+    adapter.http_client._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app),
+                                                    base_url=adapter.config.http_backend_url)
+    yield adapter.http_client
+    client, adapter.http_client._client = adapter.http_client._client, None
+    asyncio.run(client.aclose())
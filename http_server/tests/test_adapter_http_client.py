@@ -0,0 +1,70 @@
+import asyncio
+import base64
+import uuid
+
+from backend.services import ChatService
+
+
+def test_client_is_shared_until_closed(adapter):
+    async def run():
+        manager = adapter.HttpClientManager()
+        first = manager.client
+        assert manager.client is first
+        await manager.close()
+        assert first.is_closed
+        second = manager.client
+        assert second is not first and not second.is_closed
+        await manager.close()
+
+    asyncio.run(run())
+
+
+def test_client_uses_configured_backend_and_timeouts(adapter):
+    async def run():
+        manager = adapter.HttpClientManager()
+        try:
+            client = manager.client
+            assert str(client.base_url).rstrip('/') == adapter.config.http_backend_url
+            assert client.timeout.read == adapter.config.http_client['timeout']
+            assert client.timeout.connect == adapter.config.http_client['connect_timeout']
+        finally:
+            await manager.close()
+
+    asyncio.run(run())
+
+
+def test_core_reply_is_saved_in_one_batch(adapter, adapter_backend):
+    session_id = uuid.uuid4().hex
+    group_id = adapter.db_manager.get_or_create_group_id(session_id)
+    image = base64.b64encode(b'not really an image').decode('ascii')
+    reply = {
+        'message_info': {'group_info': {'group_id': group_id}},
+        'message_segment': {'type': 'seglist', 'data': [
+            {'type': 'text', 'data': '你好'},
+            {'type': 'seglist', 'data': [{'type': 'image', 'data': image}]},
+        ]},
+    }
+
+    asyncio.run(adapter.handle_from_maibot(reply))
+
+    messages = ChatService.get_messages(session_id)
+    assert [(m.from_user, m.type, m.text) for m in messages] == [('maimai', 'text', '你好'), ('maimai', 'image', '')]
+    assert messages[1].image_url
+
+
+def test_image_is_downloaded_from_blob_store(adapter, adapter_backend, client):
+    session_id = uuid.uuid4().hex
+    data = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg==')
+    response = client.post('/messages/image', params={'session_id': session_id}, content=data,
+                           headers={'Content-Type': 'image/png'})
+    assert response.status_code == 200
+    message = ChatService.get_messages(session_id)[0].model_dump()
+
+    async def run():
+        return (await adapter.MessageProcessor.load_image_b64(message),
+                await adapter.MessageProcessor.load_image_b64({**message, 'image_url': '/blobs/' + '0' * 64}))
+
+    downloaded, missing = asyncio.run(run())
+
+    assert base64.b64decode(downloaded) == data
+    assert missing is None
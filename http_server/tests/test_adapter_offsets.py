@@ -0,0 +1,150 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def restart(adapter, tmp_path, monkeypatch):
+    """返回重启适配器数据库的函数：关闭当前连接，重新打开同一个数据库文件"""
+    monkeypatch.setattr(adapter.DatabaseManager, 'LEGACY_DB_PATH', str(tmp_path / 'legacy.db'))
+    monkeypatch.setitem(adapter.config._config['database'], 'db_path', str(tmp_path / 'adapter.db'))
+    managers = []
+
+    def reopen():
+        if managers:
+            managers[-1].close()
+        managers.append(adapter.DatabaseManager())
+        monkeypatch.setattr(adapter, 'db_manager', managers[-1])
+        return managers[-1]
+
+    yield reopen
+    if managers:
+        managers[-1].close()
+
+
+def test_offsets_only_move_forward_and_survive_restart(restart):
+    manager = restart()
+    assert manager.offsets_created
+
+    manager.save_offsets({'a': 5, 'b': 2})
+    manager.save_offsets({'a': 3, 'b': 4})
+    manager = restart()
+
+    assert not manager.offsets_created
+    assert manager.get_offsets() == {'a': 5, 'b': 4}
+    manager.reset_offset('a')
+    assert restart().get_offsets() == {'b': 4}
+
+
+def test_mappings_are_flushed_on_close(restart):
+    manager = restart()
+    group_id = manager.get_or_create_group_id('session')
+
+    manager = restart()
+
+    assert manager.get_session_id(group_id) == 'session'
+
+
+def test_legacy_offsets_are_migrated(adapter, restart, tmp_path):
+    legacy = sqlite3.connect(tmp_path / 'legacy.db')
+    with legacy:
+        legacy.execute('CREATE TABLE session_group (session_id TEXT PRIMARY KEY, group_id TEXT)')
+        legacy.execute('CREATE TABLE adapter_offsets (session_id TEXT PRIMARY KEY, last_id INTEGER NOT NULL)')
+        legacy.execute("INSERT INTO session_group VALUES ('old', 'g-old')")
+        legacy.execute("INSERT INTO adapter_offsets VALUES ('old', 7)")
+    legacy.close()
+
+    manager = restart()
+
+    assert not manager.offsets_created
+    assert manager.get_offsets() == {'old': 7}
+    assert manager.get_session_id('g-old') == 'old'
+
+
+class _Core:
+    """记录转发到 MaiBot Core 的 (session_id, 文本)，failing 中的文本转发失败"""
+
+    def __init__(self):
+        self.sent = []
+        self.failing = set()
+
+    async def send_message(self, message):
+        text = message.message_segment.data[0].data
+        if text in self.failing:
+            raise ConnectionError('core unavailable')
+        self.sent.append((message.extra['session_id'], text))
+
+    def take(self):
+        sent, self.sent = sorted(self.sent), []
+        return sent
+
+
+@pytest.fixture(params=['poll', 'wait'])
+def run_adapter(request, adapter, adapter_backend, fresh_database, restart, monkeypatch):
+    """返回运行一次适配器（从数据库恢复进度）的函数，以及模拟的 Core"""
+    core = _Core()
+    monkeypatch.setattr(adapter.router, 'send_message', core.send_message)
+    restart()
+
+    def run(expected: int = 0, restart_first: bool = True):
+        if restart_first:
+            restart()
+        poller = adapter.MessagePoller()
+        poller.use_feed = request.param == 'wait'
+
+        async def go():
+            tasks = [asyncio.create_task(poller.poll_and_send()), asyncio.create_task(poller.scheduler.run())]
+            deadline = asyncio.get_running_loop().time() + 5
+            while len(core.sent) < expected and asyncio.get_running_loop().time() < deadline:
+                await asyncio.sleep(0.01)
+            # 再运行一段时间，确认没有重复转发
+            await asyncio.sleep(0.3)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run(go())
+        return core.take()
+
+    return run, core
+
+
+def _send(client, session_id: str, text: str, from_user: str = 'web'):
+    response = client.post('/send_message', params={'session_id': session_id},
+                           json={'from_user': from_user, 'text': text})
+    assert response.status_code == 200
+
+
+def test_each_message_is_forwarded_once_across_restarts(client, run_adapter):
+    run, _ = run_adapter
+    _send(client, 'a', 'history')
+
+    # 首次运行不转发历史消息
+    assert run(restart_first=False) == []
+
+    _send(client, 'a', 'a1')
+    _send(client, 'a', 'bot reply', from_user='maimai')
+    _send(client, 'b', 'b1')
+    assert run(expected=2) == [('a', 'a1'), ('b', 'b1')]
+
+    assert run() == []
+
+    _send(client, 'a', 'a2')
+    assert run(expected=1) == [('a', 'a2')]
+
+
+def test_failed_forward_is_retried_after_restart(client, run_adapter):
+    run, core = run_adapter
+    run(restart_first=False)
+
+    core.failing.add('a1')
+    _send(client, 'a', 'a1')
+    _send(client, 'a', 'a2')
+    _send(client, 'b', 'b1')
+    # a1 失败时会话 a 后面的消息也不转发，转发进度不越过 a1
+    assert run(expected=1) == [('b', 'b1')]
+
+    core.failing.clear()
+    assert run(expected=2) == [('a', 'a1'), ('a', 'a2')]
+    assert run() == []
@@ -0,0 +1,111 @@
+import asyncio
+from collections import Counter
+
+
+class _Core:
+    """模拟 MaiBot Core：记录转发结果，failures 中的消息按次数失败"""
+
+    def __init__(self, failures=None, delay: float = 0):
+        self.sent = []
+        self.attempts = []
+        self.failures = Counter(failures or {})
+        self.delay = delay
+        self.in_flight = Counter()
+        self.max_in_flight = 0
+        self.overlapped = []
+
+    async def __call__(self, session_id, item):
+        self.attempts.append(item)
+        if self.in_flight[session_id]:
+            self.overlapped.append(item)
+        self.in_flight[session_id] += 1
+        self.max_in_flight = max(self.max_in_flight, sum(self.in_flight.values()))
+        try:
+            await asyncio.sleep(self.delay)
+            if self.failures[item] > 0:
+                self.failures[item] -= 1
+                raise RuntimeError('core unavailable')
+            self.sent.append(item)
+        finally:
+            self.in_flight[session_id] -= 1
+
+
+def _run(adapter, core, queued, max_in_flight=1, quantum=1, retry_delay=0.01, max_delay=60.0, delays=None):
+    """把 queued 中的 (session_id, item) 依次入队并运行调度器，全部转发成功后停止"""
+    async def run():
+        scheduler = adapter.ForwardScheduler(core, max_in_flight, quantum)
+        scheduler.RETRY_BASE_DELAY = retry_delay
+        scheduler.RETRY_MAX_DELAY = max_delay
+        if delays is not None:
+            loop = asyncio.get_running_loop()
+            call_later = loop.call_later
+
+            def record(delay, callback, *args):
+                if callback == scheduler._resume:
+                    delays.append(delay)
+                return call_later(delay, callback, *args)
+
+            loop.call_later = record
+        for session_id, item in queued:
+            scheduler.enqueue(session_id, item)
+        task = asyncio.create_task(scheduler.run())
+        try:
+            while len(core.sent) < len(queued):
+                await asyncio.sleep(0.005)
+        finally:
+            task.cancel()
+        return scheduler
+
+    return asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_sessions_take_turns(adapter):
+    core = _Core()
+    queued = [('a', f'a{index}') for index in range(4)] + [('b', 'b0'), ('b', 'b1')]
+
+    _run(adapter, core, queued)
+
+    assert core.sent == ['a0', 'b0', 'a1', 'b1', 'a2', 'a3']
+
+
+def test_quantum_allows_consecutive_messages(adapter):
+    core = _Core()
+    queued = [('a', f'a{index}') for index in range(5)] + [('b', 'b0'), ('b', 'b1')]
+
+    _run(adapter, core, queued, quantum=2)
+
+    assert core.sent == ['a0', 'a1', 'b0', 'b1', 'a2', 'a3', 'a4']
+
+
+def test_sessions_forward_concurrently_but_in_order(adapter):
+    core = _Core(delay=0.01)
+    queued = [(session_id, f'{session_id}{index}') for index in range(3) for session_id in 'abc']
+
+    _run(adapter, core, queued, max_in_flight=2)
+
+    assert core.overlapped == []
+    assert core.max_in_flight == 2
+    for session_id in 'abc':
+        assert [item for item in core.sent if item[0] == session_id] == [f'{session_id}{i}' for i in range(3)]
+
+
+def test_failed_message_is_retried_before_the_rest_of_its_session(adapter):
+    core = _Core(failures={'a0': 1})
+    queued = [('a', 'a0'), ('a', 'a1'), ('b', 'b0'), ('b', 'b1')]
+
+    scheduler = _run(adapter, core, queued, retry_delay=0.05)
+
+    # 会话 a 退避期间会话 b 继续转发
+    assert core.attempts[0] == 'a0'
+    assert core.sent == ['b0', 'b1', 'a0', 'a1']
+    assert not scheduler.has_pending('a')
+
+
+def test_retry_delay_backs_off_exponentially_up_to_max(adapter):
+    core = _Core(failures={'a0': 4})
+    delays = []
+
+    _run(adapter, core, [('a', 'a0')], retry_delay=0.01, max_delay=0.03, delays=delays)
+
+    assert delays == [0.01, 0.02, 0.03, 0.03]
+    assert core.attempts == ['a0'] * 5
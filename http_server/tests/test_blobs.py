@@ -0,0 +1,62 @@
+import hashlib
+
+import pytest
+
+from backend.blobs import BlobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(str(tmp_path / 'blobs'))
+
+
+def _upload(store: BlobStore, data: bytes):
+    writer = store.writer()
+    writer.write(data[:3])
+    writer.write(data[3:])
+    return writer, writer.commit()
+
+
+def test_writer_stores_content_under_its_hash(store):
+    writer, blob_hash = _upload(store, b'hello blob')
+
+    assert blob_hash == hashlib.sha256(b'hello blob').hexdigest()
+    assert writer.created and writer.size == 10
+    assert store.read(blob_hash) == b'hello blob'
+    assert store.read(blob_hash, 6, 4) == b'blob'
+
+
+def test_second_upload_of_same_content_is_not_created(store):
+    _upload(store, b'same bytes')
+
+    writer, blob_hash = _upload(store, b'same bytes')
+
+    assert not writer.created
+    assert store.read(blob_hash) == b'same bytes'
+
+
+def test_release_deletes_unclaimed_upload(store):
+    writer, blob_hash = _upload(store, b'failed upload')
+
+    assert store.release(blob_hash, writer.mtime_ns)
+    assert not store.exists(blob_hash)
+
+
+@pytest.mark.parametrize('reuse', ['writer', 'put_bytes'])
+def test_release_keeps_content_reused_by_another_write(store, reuse):
+    writer, blob_hash = _upload(store, b'shared bytes')
+    if reuse == 'writer':
+        _upload(store, b'shared bytes')
+    else:
+        store.put_bytes(b'shared bytes')
+
+    assert not store.release(blob_hash, writer.mtime_ns)
+    assert store.read(blob_hash) == b'shared bytes'
+
+
+def test_release_of_missing_content_is_noop(store):
+    writer, blob_hash = _upload(store, b'gone')
+    store.release(blob_hash, writer.mtime_ns)
+
+    assert not store.release(blob_hash, writer.mtime_ns)
+    assert not store.claim(blob_hash)
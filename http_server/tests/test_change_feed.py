@@ -0,0 +1,113 @@
+import asyncio
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from backend import change_feed as change_feed_module
+from backend.cache import config_cache
+from backend.change_feed import ChangeFeed
+from backend.events import MessageBroker
+from backend.models import AppMeta
+
+
+class _OtherProcess:
+    """模拟另一个工作进程：通过独立的 sqlite3 连接写入"""
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+
+    def send(self, session_id: str, text: str) -> int:
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO chat_messages(session_id, from_user, text, type, image_b64, image_hash, "
+                "thumb_hash, display_hash, created_at) VALUES (?, 'web', ?, 'text', '', '', '', '', ?)",
+                (session_id, text, datetime.now()))
+        return cursor.lastrowid
+
+    def bump(self, key: str) -> None:
+        with self.conn:
+            self.conn.execute("INSERT INTO app_meta(key, value) VALUES (?, 1) "
+                              "ON CONFLICT(key) DO UPDATE SET value = value + 1", (key,))
+
+    def clear_messages(self) -> None:
+        with self.conn:
+            self.conn.execute("DELETE FROM chat_messages")
+        self.bump(AppMeta.MESSAGES_EPOCH)
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = MessageBroker()
+    monkeypatch.setattr(change_feed_module, 'message_broker', broker)
+    return broker
+
+
+@pytest.fixture
+def feed(fresh_database, broker):
+    feed = ChangeFeed(interval=0)
+    feed.prime()
+    yield feed
+    asyncio.run(feed.stop())
+
+
+@pytest.fixture
+def other(fresh_database):
+    other = _OtherProcess(fresh_database)
+    yield other
+    other.conn.close()
+
+
+def _poll(feed: ChangeFeed, broker: MessageBroker):
+    """执行一次轮询，返回订阅者收到的 (session_id, text)"""
+    async def run():
+        subscription = broker.subscribe(None)
+        feed.poll()
+        received = []
+        while True:
+            try:
+                messages = await asyncio.wait_for(subscription.get(), 0.1)
+            except asyncio.TimeoutError:
+                return received
+            received.extend((msg.session_id, msg.text) for msg in messages)
+
+    return asyncio.run(run())
+
+
+def test_publishes_messages_written_by_another_process(feed, broker, other):
+    other.send('a', 'one')
+    other.send('b', 'two')
+
+    assert _poll(feed, broker) == [('a', 'one'), ('b', 'two')]
+    assert _poll(feed, broker) == []
+
+
+def test_messages_before_prime_are_not_published(fresh_database, broker, other):
+    other.send('a', 'old')
+    feed = ChangeFeed(interval=0)
+    feed.prime()
+    other.send('a', 'new')
+
+    assert _poll(feed, broker) == [('a', 'new')]
+
+
+def test_clearing_messages_resets_cursor(feed, broker, other):
+    first_id = other.send('a', 'before clear')
+    assert _poll(feed, broker) == [('a', 'before clear')]
+    version = broker.version('a')
+
+    other.clear_messages()
+    # 清空后消息ID从头分配，与清空前已发布的消息ID相同
+    assert other.send('a', 'after clear') == first_id
+
+    assert _poll(feed, broker) == [('a', 'after clear')]
+    assert broker.version('a') != version
+
+
+def test_config_revision_invalidates_config_cache(feed, broker, other):
+    version = config_cache.version
+
+    other.bump(AppMeta.CONFIG_REVISION)
+    _poll(feed, broker)
+
+    assert config_cache.version != version
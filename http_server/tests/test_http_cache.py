@@ -0,0 +1,94 @@
+import uuid
+
+import pytest
+
+from backend.http_cache import is_not_modified, make_etag
+
+
+def _send(client, session_id: str, text: str):
+    response = client.post('/send_message', params={'session_id': session_id}, json={'from_user': 'web', 'text': text})
+    assert response.status_code == 200
+
+
+@pytest.fixture
+def session(client):
+    session_id = uuid.uuid4().hex
+    _send(client, session_id, 'hello')
+    return session_id
+
+
+class _Request:
+    def __init__(self, if_none_match: str):
+        self.headers = {'if-none-match': if_none_match}
+
+
+@pytest.mark.parametrize('header', [
+    'W/"{tag}"',
+    '"{tag}"',
+    '"other", W/"{tag}"',
+    '*',
+])
+def test_if_none_match_uses_weak_comparison(header):
+    etag = make_etag('m', 1, None)
+    tag = etag[3:-1]
+
+    assert is_not_modified(_Request(header.format(tag=tag)), etag)
+
+
+def test_etag_depends_on_every_part():
+    assert make_etag('m', 1, None, 50) != make_etag('m', 1, None, None)
+    assert make_etag('m', 1) != make_etag('m', 2)
+    assert not is_not_modified(_Request(make_etag('m', 1)), make_etag('m', 2))
+
+
+def test_unchanged_messages_answer_304(client, session):
+    first = client.get('/messages', params={'session_id': session, 'limit': 20})
+    etag = first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'no-cache'
+
+    second = client.get('/messages', params={'session_id': session, 'limit': 20}, headers={'If-None-Match': etag})
+
+    assert second.status_code == 304
+    assert second.content == b''
+    assert second.headers['ETag'] == etag
+
+
+def test_new_message_invalidates_etag(client, session):
+    etag = client.get('/messages', params={'session_id': session}).headers['ETag']
+    _send(client, session, 'another')
+
+    response = client.get('/messages', params={'session_id': session}, headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert [message['text'] for message in response.json()] == ['hello', 'another']
+
+
+def test_other_session_does_not_invalidate_etag(client, session):
+    etag = client.get('/messages', params={'session_id': session}).headers['ETag']
+    _send(client, uuid.uuid4().hex, 'elsewhere')
+
+    response = client.get('/messages', params={'session_id': session}, headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+
+
+def test_config_change_invalidates_config_etags(client):
+    etag = client.get('/background').headers['ETag']
+    assert client.get('/theme', headers={'If-None-Match': etag}).status_code == 304
+
+    assert client.post('/background', json={'url': 'https://example.com/bg.png'}).json()['success']
+
+    response = client.get('/background', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json()['url'] == 'https://example.com/bg.png'
+
+
+def test_large_responses_are_compressed(client, session):
+    for index in range(20):
+        _send(client, session, f'第 {index} 条比较长的消息，用来让响应超过压缩的最小长度' * 2)
+
+    response = client.get('/messages', params={'session_id': session}, headers={'Accept-Encoding': 'gzip'})
+
+    assert response.headers['Content-Encoding'] in ('gzip', 'br')
+    assert len(response.json()) == 21
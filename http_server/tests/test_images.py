@@ -0,0 +1,41 @@
+import io
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+from backend.images import make_derivatives
+
+
+def _derivatives(data: bytes, display_max: int = 64):
+    return make_derivatives(data, display_max=display_max, thumb_max=16, output_format='webp',
+                            display_quality=80, thumb_quality=70, max_pixels=10_000_000)
+
+
+def _encode(frames, **kwargs) -> bytes:
+    output = io.BytesIO()
+    frames[0].save(output, **kwargs)
+    return output.getvalue()
+
+
+def test_animated_gif_keeps_original_for_display():
+    frames = [Image.new('RGB', (200, 100), color) for color in ('red', 'blue')]
+    data = _encode(frames, format='GIF', save_all=True, append_images=frames[1:], duration=100, loop=0)
+
+    result = _derivatives(data)
+
+    assert result['valid']
+    assert (result['width'], result['height']) == (200, 100)
+    assert result['display'] is None
+    assert result['thumb'] is not None
+
+
+def test_static_image_gets_display_copy():
+    data = _encode([Image.new('RGB', (200, 100), 'red')], format='PNG')
+
+    result = _derivatives(data)
+
+    assert result['valid']
+    assert result['display'] is not None
+    with Image.open(io.BytesIO(result['display'])) as display:
+        assert max(display.size) == 64
@@ -0,0 +1,70 @@
+import json
+import uuid
+
+import pytest
+
+from backend.serialization import dumps
+from backend.services import ChatService
+
+
+@pytest.fixture
+def session(client):
+    """新的会话，写入 web 与 maimai 交替的 7 条消息"""
+    session_id = uuid.uuid4().hex
+    for index in range(7):
+        sender = 'web' if index % 2 == 0 else 'maimai'
+        response = client.post('/send_message', params={'session_id': session_id},
+                               json={'from_user': sender, 'text': f'消息 {index} "引号"'})
+        assert response.status_code == 200
+    return session_id
+
+
+@pytest.fixture
+def history(client, session):
+    return client.get('/messages', params={'session_id': session, 'limit': 100}).json()
+
+
+def test_dumps_outputs_compact_utf8():
+    payload = [{"id": 1, "text": "你好 \"世界\"", "image_b64": ""}]
+
+    data = dumps(payload)
+
+    assert isinstance(data, bytes)
+    assert json.loads(data) == payload
+    assert '你好'.encode('utf-8') in data
+
+
+def test_row_dicts_match_message_response(session, history):
+    models = ChatService.get_messages(session)
+
+    assert [model.model_dump() for model in models] == history
+    assert [message['text'] for message in history] == [f'消息 {index} "引号"' for index in range(7)]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 500])
+def test_stream_is_one_json_array_across_chunks(session, history, chunk_size):
+    upper_id = history[-1]['id']
+
+    data = b''.join(ChatService.iter_messages_json(session, 0, upper_id, chunk_size))
+
+    assert json.loads(data) == history
+
+
+def test_stream_respects_range_and_excluded_sender(session, history):
+    after_id, upper_id = history[0]['id'], history[5]['id']
+
+    data = b''.join(ChatService.iter_messages_json(session, after_id, upper_id, 2, exclude_from_user='maimai'))
+
+    assert json.loads(data) == [m for m in history[1:6] if m['from_user'] != 'maimai']
+
+
+def test_stream_of_empty_range_is_empty_array(session, history):
+    assert b''.join(ChatService.iter_messages_json(session, history[-1]['id'], history[-1]['id'])) == b'[]'
+
+
+def test_streamed_and_paged_responses_agree(client, session, history):
+    streamed = client.get('/messages', params={'session_id': session, 'after_id': history[1]['id']})
+
+    assert streamed.json() == history[2:]
+    assert streamed.headers['X-Next-Cursor'] == str(history[-1]['id'])
+    assert streamed.headers['X-Has-More'] == 'false'
@@ -0,0 +1,130 @@
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from backend import ratelimit
+from backend.config import config
+from backend.ratelimit import ConcurrencyLimiter, TokenBucketLimiter, admission, check_send_rate
+from backend.services import ChatService
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """启用限流：客户端最多突发 3 条，每个会话最多突发 1 条，测试期间几乎不补充令牌"""
+    monkeypatch.setattr(config, 'rate_limit_enabled', True)
+    monkeypatch.setattr(ratelimit, 'client_limiter', TokenBucketLimiter(rate=0.001, burst=3))
+    monkeypatch.setattr(ratelimit, 'session_limiter', TokenBucketLimiter(rate=0.001, burst=1))
+
+
+def test_bucket_allows_burst_then_reports_wait():
+    limiter = TokenBucketLimiter(rate=2, burst=2)
+
+    assert limiter.acquire('k') == 0
+    assert limiter.acquire('k') == 0
+    assert limiter.acquire('k') == pytest.approx(0.5, abs=0.01)
+
+
+def test_oversized_request_passes_when_bucket_is_full():
+    limiter = TokenBucketLimiter(rate=1, burst=5)
+
+    assert limiter.acquire('k', cost=8) == 0
+    # 令牌记为负数，需要等待补足到 1 个
+    assert limiter.acquire('k') == pytest.approx(4, abs=0.01)
+
+
+def test_refund_is_capped_at_burst():
+    limiter = TokenBucketLimiter(rate=0.001, burst=2)
+    limiter.acquire('k')
+
+    limiter.refund('k', 5)
+
+    assert limiter.acquire('k', 2) == 0
+    assert limiter.acquire('k') > 0
+
+
+def test_session_rejection_refunds_client_tokens(limits):
+    check_send_rate('client', {'s': 1})
+    with pytest.raises(HTTPException) as rejected:
+        check_send_rate('client', {'s': 1})
+    assert rejected.value.status_code == 429
+
+    # 被拒绝的请求没有消耗客户端配额：还能再发送 2 条
+    check_send_rate('client', {'t': 1})
+    check_send_rate('client', {'u': 1})
+    with pytest.raises(HTTPException):
+        check_send_rate('client', {'v': 1})
+
+
+def test_batch_rejection_refunds_earlier_sessions(limits):
+    check_send_rate('client', {'busy': 1})
+    with pytest.raises(HTTPException):
+        check_send_rate('client', {'idle': 1, 'busy': 1})
+
+    check_send_rate('other-client', {'idle': 1})
+
+
+def test_exempt_clients_skip_client_limit(limits, monkeypatch):
+    monkeypatch.setattr(config, 'rate_limit_exempt_clients', ('adapter',))
+
+    for index in range(5):
+        check_send_rate('adapter', {f's{index}': 1})
+
+
+def test_rejected_send_returns_429_and_stores_nothing(client, limits):
+    session_id = uuid.uuid4().hex
+    message = {'from_user': 'web', 'text': 'hello'}
+
+    assert client.post('/send_message', params={'session_id': session_id}, json=message).status_code == 200
+    response = client.post('/send_message', params={'session_id': session_id}, json=message)
+
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert len(ChatService.get_messages(session_id)) == 1
+
+
+def test_concurrency_limiter_rejects_over_limit():
+    limiter = ConcurrencyLimiter(1)
+
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release()
+    assert limiter.try_acquire()
+
+
+@pytest.fixture
+def one_slot(monkeypatch):
+    """并发上限为 1"""
+    monkeypatch.setattr(admission, 'limit', admission.active + 1)
+
+
+def test_full_admission_rejects_but_not_long_poll(client, one_slot):
+    assert admission.try_acquire()
+    try:
+        rejected = client.get('/messages', params={'limit': 1})
+        feed = client.get('/messages/wait')
+    finally:
+        admission.release()
+
+    assert rejected.status_code == 429
+    assert 'Retry-After' in rejected.headers
+    assert feed.status_code == 200
+    assert client.get('/messages', params={'limit': 1}).status_code == 200
+
+
+def test_streaming_response_holds_slot_until_body_is_sent(client, monkeypatch):
+    active = []
+
+    def chunks(*args, **kwargs):
+        yield b'['
+        active.append(admission.active)
+        yield b']'
+
+    baseline = admission.active
+    monkeypatch.setattr(ChatService, 'iter_messages_json', staticmethod(chunks))
+
+    response = client.get('/messages', params={'session_id': uuid.uuid4().hex})
+
+    assert response.json() == []
+    assert active == [baseline + 1]
+    assert admission.active == baseline
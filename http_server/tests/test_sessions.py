@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend.models import ChatMessage, ChatSession, SESSION_PREVIEW_LENGTH, db, _create_session_index
+
+
+def _insert(session_id: str, text: str = '', **fields) -> int:
+    return ChatMessage.insert(session_id=session_id, from_user='web', text=text,
+                              created_at=fields.pop('created_at', datetime.now()), **fields).execute()
+
+
+def _session(session_id: str):
+    return (ChatSession
+            .select(ChatSession.message_count, ChatSession.last_message_id, ChatSession.last_preview)
+            .where(ChatSession.session_id == session_id)
+            .tuples()
+            .first())
+
+
+@pytest.fixture
+def messages(fresh_database):
+    """会话 s 中的三条消息"""
+    return [_insert('s', 'first'), _insert('s', 'second'), _insert('s', 'third')]
+
+
+def test_insert_updates_count_and_latest(messages):
+    assert _session('s') == (3, messages[-1], 'third')
+
+
+def test_preview_is_truncated_or_marks_images(fresh_database):
+    _insert('long', 'x' * (SESSION_PREVIEW_LENGTH + 20))
+    _insert('image', image_hash='0' * 64)
+
+    assert _session('long')[2] == 'x' * SESSION_PREVIEW_LENGTH
+    assert _session('image')[2] == '[图片]'
+
+
+def test_inserting_older_id_only_counts(messages):
+    # 拆分分片等场景下可能先写入较新的消息
+    ChatMessage.delete().where(ChatMessage.id == messages[0]).execute()
+    _insert('s', 'restored', id=messages[0])
+
+    assert _session('s') == (3, messages[-1], 'third')
+
+
+def test_deleting_latest_falls_back_to_previous(messages):
+    ChatMessage.delete().where(ChatMessage.id == messages[-1]).execute()
+
+    assert _session('s') == (2, messages[1], 'second')
+
+
+def test_deleting_older_message_keeps_latest(messages):
+    ChatMessage.delete().where(ChatMessage.id == messages[0]).execute()
+
+    assert _session('s') == (2, messages[-1], 'third')
+
+
+def test_deleting_last_message_removes_session(messages):
+    ChatMessage.delete().where(ChatMessage.session_id == 's').execute()
+
+    assert _session('s') is None
+
+
+def test_index_is_filled_from_existing_messages(messages):
+    _insert('other', 'hello')
+    db.execute_sql('DROP TRIGGER chat_sessions_ai')
+    db.execute_sql('DROP TRIGGER chat_sessions_ad')
+    ChatSession.delete().execute()
+
+    _create_session_index(db)
+
+    assert _session('s') == (3, messages[-1], 'third')
+    assert _session('other')[0] == 1
+
+
+def test_sessions_endpoint_sorts_and_pages(client, fresh_database):
+    now = datetime.now()
+    for index in range(3):
+        _insert('busy', f'busy {index}', created_at=now - timedelta(minutes=10))
+    _insert('recent', 'latest', created_at=now)
+
+    recent = client.get('/sessions', params={'sort': 'recent'}).json()
+    by_count = client.get('/sessions', params={'sort': 'count', 'limit': 1}).json()
+
+    assert [s['session_id'] for s in recent['sessions']] == ['recent', 'busy']
+    assert recent['total'] == 2
+    assert [(s['session_id'], s['message_count']) for s in by_count['sessions']] == [('busy', 3)]
@@ -0,0 +1,157 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from backend.sharding import shard_index
+
+HTTP_SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# bob 与 dave 位于分片 0，alice 位于分片 1
+BOB, DAVE, ALICE = 'bob', 'dave', 'alice'
+
+
+def _send(client, session_id: str, text: str, from_user: str = 'web'):
+    response = client.post('/send_message', params={'session_id': session_id},
+                           json={'from_user': from_user, 'text': text})
+    assert response.status_code == 200
+
+
+def _wait(client, cursor: str, **params):
+    response = client.get('/messages/wait', params={'after_id': cursor, 'timeout': 0, **params})
+    assert response.status_code == 200
+    return response.json()
+
+
+def _rows(path: str, sql: str):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def test_session_names_cover_both_shards():
+    assert [shard_index(name, 2) for name in (BOB, DAVE, ALICE)] == [0, 0, 1]
+
+
+def test_messages_are_written_to_owning_shard(client, sharded):
+    _send(client, BOB, 'hi from bob')
+    _send(client, ALICE, 'hi from alice')
+    _send(client, DAVE, 'hi from dave')
+
+    assert _rows(sharded[0].database, 'SELECT id, session_id FROM chat_messages') == [(1, BOB), (2, DAVE)]
+    assert _rows(sharded[1].database, 'SELECT id, session_id FROM chat_messages') == [(1, ALICE)]
+    assert [m['text'] for m in client.get('/messages', params={'session_id': ALICE}).json()] == ['hi from alice']
+    sessions = client.get('/sessions').json()['sessions']
+    assert sorted(session['session_id'] for session in sessions) == [ALICE, BOB, DAVE]
+
+
+def test_wait_feed_keeps_one_cursor_per_shard(client, sharded):
+    head = client.get('/messages/wait').json()
+    assert head['next_cursor'] == '0,0'
+
+    _send(client, BOB, 'b1')
+    _send(client, ALICE, 'a1')
+    feed = _wait(client, head['next_cursor'])
+    assert sorted((m['session_id'], m['id']) for m in feed['messages']) == [(ALICE, 1), (BOB, 1)]
+    assert feed['next_cursor'] == '1,1'
+
+    assert _wait(client, feed['next_cursor'])['messages'] == []
+    _send(client, DAVE, 'd1')
+    feed = _wait(client, feed['next_cursor'])
+    assert [(m['session_id'], m['text']) for m in feed['messages']] == [(DAVE, 'd1')]
+    assert feed['next_cursor'] == '2,1'
+
+
+def test_wait_feed_limit_and_exclusion_apply_per_shard(client, sharded):
+    for index in range(3):
+        _send(client, BOB, f'b{index}')
+    _send(client, ALICE, 'bot reply', from_user='maimai')
+
+    feed = _wait(client, '0,0', limit=2, exclude_from_user='maimai')
+
+    assert [m['text'] for m in feed['messages']] == ['b0', 'b1']
+    assert feed['has_more']
+    assert feed['next_cursor'] == '2,1'
+    feed = _wait(client, feed['next_cursor'], limit=2, exclude_from_user='maimai')
+    assert [m['text'] for m in feed['messages']] == ['b2']
+    assert not feed['has_more']
+
+
+def test_wait_feed_resets_shard_whose_cursor_is_ahead(client, sharded):
+    _send(client, BOB, 'after clear')
+    _send(client, ALICE, 'a1')
+
+    feed = _wait(client, '5,1')
+
+    assert feed['reset']
+    assert [m['text'] for m in feed['messages']] == ['after clear']
+    assert feed['next_cursor'] == '1,1'
+
+
+def test_websocket_resumes_from_session_cursor(client, sharded):
+    _send(client, BOB, 'b1')
+    _send(client, ALICE, 'a1')
+    _send(client, ALICE, 'a2')
+
+    with client.websocket_connect(f'/ws/sessions/{ALICE}?after_id=1') as websocket:
+        frame = websocket.receive_json()
+        assert [m['text'] for m in frame['messages']] == ['a2']
+        assert frame['cursor'] == 2
+
+        # 分片 0 中ID为 3 的消息不属于该会话，不会推送
+        _send(client, BOB, 'b2')
+        _send(client, BOB, 'b3')
+        _send(client, ALICE, 'a3')
+        frame = websocket.receive_json()
+        assert [(m['session_id'], m['text']) for m in frame['messages']] == [(ALICE, 'a3')]
+        assert frame['cursor'] == 3
+
+
+def _run(args, data_dir, shards: int, **kwargs):
+    env = {**os.environ, 'MAIMBOT_DATA_DIR': str(data_dir), 'MAIMBOT_DB_SHARDS': str(shards)}
+    return subprocess.run([sys.executable, *args], cwd=HTTP_SERVER_DIR, env=env,
+                          capture_output=True, text=True, timeout=60, **kwargs)
+
+
+SEED = '''
+from backend.models import initialize_database
+from backend.schemas import MessageRequest
+from backend.services import ChatService
+initialize_database()
+for index in range(12):
+    session_id = ('bob', 'alice', 'dave')[index % 3]
+    ChatService.send_message(MessageRequest(from_user='web', text=f'{session_id} message {index}'), session_id)
+'''
+
+
+def test_split_command_moves_messages_into_shards(tmp_path):
+    seeded = _run(['-c', SEED], tmp_path, shards=1)
+    assert seeded.returncode == 0, seeded.stderr
+    main = str(tmp_path / 'chat.db')
+    original = _rows(main, 'SELECT id, session_id, text FROM chat_messages ORDER BY id')
+
+    split = _run(['-m', 'backend.sharding', 'split', '--batch-size', '5'], tmp_path, shards=2)
+    assert split.returncode == 0, split.stderr
+
+    assert _rows(main, 'SELECT COUNT(*) FROM chat_messages') == [(0,)]
+    moved = []
+    for index in range(2):
+        shard = str(tmp_path / f'chat.shard{index}.db')
+        rows = _rows(shard, 'SELECT id, session_id, text FROM chat_messages ORDER BY id')
+        # 消息ID保持不变，客户端游标仍然有效
+        assert all(shard_index(session_id, 2) == index for _, session_id, _ in rows)
+        moved.extend(rows)
+        # 会话索引与全文索引由分片上的触发器生成
+        counts = dict(_rows(shard, 'SELECT session_id, message_count FROM chat_sessions'))
+        assert counts == {session_id: 4 for session_id in {row[1] for row in rows}}
+        matches = _rows(shard, "SELECT rowid FROM chat_messages_fts WHERE chat_messages_fts MATCH 'message' ORDER BY rowid")
+        assert [rowid for rowid, in matches] == [row[0] for row in rows]
+    assert sorted(moved) == original
+
+    again = _run(['-m', 'backend.sharding', 'split'], tmp_path, shards=2)
+    assert again.returncode != 0
+    assert '已有消息' in again.stderr
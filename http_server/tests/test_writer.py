@@ -0,0 +1,83 @@
+from datetime import datetime
+
+import pytest
+from peewee import IntegrityError
+
+from backend.models import ChatMessage
+from backend.writer import MessageWriter
+
+
+def _row(session_id: str, text: str, **fields):
+    return dict(session_id=session_id, from_user='web', text=text, type='text', image_b64='',
+                image_hash='', thumb_hash='', display_hash='', created_at=datetime.now(), **fields)
+
+
+def _texts(session_id: str):
+    query = ChatMessage.select(ChatMessage.text).where(ChatMessage.session_id == session_id).order_by(ChatMessage.id)
+    return [text for text, in query.tuples()]
+
+
+@pytest.fixture
+def writer(database):
+    """记录每次提交的消息数的写入队列"""
+    writer = MessageWriter(ChatMessage, max_batch_size=10, max_delay=0.3, name='test-writer')
+    writer.batches = []
+    write = writer._write
+
+    def record(batch):
+        writer.batches.append(sum(len(rows) for rows, _ in batch))
+        write(batch)
+
+    writer._write = record
+    yield writer
+    writer.stop()
+
+
+def test_groups_within_delay_share_one_commit(writer):
+    writer.start()
+    futures = [future for index in range(3)
+               for future in writer.submit([_row('writer-batch', f'{index}-a'), _row('writer-batch', f'{index}-b')])]
+
+    ids = [future.result(timeout=5) for future in futures]
+
+    assert writer.batches == [6]
+    assert ids == sorted(ids)
+    assert _texts('writer-batch') == ['0-a', '0-b', '1-a', '1-b', '2-a', '2-b']
+
+
+def test_batch_is_committed_once_max_size_is_reached(writer):
+    writer.max_batch_size = 2
+    writer.start()
+    futures = [writer.submit([_row('writer-limit', str(index))])[0] for index in range(3)]
+
+    for future in futures:
+        future.result(timeout=5)
+
+    assert writer.batches == [2, 1]
+
+
+def test_failed_row_only_rolls_back_its_savepoint(writer):
+    existing_id = writer.submit([_row('writer-savepoint', 'existing')])[0].result()
+    writer.batches.clear()
+    writer.start()
+
+    first, duplicate, last = writer.submit([
+        _row('writer-savepoint', 'first'),
+        _row('writer-savepoint', 'duplicate', id=existing_id),
+        _row('writer-savepoint', 'last'),
+    ])
+    other = writer.submit([_row('writer-savepoint', 'other group')])[0]
+
+    with pytest.raises(IntegrityError):
+        duplicate.result(timeout=5)
+    assert first.result() and last.result() and other.result()
+    assert writer.batches == [4]
+    assert _texts('writer-savepoint') == ['existing', 'first', 'last', 'other group']
+
+
+def test_submit_without_thread_writes_synchronously(writer):
+    future, = writer.submit([_row('writer-sync', 'direct')])
+
+    assert future.done()
+    assert writer.batches == [1]
+    assert _texts('writer-sync') == ['direct']